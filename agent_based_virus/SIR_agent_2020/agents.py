@@ -1,177 +1,175 @@
-import random
+from SIR_agent_2020.random_walk import RandomWalker  #RandomWalker from wolf_sheep example
 
-from mesa import Agent
 
-from SIR_agent_2020.random_walk import RandomWalker  #RandomWalker from wolf_sheep example
+def change_health(agent, health_class):
+    '''
+    Change the health of an agent in place by turning it into an instance of
+    health_class. The agent keeps its position on the grid and its place in
+    the activation order; only the scheduler's per-health buckets and the
+    grid's infected counts are updated.
+    '''
+    if agent.sick:
+        agent.model.grid.count_infected(agent.pos, -1)
+    agent.model.schedule.change_health(agent, health_class)
+    if agent.sick:
+        agent.model.grid.count_infected(agent.pos, 1)
+
+
+# The decision of an agent to whom nothing happens this step
+NOTHING = (None, False, None)
+
+
+class Person(RandomWalker):
+    '''
+    What all healths have in common. A step is a move, then a decision about
+    what happens to the agent, then carrying it out.
+
+    decide() only reads the model (and draws random numbers), so the
+    scheduler's synchronous mode can take every agent's decision against the
+    same state before applying any of them. A decision is a tuple
+    (new health class or None, leaves the model, (class, position) of a
+    newborn or None).
+    '''
+
+    __slots__ = ()
+
+    def step(self):
+        '''
+        A model step. Move, decide what happens, and make it happen.
+        '''
+        grid = self.model.grid
+        grid.move_agent(self, grid.random_neighbor(self.pos, self.moore))  #RandomWalker.random_move, inlined
+        decision = self.decide()
+        if decision != NOTHING:   #Most steps change nothing
+            self.apply(decision)
+
+    def decide(self):
+        '''
+        What happens to the agent this step, without changing anything yet.
+        '''
+        return NOTHING
+
+    def apply(self, decision):
+        '''
+        Carry out a decision: change health, leave the model, give birth.
+        '''
+        new_health, leaves, newborn = decision
+        if new_health is not None:
+            change_health(self, new_health)   #The agent changes health where it stands
+        if leaves:
+            self.model.grid._remove_agent(self.pos, self)   #Removes agent from model
+            self.model.schedule.remove(self)    #Removes agent from schedule
+        if newborn is not None:
+            health, pos = newborn
+            baby = health(pos, self.model, True)
+            self.model.grid.place_agent(baby, pos)   #places the new agent on the board
+            self.model.schedule.add(baby)    #adds the new agent to the schedule
 
 
-class Susceptible_with_mask(RandomWalker):
+class Susceptible_with_mask(Person):
     '''
     An individual who is susceptible but with mask. the infected rate will lower than normal susceptibles. This class has a fluid population with random
     chance of leaving and joining the model
     '''
-    def __init__(self, pos, model, moore):
-        super().__init__(pos, model, moore=moore)
-        self.sick = False           #Are they sick?
-        self.recovered = False      #Have they recovered?
+    __slots__ = ()
 
-    def step(self):
+    sick = False       #Are they sick?
+    recovered = False  #Have they recovered?
+
+    def decide(self):
         '''
-        A model step. Move, see if they get sick, continue.
+        See if they get sick, leave, or give birth.
         Sickness can occur if susceptible is nearby infected. Infection Rate
         is multiplied by amount of nearby infected neighbors.
         Chance to generate new susceptible if random.random() is above the
         population increase rate (alpha).
         '''
-        self.random_move()  #From RandomWalker, agent moves randomly
-        left = False
+        model = self.model
+        new_health = None
         # If there are infected people nearby, chance to become Infected
         #Chance multiplied by amount of infected agents nearby
         x, y = self.pos
-        if (x > 15 and x<35 and y>15 and y< 35):#the area with high population dencity
-            this_cell = self.model.grid.get_neighbors((x,y), moore=True, include_center = True) #Find all neighbors ()
-            infected = [obj for obj in this_cell if isinstance(obj, Infected)] #Are those neighbors infected?
-            if len(infected) > 0:   #If any neighbors are infected, do this
-                if random.random() < self.model.beta*len(infected)*1.2*0.7: #Infection chance increace since it in the high population area, multiplied by amount of infected neighbors
-                    #create new infected individual from Susceptible
-                    new_infected = Infected(self.pos, self.model, True) #If infection successful, place new infected agent there
-                    self.model.grid.place_agent(new_infected, new_infected.pos)
-                    self.model.schedule.add(new_infected)   #Adds new infected agent to schedule
-
-                    # Infect the individual
-                    self.model.grid._remove_agent(self.pos, self)   #Removes the masked susceptible agent, who has become infected
-                    self.model.schedule.remove(self)    #Removes susceptible from schedule
-                    left = True
-        else:
-            this_cell = self.model.grid.get_neighbors((x,y), moore=True, include_center = True) #Find all neighbors ()
-            infected = [obj for obj in this_cell if isinstance(obj, Infected)] #Are those neighbors infected?
-            if len(infected) > 0:   #If any neighbors are infected, do this
-                if random.random() < self.model.beta*len(infected)*0.7: #Infection chance, multiplied by amount of infected neighbors
-                    #create new infected individual from Susceptible
-                    new_infected = Infected(self.pos, self.model, True) #If infection successful, place new infected agent there
-                    self.model.grid.place_agent(new_infected, new_infected.pos)
-                    self.model.schedule.add(new_infected)   #Adds new infected agent to schedule
-
-                    # Infect the individual
-                    self.model.grid._remove_agent(self.pos, self)   #Removes the susceptible agent, who has become infected
-                    self.model.schedule.remove(self)    #Removes susceptible from schedule
-                    left = True
-
-        if (random.random() < self.model.epsilon) and not left: #Population decay rate, if random.random() less than epsilon, susceptible agent leaves model
-            self.model.grid._remove_agent(self.pos, self)   #Removes susceptible agent from model
-            self.model.schedule.remove(self)    #Removes susceptible from schedule
-
-        if random.random() < self.model.alpha:  #Population increase rate, if random.random() less than growth rate, spawn new susceptible agent in model
-            new_masked_susceptible = Susceptible_with_mask(random.choice(self.model.grid.get_neighborhood((x,y), moore=True, include_center = True)), self.model, True)
-            self.model.grid.place_agent(new_masked_susceptible, new_masked_susceptible.pos)   #places susceptible agent on model
-            self.model.schedule.add(new_masked_susceptible)    #adds susceptible agent to schedule
-
-
-class Susceptible(RandomWalker):
+        infected = model.grid.infected_nearby[x][y] #How many infected agents are in this cell and the cells around it?
+        if infected > 0:   #If any neighbors are infected, do this
+            if model.random.random() < model.beta*infected*model.infection_factor[x][y]*model.mask_factor: #Infection chance, multiplied by amount of infected neighbors and by the cell's multiplier (higher in high population density areas)
+                new_health = Infected   #The susceptible agent becomes infected
+
+        #Population decay rate, if random.random() less than epsilon, susceptible agent leaves model
+        leaves = (model.random.random() < model.epsilon*model.departure_factor[x][y]) and new_health is None
+
+        newborn = None
+        if model.random.random() < model.alpha*model.birth_factor[x][y]:  #Population increase rate, if random.random() less than growth rate, spawn new susceptible agent in model
+            newborn = (Susceptible_with_mask, model.grid.random_neighbor((x,y), moore=True))
+        return new_health, leaves, newborn
+
+
+class Susceptible(Person):
     '''
     An individual who is susceptible. This class has a fluid population with random
     chance of leaving and joining the model
     '''
 
-    def __init__(self, pos, model, moore):
-        super().__init__(pos, model, moore=moore)
-        self.sick = False           #Are they sick?
-        self.recovered = False      #Have they recovered?
+    __slots__ = ()
 
-    def step(self):
+    sick = False       #Are they sick?
+    recovered = False  #Have they recovered?
+
+    def decide(self):
         '''
-        A model step. Move, see if they get sick, continue.
+        See if they get sick, leave, or give birth.
         Sickness can occur if susceptible is nearby infected. Infection Rate
         is multiplied by amount of nearby infected neighbors.
         Chance to generate new susceptible if random.random() is above the
         population increase rate (alpha).
         '''
-        self.random_move()  #From RandomWalker, agent moves randomly
-        left = False
+        model = self.model
+        new_health = None
         # If there are infected people nearby, chance to become Infected
         #Chance multiplied by amount of infected agents nearby
         x, y = self.pos
-        if (x > 15 and x<35 and y>15 and y< 35):#the area with high population dencity
-            this_cell = self.model.grid.get_neighbors((x,y), moore=True, include_center = True) #Find all neighbors ()
-            infected = [obj for obj in this_cell if isinstance(obj, Infected)] #Are those neighbors infected?
-            if len(infected) > 0:   #If any neighbors are infected, do this
-                if random.random() < self.model.beta*len(infected)*1.2: #Infection chance increace since it in the high population area, multiplied by amount of infected neighbors
-                    #create new infected individual from Susceptible
-                    new_infected = Infected(self.pos, self.model, True) #If infection successful, place new infected agent there
-                    self.model.grid.place_agent(new_infected, new_infected.pos)
-                    self.model.schedule.add(new_infected)   #Adds new infected agent to schedule
-
-                    # Infect the individual
-                    self.model.grid._remove_agent(self.pos, self)   #Removes the susceptible agent, who has become infected
-                    self.model.schedule.remove(self)    #Removes susceptible from schedule
-                    left = True
-        else:
-            this_cell = self.model.grid.get_neighbors((x,y), moore=True, include_center = True) #Find all neighbors ()
-            infected = [obj for obj in this_cell if isinstance(obj, Infected)] #Are those neighbors infected?
-            if len(infected) > 0:   #If any neighbors are infected, do this
-                if random.random() < self.model.beta*len(infected): #Infection chance, multiplied by amount of infected neighbors
-                    #create new infected individual from Susceptible
-                    new_infected = Infected(self.pos, self.model, True) #If infection successful, place new infected agent there
-                    self.model.grid.place_agent(new_infected, new_infected.pos)
-                    self.model.schedule.add(new_infected)   #Adds new infected agent to schedule
-
-                    # Infect the individual
-                    self.model.grid._remove_agent(self.pos, self)   #Removes the susceptible agent, who has become infected
-                    self.model.schedule.remove(self)    #Removes susceptible from schedule
-                    left = True
-
-        if (random.random() < self.model.epsilon) and not left: #Population decay rate, if random.random() less than epsilon, susceptible agent leaves model
-            self.model.grid._remove_agent(self.pos, self)   #Removes susceptible agent from model
-            self.model.schedule.remove(self)    #Removes susceptible from schedule
-
-        if random.random() < self.model.alpha:  #Population increase rate, if random.random() less than growth rate, spawn new susceptible agent in model
-            new_susceptible = Susceptible(random.choice(self.model.grid.get_neighborhood((x,y), moore=True, include_center = True)), self.model, True)
-            self.model.grid.place_agent(new_susceptible, new_susceptible.pos)   #places susceptible agent on model
-            self.model.schedule.add(new_susceptible)    #adds susceptible agent to schedule
-
-class Infected(RandomWalker):
+        infected = model.grid.infected_nearby[x][y] #How many infected agents are in this cell and the cells around it?
+        if infected > 0:   #If any neighbors are infected, do this
+            if model.random.random() < model.beta*infected*model.infection_factor[x][y]: #Infection chance, multiplied by amount of infected neighbors and by the cell's multiplier (higher in high population density areas)
+                new_health = Infected   #The susceptible agent becomes infected
+
+        #Population decay rate, if random.random() less than epsilon, susceptible agent leaves model
+        leaves = (model.random.random() < model.epsilon*model.departure_factor[x][y]) and new_health is None
+
+        newborn = None
+        if model.random.random() < model.alpha*model.birth_factor[x][y]:  #Population increase rate, if random.random() less than growth rate, spawn new susceptible agent in model
+            newborn = (Susceptible, model.grid.random_neighbor((x,y), moore=True))
+        return new_health, leaves, newborn
+
+
+class Infected(Person):
     '''
     An individual who is infected. These agents have the chance of infecting susceptible agents,
     recovering, and leaving the system through our liquid population model
     '''
 
-    def __init__(self, pos, model, moore):
-        super().__init__(pos, model, moore=moore)
-        self.sick = True        #Are they sick?
-        self.recovered = False  #Have they recovered?
+    __slots__ = ()
 
-    def step(self):
+    sick = True        #Are they sick?
+    recovered = False  #Have they recovered?
+
+    def decide(self):
         '''
-        A model step. Infected agents will move randomly and have the chance to spread their infection.
-        Infected agents also have a chance of recovering, as well as leaving the system.
+        Infected agents have a chance of recovering, as well as leaving the system.
+        They spread their infection by being counted in the grid's infected counts.
         '''
-        self.random_move()  #From RandomWalker, agent moves randomly
-        left = False
+        model = self.model
+        new_health = None
 
         x, y = self.pos
-        if (x > 15 and x<35 and y>15 and y< 35):#the area with high population dencity
-            if random.random() < self.model.gamma*1.25:  #If random.random() less than recovery rate (gamma), agent will become recovered, the recovered rate will be little bit higher than other area
-                new_recovered = Recovered(self.pos, self.model, True)   #If recovery happens, place new recovered agent there
-                self.model.grid.place_agent(new_recovered, new_recovered.pos)   #Place recovered agent on board
-                self.model.schedule.add(new_recovered)  #Add new recovered agent to schedule
-                self.model.grid._remove_agent(self.pos, self)   #Remove infected agent from board
-                self.model.schedule.remove(self)    #Remove infected agent from schedule
-                left = True
-        else:
-            if random.random() < self.model.gamma:  #If random.random() less than recovery rate (gamma), agent will become recovered
-                new_recovered = Recovered(self.pos, self.model, True)   #If recovery happens, place new recovered agent there
-                self.model.grid.place_agent(new_recovered, new_recovered.pos)   #Place recovered agent on board
-                self.model.schedule.add(new_recovered)  #Add new recovered agent to schedule
-                self.model.grid._remove_agent(self.pos, self)   #Remove infected agent from board
-                self.model.schedule.remove(self)    #Remove infected agent from schedule
-                left = True
-
-        if (random.random() < (self.model.delta + self.model.epsilon)) and not left: #If random.random() less than the sum of population decay rate (epsilon) and mortalty Rate (delta), agent will leave model
-            self.model.grid._remove_agent(self.pos, self)   #Removes agent from model
-            self.model.schedule.remove(self)    #Removes agent from schedule
+        if model.random.random() < model.gamma*model.recovery_factor[x][y]:  #If random.random() less than recovery rate (gamma) times the cell's multiplier (higher in high population density areas), agent will become recovered
+            new_health = Recovered   #If recovery happens, the infected agent becomes recovered
+
+        #If random.random() less than the sum of population decay rate (epsilon) and mortalty Rate (delta), agent will leave model
+        leaves = (model.random.random() < (model.delta + model.epsilon)*model.departure_factor[x][y]) and new_health is None
+        return new_health, leaves, None
 
 
-class Recovered(RandomWalker):
+class Recovered(Person):
     '''
     An individual who is recovered. Infected agents have a chance to become Recovered.
     Recovered agents have a chance to leave the system through our liquid population model.
@@ -179,33 +177,27 @@ class Recovered(RandomWalker):
     agents nearby.
     '''
 
-    def __init__(self, pos, model, moore):
-        super().__init__(pos, model, moore=moore)
-        self.sick = False       #Are they sick?
-        self.recovered = True   #Have they recovered?
+    __slots__ = ()
 
-    def step(self):
+    sick = False       #Are they sick?
+    recovered = True   #Have they recovered?
+
+    def decide(self):
         '''
-        A model step. Recovered agents will move randomly.
-        Recovered agents also have a chance of becoming infected, as well as leaving the system.
+        Recovered agents have a chance of becoming infected, as well as leaving the system.
         '''
-        self.random_move() #From RandomWalker, agent moves randomly
-        left = False
-
-        if random.random() < self.model.epsilon: #If random.random() less than population decay rate (epsilon), agent will leave model
-            self.model.grid._remove_agent(self.pos, self)   #Remove agent from model
-            self.model.schedule.remove(self)    #Remove agent from schedule
-            left = True
+        model = self.model
+        new_health = None
 
         x, y = self.pos
-        this_cell = self.model.grid.get_neighbors((x,y), moore=True, include_center = True) #Find all neighbors ()
-        infected = [obj for obj in this_cell if isinstance(obj, Infected)]  #Are those neighbors infected?
-        if (len(infected) > 3) and not left:    #If 3 of those neighbors are infected, do this
-            #create new infected individual from Susceptible
-            new_infected = Infected(self.pos, self.model, True) #Creates new infected agent
-            self.model.grid.place_agent(new_infected, new_infected.pos) #Places new infected agent where recovered agent was
-            self.model.schedule.add(new_infected)   #Adds new infected agent to schedule
-
-            # Infect the individual
-            self.model.grid._remove_agent(self.pos, self)   #Removes recovered agent from model
-            self.model.schedule.remove(self)    #Removes recovered agent from schedule
+        leaves = model.random.random() < model.epsilon*model.departure_factor[x][y] #If random.random() less than population decay rate (epsilon), agent will leave model
+
+        infected = model.grid.infected_nearby[x][y]  #How many infected agents are in this cell and the cells around it?
+        if (infected > 3) and not leaves:    #If 3 of those neighbors are infected, do this
+            new_health = Infected   #The recovered agent becomes infected again
+        return new_health, leaves, None
+
+
+# Health classes by their code (the order of the time series and of the
+# vectorized engine's health array)
+HEALTH_CLASSES = (Susceptible, Susceptible_with_mask, Infected, Recovered)
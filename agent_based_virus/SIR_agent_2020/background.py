@@ -0,0 +1,299 @@
+'''
+Running the model in a background thread behind the visualization server.
+
+With the plain ModularServer every "get_step" from the browser steps the model
+inside the Tornado handler and then renders it, so each frame takes the time
+of a step plus the time of a render, and the model waits while the browser
+draws. BackgroundServer instead hands the model to a ModelRunner, which steps
+it as fast as it can in its own thread:
+
+    - the browser's Start (any get_step) lets the runner go; it pauses itself
+      once no frame has been asked for in idle_timeout seconds (Stop)
+    - when a frame has been asked for, the runner takes a sample of the
+      latest completed step (its health raster) between two steps, at most
+      frame_rate times a second; the steps in between are never drawn
+    - a get_step is answered at once with the newest sample not sent to that
+      connection yet, rendered in the Tornado thread, or with nothing if
+      there is none
+
+Every step's counts are still kept, and ChartDeltaModule sends the ones
+since the connection's previous frame, so the chart has every step without
+resending its history. Each open connection (browser tab) has its own
+cursor into the samples and counts, which are dropped only once every open
+connection has been sent them. The board is drawn by raster.HealthRasterModule; the per-agent
+CanvasGrid needs the live model and is not available here.
+
+Serve it from the agent_based_virus directory with
+
+    > python run.py --background --frame-rate 5
+'''
+
+import json
+import threading
+import time
+import traceback
+
+import tornado.escape
+from mesa.visualization.ModularVisualization import VisualizationElement
+
+from SIR_agent_2020.collector import HEALTH_LABELS
+from SIR_agent_2020.raster import ClientServer, ClientSocketHandler
+
+
+class ModelRunner:
+    '''
+    Steps a model in a daemon thread until it stops running, and hands out
+    samples of its state to the server thread, separately to each client
+    (connection) opened with open().
+    '''
+
+    def __init__(self, model, frame_rate=5.0, idle_timeout=1.0):
+        '''
+        parameters:
+            model: a model of any engine
+            frame_rate:float, most samples taken per second
+            idle_timeout:float, seconds without a request after which the runner pauses
+        '''
+        self.model = model
+        self.frame_interval = 1.0 / frame_rate
+        self.idle_timeout = idle_timeout
+        self.steps = 0            # steps taken by the runner
+        self.step_seconds = 0.0   # time spent in model.step
+        self.finished = not model.running
+        self.error = None         # traceback of an exception raised by the model
+        self._lock = threading.Lock()
+        self._go = threading.Event()
+        self._stopped = False
+        self._wanted = False
+        self._last_request = time.monotonic()
+        self._last_sample = float("-inf")
+        self._rows = [(0, self._counts())]   # (step, counts) not handed to every client yet
+        self._sample = None                  # (serial, step, raster)
+        self._cursors = {}                   # client -> (serial, step) of the last sample it got
+        self._take_sample()
+        self._thread = threading.Thread(target=self._run, name="model-runner", daemon=True)
+        self._thread.start()
+
+    def _counts(self):
+        counts = self.model.health_counts()
+        return [counts[label] for label in HEALTH_LABELS]
+
+    def _take_sample(self):
+        raster = self.model.health_raster()
+        with self._lock:
+            serial = self._sample[0] + 1 if self._sample else 1
+            self._sample = (serial, self.steps, raster)
+            self._wanted = False
+        self._last_sample = time.monotonic()
+
+    def _run(self):
+        try:
+            while True:
+                self._go.wait()
+                if self._stopped:
+                    return
+                if time.monotonic() - self._last_request > self.idle_timeout:
+                    self._go.clear()   # no one is watching: pause until the next request
+                    continue
+                start = time.perf_counter()
+                self.model.step()
+                self.step_seconds += time.perf_counter() - start
+                self.steps += 1
+                row = self._counts()
+                with self._lock:
+                    self._rows.append((self.steps, row))
+                done = not self.model.running
+                if done or (self._wanted and time.monotonic() - self._last_sample >= self.frame_interval):
+                    self._take_sample()
+                if done:
+                    self.finished = True
+                    return
+        except Exception:
+            self.error = traceback.format_exc()
+            self.finished = True
+
+    def resume(self):
+        '''
+        Ask for a sample and keep (or start) the model running.
+        '''
+        self._last_request = time.monotonic()
+        self._wanted = True
+        if not self.finished:
+            self._go.set()
+
+    def open(self, client):
+        '''
+        Start handing out samples to a client, from the counts still kept.
+        '''
+        with self._lock:
+            self._cursors.setdefault(client, (0, -1))
+
+    def close(self, client):
+        '''
+        Stop handing out samples to a client, dropping the counts only it still needed.
+        '''
+        with self._lock:
+            self._cursors.pop(client, None)
+            self._drop_sent_rows()
+
+    def _drop_sent_rows(self):
+        if self._cursors:
+            oldest = min(step for _, step in self._cursors.values())
+            self._rows = [row for row in self._rows if row[0] > oldest]
+
+    def take(self, client=None):
+        '''
+        The newest sample not handed to the client yet, as (step, raster,
+        counts), where counts is the list of (step, counts) of every step
+        since the client's previous sample; None if there is no new sample.
+        '''
+        if self.error is not None:
+            raise RuntimeError("The model failed in the runner thread:\n" + self.error)
+        with self._lock:
+            serial, last_step = self._cursors.get(client, (0, -1))
+            if self._sample is None or self._sample[0] == serial:
+                return None
+            serial, step, raster = self._sample
+            rows = [row for row in self._rows if last_step < row[0] <= step]
+            self._cursors[client] = (serial, step)
+            self._drop_sent_rows()
+        return step, raster, rows
+
+    def stop(self):
+        '''
+        Stop the thread, after the step it is taking.
+        '''
+        self._stopped = True
+        self._go.set()
+        self._thread.join()
+
+    def steps_per_second(self):
+        return self.steps / self.step_seconds if self.step_seconds else 0.0
+
+
+class LiveView:
+    '''
+    What the visualization elements read from a model, filled in from the
+    runner's samples: health_raster() and the counts since the last frame.
+    One per model, so the elements can tell a new model from a new frame.
+    '''
+
+    def __init__(self, model):
+        self.width = model.width
+        self.height = model.height
+        self.steps = 0
+        self.rows = []
+        self._raster = None
+
+    def update(self, step, raster, rows):
+        self.steps = step
+        self._raster = raster
+        self.rows = rows
+
+    def health_raster(self):
+        return self._raster
+
+
+class ChartDeltaModule(VisualizationElement):
+    '''
+    A line chart of the four health series (like ChartModule) that is sent
+    the counts of every step since the previous frame, rather than the
+    latest counts only, so no step is missing when frames skip steps.
+    '''
+
+    package_includes = ["Chart.min.js"]
+    local_includes = ["SIR_agent_2020/resources/ChartDeltaModule.js"]
+
+    def __init__(self, series, canvas_height=200, canvas_width=500):
+        '''
+        parameters:
+            series: list of {"Label", "Color"} dicts, Labels from collector.HEALTH_LABELS
+            canvas_height, canvas_width: size of the chart in pixels
+        '''
+        self.series = series
+        self.columns = [HEALTH_LABELS.index(s["Label"]) for s in series]
+        self.js_code = "elements.push(new ChartDeltaModule({}, {}, {}));".format(
+            json.dumps(series), canvas_width, canvas_height)
+
+    def render(self, view):
+        return {"steps": [step for step, _ in view.rows],
+                "values": [[counts[i] for i in self.columns] for _, counts in view.rows]}
+
+
+class BackgroundSocketHandler(ClientSocketHandler):
+    '''
+    Answers get_step with the newest sample for this connection instead of
+    stepping the model.
+    '''
+
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        if msg["type"] != "get_step":
+            return super().on_message(message)
+        runner = self.application.runner
+        runner.resume()
+        frame = self.application.render_frame(self)
+        if frame is not None:
+            self.write_message({"type": "viz_state", "data": frame})
+        elif runner.finished:
+            self.write_message({"type": "end"})
+
+
+class BackgroundServer(ClientServer):
+    '''
+    A ModularServer whose model runs in a ModelRunner (see the module docstring).
+    '''
+
+    socket_handler = (r'/ws', BackgroundSocketHandler)
+    handlers = [ClientServer.page_handler, socket_handler,
+                ClientServer.static_handler, ClientServer.local_handler]
+
+    runner = None
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model",
+                 model_params={}, frame_rate=5.0, idle_timeout=1.0):
+        '''
+        parameters:
+            frame_rate:float, most frames sampled from the model per second
+            idle_timeout:float, seconds without a request from the browser
+                after which the model pauses
+            the others as for ModularServer; the elements get a LiveView, so
+                they may only use health_raster() and the rows of counts
+        '''
+        self.frame_rate = frame_rate
+        self.idle_timeout = idle_timeout
+        super().__init__(model_cls, visualization_elements, name, model_params)
+
+    def reset_model(self):
+        if self.runner is not None:
+            self.runner.stop()
+        super().reset_model()
+        self.view = LiveView(self.model)
+        self.runner = ModelRunner(self.model, self.frame_rate, self.idle_timeout)
+        for client in self.clients:
+            self.runner.open(client)
+
+    def open_client(self, client):
+        super().open_client(client)
+        self.runner.open(client)
+
+    def close_client(self, client):
+        super().close_client(client)
+        self.runner.close(client)
+
+    def render_frame(self, client=None):
+        '''
+        The elements' render of the newest sample for a client, or None if
+        it has been sent to that client already.
+        '''
+        sample = self.runner.take(client)
+        if sample is None:
+            return None
+        self.view.update(*sample)
+        return [element.render(self.view, client) if getattr(element, "per_client", False)
+                else element.render(self.view)
+                for element in self.visualization_elements]
+
+    def render_model(self):
+        # Only asked for right after a reset, when the first sample is always new
+        return self.render_frame(self.client)
@@ -0,0 +1,353 @@
+'''
+Benchmarks for the SIR model.
+
+Run from the agent_based_virus directory, e.g.
+
+    > python -m SIR_agent_2020.benchmark suite --output bench.json
+    > python -m SIR_agent_2020.benchmark suite --baseline bench.json --threshold 0.1
+    > python -m SIR_agent_2020.benchmark churn --populations 1000 5000 20000
+    > python -m SIR_agent_2020.benchmark movement --grids 50 500
+
+The suite runs every combination of population, grid size, mask fraction and
+churn rates, each in its own process so peak memory is measured per case, and
+writes the results as JSON. Given a baseline JSON file it exits with an error
+when any case got slower than the threshold allows. Bytes per agent come
+from tracemalloc on separate builds of the same model, in another process, so
+tracing neither slows the timed run nor adds to its peak memory.
+'''
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from mesa.space import MultiGrid
+
+from SIR_agent_2020.engines import make_model, close_model
+from SIR_agent_2020.model import SIR
+from SIR_agent_2020.agents import HEALTH_CLASSES
+
+
+# Rates (in percent, like the model parameters) for each churn level
+CHURN_RATES = {"none": {"epsilon": 0, "alpha": 0, "delta": 0},
+               "low": {"epsilon": 2, "alpha": 2, "delta": 1},
+               "high": {"epsilon": 30, "alpha": 35, "delta": 10}}
+
+DEFAULT_MATRIX = {"population": [1000, 10000, 100000],
+                  "grid": [50, 200, 1000],
+                  "mask_fraction": [0.0, 0.5],
+                  "churn": ["low", "high"]}
+
+
+def churn_benchmark(populations, steps=10, seed=0):
+    '''
+    Time SIR.step on churn-heavy runs (high alpha/epsilon/delta) so every step
+    adds and removes a large share of the agents.
+    Parameters:
+        populations: iterable of int, total starting population of each run
+        steps:int, number of steps timed for each run
+        seed:int, seed of every run
+    Returns a list of dicts, one per population, with the timing results.
+    '''
+    results = []
+    for population in populations:
+        # Births balance departures so the population stays roughly constant
+        model = SIR(initial_susceptible=population // 2,
+                    initial_infected=max(1, population // 100),
+                    initial_recovered=0,
+                    initial_susceptible_with_mask=population // 2,
+                    gamma=10, beta=1, epsilon=30, alpha=35, delta=10,
+                    height=100, width=100, seed=seed)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+        elapsed = time.perf_counter() - start
+        results.append({"population": population,
+                        "final_population": model.schedule.get_agent_count(),
+                        "steps": steps,
+                        "seconds_per_step": elapsed / steps,
+                        "steps_per_sec": steps / elapsed})
+    return results
+
+
+def _mesa_moves(model):
+    '''
+    Move every agent the way RandomWalker.random_move used to: build the
+    neighborhood list, pick from it, and move with mesa's move_agent.
+    '''
+    grid = model.grid
+    for agent in model.schedule.agents:
+        next_moves = grid.get_neighborhood(agent.pos, agent.moore, True)
+        MultiGrid.move_agent(grid, agent, model.random.choice(next_moves))
+
+
+def _agent_moves(model):
+    '''
+    Move every agent with its own random_move (precomputed neighborhoods).
+    '''
+    for agent in model.schedule.agents:
+        agent.random_move()
+
+
+def _batched_moves(model):
+    '''
+    Move every agent with one batched pass per health.
+    '''
+    for health in HEALTH_CLASSES:
+        model.schedule.move_health(health)
+
+
+MOVERS = {"mesa": _mesa_moves, "table": _agent_moves, "batched": _batched_moves}
+
+
+def movement_benchmark(grids=(50, 500), population=10000, passes=10, seed=0):
+    '''
+    Time moving every agent once, the mesa way (neighborhood list per move)
+    against the precomputed neighborhood tables, one agent at a time and in
+    batched passes per health.
+    Parameters:
+        grids: iterable of int, side of each (square) board
+        population:int, agents on the board (a tenth of them infected)
+        passes:int, number of times every agent is moved
+        seed:int, seed of every model
+    Returns a list of dicts, one per grid and way of moving.
+    '''
+    results = []
+    for grid in grids:
+        baseline = None
+        for name, mover in MOVERS.items():
+            model = SIR(initial_susceptible=population * 9 // 20,
+                        initial_susceptible_with_mask=population * 9 // 20,
+                        initial_infected=population // 10, initial_recovered=0,
+                        gamma=0, beta=0, epsilon=0, alpha=0, delta=0,
+                        height=grid, width=grid, seed=seed)
+            start = time.perf_counter()
+            for _ in range(passes):
+                mover(model)
+            elapsed = time.perf_counter() - start
+            moves_per_sec = passes * model.schedule.get_agent_count() / elapsed
+            baseline = baseline or moves_per_sec
+            results.append({"grid": grid, "population": population, "mover": name,
+                            "moves_per_sec": moves_per_sec, "speedup": moves_per_sec / baseline})
+    return results
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # kilobytes on Linux
+
+
+def _traced_bytes(case, params):
+    '''
+    Bytes allocated (and still held) by building a model, as seen by tracemalloc.
+    '''
+    tracemalloc.start()
+    model = make_model(case["engine"], seed=case["seed"], **params)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    population = sum(model.health_counts().values())
+    close_model(model)
+    return size, population
+
+
+def bytes_per_agent(case):
+    '''
+    Memory per agent of a case: the model's allocations minus those of the
+    same model with an empty board, over the number of agents. Builds the
+    model twice, so run it in a process of its own rather than run_case's.
+    '''
+    params = case_params(case)
+    empty = dict(params, initial_susceptible=0, initial_infected=0,
+                 initial_recovered=0, initial_susceptible_with_mask=0)
+    board_bytes, _ = _traced_bytes(case, empty)
+    model_bytes, population = _traced_bytes(case, params)
+    return max(0, model_bytes - board_bytes) / max(1, population)
+
+
+def case_params(case):
+    '''
+    Model parameters of one benchmark case.
+    '''
+    population, mask_fraction = case["population"], case["mask_fraction"]
+    infected = max(1, population // 100)
+    masked = int(round((population - infected) * mask_fraction))
+    params = dict(initial_susceptible=population - infected - masked,
+                  initial_infected=infected,
+                  initial_recovered=0,
+                  initial_susceptible_with_mask=masked,
+                  gamma=10, beta=5,
+                  height=case["grid"], width=case["grid"])
+    params.update(CHURN_RATES[case["churn"]])
+    return params
+
+
+def run_case(case):
+    '''
+    Build and step one case, returning its measurements. Meant to run in a
+    fresh worker process so the peak RSS belongs to this case alone.
+    '''
+    params = case_params(case)
+
+    start = time.perf_counter()
+    model = make_model(case["engine"], seed=case["seed"], **params)
+    build_seconds = time.perf_counter() - start
+
+    agent_updates = 0
+    steps = 0
+    start = time.perf_counter()
+    while steps < case["steps"]:
+        agent_updates += sum(model.health_counts().values())
+        model.step()
+        steps += 1
+    seconds = time.perf_counter() - start
+    final_population = sum(model.health_counts().values())
+    close_model(model)
+
+    result = dict(case)
+    result.update({"build_seconds": build_seconds,
+                   "seconds": seconds,
+                   "steps_per_sec": steps / seconds,
+                   "agent_updates_per_sec": agent_updates / seconds,
+                   "final_population": final_population,
+                   "peak_rss_bytes": _peak_rss_bytes()})
+    return result
+
+
+def case_key(case):
+    '''
+    Identifies a case across result files.
+    '''
+    return (case["engine"], case["population"], case["grid"], case["mask_fraction"], case["churn"])
+
+
+def run_suite(matrix=DEFAULT_MATRIX, engine="agent", steps=10, seed=0, max_population=None):
+    '''
+    Run every combination of the matrix, each case in its own process.
+    Parameters:
+        matrix: dict with lists of population, grid, mask_fraction and churn values
+        engine:str, engine name from engines.ENGINES
+        steps:int, steps timed per case
+        seed:int, seed of every case, or None for a fresh seed per case
+        max_population:int, skip cases with more agents than this
+    Returns the list of case results.
+    '''
+    names = ["population", "grid", "mask_fraction", "churn"]
+    results = []
+    for values in itertools.product(*(matrix[name] for name in names)):
+        case = dict(zip(names, values), engine=engine, steps=steps, seed=seed)
+        if max_population is not None and case["population"] > max_population:
+            continue
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_case, case).result()
+        # In a process of its own too, so the traced builds stay out of the peak RSS above
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result["bytes_per_agent"] = pool.submit(bytes_per_agent, case).result()
+        print("{engine} pop={population} grid={grid} mask={mask_fraction} churn={churn}: "
+              "{steps_per_sec:.2f} steps/s, {agent_updates_per_sec:.0f} updates/s, "
+              "{bytes_per_agent:.0f} B/agent".format(**result), flush=True)
+        results.append(result)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(results, baseline, threshold):
+    '''
+    Cases whose steps/sec fell by more than threshold (a fraction) compared to
+    the same case in baseline. Returns a list of (key, baseline, current).
+    '''
+    before = {case_key(case): case["steps_per_sec"] for case in baseline}
+    slower = []
+    for case in results:
+        key = case_key(case)
+        if key in before and case["steps_per_sec"] < before[key] * (1 - threshold):
+            slower.append((key, before[key], case["steps_per_sec"]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the SIR model.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    churn = commands.add_parser("churn", help="scheduler churn micro-benchmark")
+    churn.add_argument("--populations", type=int, nargs="+", default=[1000, 5000, 20000])
+    churn.add_argument("--steps", type=int, default=10)
+    churn.add_argument("--seed", type=int, default=0)
+
+    movement = commands.add_parser("movement", help="agent movement micro-benchmark")
+    movement.add_argument("--grids", type=int, nargs="+", default=[50, 500])
+    movement.add_argument("--population", type=int, default=10000)
+    movement.add_argument("--passes", type=int, default=10)
+    movement.add_argument("--seed", type=int, default=0)
+
+    suite = commands.add_parser("suite", help="population/grid/mask/churn scaling matrix")
+    suite.add_argument("--engine", default="agent")
+    suite.add_argument("--populations", type=int, nargs="+", default=DEFAULT_MATRIX["population"])
+    suite.add_argument("--grids", type=int, nargs="+", default=DEFAULT_MATRIX["grid"])
+    suite.add_argument("--mask-fractions", type=float, nargs="+", default=DEFAULT_MATRIX["mask_fraction"])
+    suite.add_argument("--churn", nargs="+", choices=sorted(CHURN_RATES), default=DEFAULT_MATRIX["churn"])
+    suite.add_argument("--steps", type=int, default=10)
+    suite.add_argument("--seed", type=int, default=0, help="seed of every case (fixed so runs compare)")
+    suite.add_argument("--unseeded", action="store_true", help="use a fresh seed per case instead")
+    suite.add_argument("--max-population", type=int, default=None)
+    suite.add_argument("--output", help="JSON file to write the results to")
+    suite.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    suite.add_argument("--threshold", type=float, default=0.1,
+                       help="allowed fractional drop in steps/sec before failing")
+    args = parser.parse_args(argv)
+
+    if args.command == "churn":
+        print("{:>12} {:>12} {:>14} {:>10}".format(
+            "population", "final", "sec/step", "steps/s"))
+        for row in churn_benchmark(args.populations, args.steps, args.seed):
+            print("{population:>12} {final_population:>12} "
+                  "{seconds_per_step:>14.4f} {steps_per_sec:>10.2f}".format(**row))
+        return
+
+    if args.command == "movement":
+        print("{:>8} {:>12} {:>10} {:>14} {:>8}".format(
+            "grid", "population", "mover", "moves/s", "speedup"))
+        for row in movement_benchmark(args.grids, args.population, args.passes, args.seed):
+            print("{grid:>8} {population:>12} {mover:>10} "
+                  "{moves_per_sec:>14.0f} {speedup:>8.2f}".format(**row))
+        return
+
+    matrix = {"population": args.populations, "grid": args.grids,
+              "mask_fraction": args.mask_fractions, "churn": args.churn}
+    seed = None if args.unseeded else args.seed
+    results = run_suite(matrix, args.engine, args.steps, seed, args.max_population)
+    report = {"commit": _git_commit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        slower = regressions(results, baseline, args.threshold)
+        for key, before, after in slower:
+            print("REGRESSION {}: {:.2f} -> {:.2f} steps/s".format(key, before, after))
+        if slower:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+'''
+Approximate Bayesian calibration of the model's rates against observed curves.
+
+calibrate() fits any model parameters (by default beta, gamma, delta and
+mask_factor) to an observed time series with ABC-SMC (sequential Monte Carlo
+approximate Bayesian computation, Toni et al. 2009, with Beaumont et al.'s
+2009 adaptive kernel): a population of parameter sets, the particles, is
+drawn from uniform priors, and every generation draws a new population near
+the previous one, keeping the particles whose simulated curves come within a
+shrinking threshold of the observed ones. The threshold of each generation
+is a quantile of the previous generation's distances, so the simulations
+concentrate on ever more plausible parameters.
+
+The distance between a run and the observations is the root mean squared
+difference of the compared series (Infected and Recovered by default) over
+all observed steps. Workers add up the squared differences step by step as
+the run goes and abort it as soon as the sum is past what the threshold
+allows. The sum only grows, so an aborted run would have been rejected anyway
+and the posterior is the same as without aborting; only the steps are saved.
+
+Particles are proposed in the main process and simulated in batches on a
+process pool. Results are folded in proposal order and every simulation's
+seed is the substream of the calibration seed keyed by its generation and
+number, so the result depends on the seed only, not on the number of workers.
+
+Run from the agent_based_virus directory, e.g.
+
+    > python -m SIR_agent_2020.calibration scenario.json observed.csv posterior.csv --particles 200
+
+where scenario.json holds the fixed model parameters as for run_headless.py's
+--config and observed.csv holds one row per step with a column per compared
+series (the .csv output of run_headless.py is one). Row 0 is compared with
+the initial state, row t with the state after t steps.
+'''
+
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from SIR_agent_2020.engines import open_model
+from SIR_agent_2020.rng import substream_seed
+from SIR_agent_2020.sweep import model_params
+
+
+# Uniform priors, (low, high), of the parameters fitted by default; rates in percent
+DEFAULT_PRIORS = {"beta": (0.0, 30.0),
+                  "gamma": (0.0, 30.0),
+                  "delta": (0.0, 10.0),
+                  "mask_factor": (0.0, 1.0)}
+
+DEFAULT_SERIES = ("Infected", "Recovered")
+
+
+def load_observed(path, series=DEFAULT_SERIES):
+    '''
+    The observed series from a CSV file with a header row, as a
+    (steps + 1, len(series)) float array.
+    '''
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    missing = [label for label in series if rows and label not in rows[0]]
+    if not rows or missing:
+        raise ValueError("{} has no rows or lacks the columns {}".format(path, ", ".join(missing)))
+    return np.array([[float(row[label]) for label in series] for row in rows])
+
+
+def simulate(task):
+    '''
+    Run one model against the observations, aborting once it cannot come
+    within threshold of them. Runs in a worker process.
+    task: (number, seed, params, engine, observed, series, threshold)
+    Returns (number, distance, steps run, aborted). The distance of an aborted
+    run is the part added up so far, already above threshold.
+    '''
+    number, seed, params, engine, observed, series, threshold = task
+    with open_model(engine, seed=seed, **params) as model:
+        steps = len(observed) - 1
+        budget = threshold ** 2 * observed.size   # largest sum of squares within threshold
+
+        def current():
+            counts = model.health_counts()
+            return np.array([counts[label] for label in series], dtype=float)
+
+        counts = current()
+        total = float(((counts - observed[0]) ** 2).sum())
+        step = 0
+        aborted = False
+        while step < steps:
+            if total > budget:
+                aborted = True
+                break
+            if not model.running:
+                # No one infected: the counts stay as they are for the remaining steps
+                total += float(((observed[step + 1:] - counts) ** 2).sum())
+                break
+            model.step()
+            step += 1
+            counts = current()
+            total += float(((counts - observed[step]) ** 2).sum())
+    return number, float(np.sqrt(total / observed.size)), step, aborted
+
+
+class _Generation:
+    '''
+    Counters of one generation, for the report.
+    '''
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.simulations = 0
+        self.accepted = 0
+        self.aborted = 0
+        self.steps_run = 0
+        self.steps_saved = 0   # steps aborted runs did not take
+        self.cut_short = False # stopped at the simulation limit before filling up
+
+    def report(self):
+        return {"threshold": self.threshold,
+                "simulations": self.simulations,
+                "accepted": self.accepted,
+                "acceptance_rate": self.accepted / self.simulations if self.simulations else 0.0,
+                "aborted": self.aborted,
+                "steps_run": self.steps_run,
+                "steps_saved": self.steps_saved,
+                "cut_short": self.cut_short}
+
+
+def _kernel_density(points, particles, weights, scale):
+    '''
+    Density at each point of the mixture of Gaussian kernels (per-parameter
+    scale) centred on the weighted particles, up to a constant factor.
+    '''
+    z = (points[:, None, :] - particles[None, :, :]) / scale
+    return np.exp(-0.5 * (z ** 2).sum(axis=2)) @ weights
+
+
+def calibrate(scenario, observed, priors=None, series=DEFAULT_SERIES, particles=100,
+              generations=5, quantile=0.5, min_acceptance=0.01, engine="agent",
+              seed=0, workers=None, batch_size=None, progress=None):
+    '''
+    Fit model parameters to observed curves with ABC-SMC.
+    Parameters:
+        scenario: dict, fixed model parameters (filled in with sweep.DEFAULT_PARAMS)
+        observed: (steps + 1, len(series)) array of the observed series, or a CSV file of them
+        priors: dict, parameter -> (low, high) of its uniform prior (default DEFAULT_PRIORS)
+        series: labels of the compared series, in the order of observed's columns
+        particles:int, accepted parameter sets per generation
+        generations:int, most generations, the first drawn from the priors
+        quantile:float, each threshold is this quantile of the previous generation's distances
+        min_acceptance:float, stop once a generation accepts fewer of its simulations
+            than this: a generation is given up after particles / min_acceptance
+            simulations, and the calibration ends with the previous one
+        engine:str, engine name from engines.ENGINES
+        seed:int, calibration seed; proposals and simulations use its substreams
+        workers:int, number of worker processes (default: one per CPU)
+        batch_size:int, most simulations handed to the pool at once
+            (default: the number of particles still missing); with the seed it decides
+            the result, so keep it when comparing runs
+        progress: callable, called with the report of every finished generation
+    Returns a dict with "parameters" (names), "samples" (particles x parameters
+    array of the last generation), "weights" (summing to 1), "distances",
+    "mean" and "std" (weighted, per parameter), "generations" (one report per
+    generation: threshold, simulations, accepted, acceptance_rate, aborted,
+    steps_run, steps_saved, cut_short), "simulations" and "steps_saved" (over
+    all generations), "steps_saved_fraction" (of the steps all simulations
+    would have taken without aborting) and "cut_short" (whether the last
+    generation was given up at the simulation limit; the samples are then
+    those of the generation before it).
+    '''
+    priors = dict(DEFAULT_PRIORS if priors is None else priors)
+    names = sorted(priors)
+    low = np.array([priors[name][0] for name in names], dtype=float)
+    high = np.array([priors[name][1] for name in names], dtype=float)
+    if not (low < high).all():
+        raise ValueError("Every prior needs low < high")
+    if isinstance(observed, str):
+        observed = load_observed(observed, series)
+    observed = np.asarray(observed, dtype=float).reshape(len(observed), len(series))
+    workers = workers or os.cpu_count() or 1
+    steps = len(observed) - 1
+    # Simulations a generation may take before its acceptance rate is surely below min_acceptance
+    limit = int(np.ceil(particles / min_acceptance)) if min_acceptance > 0 else np.inf
+
+    reports = []
+    samples = weights = distances = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for generation in range(generations):
+            threshold = np.inf if generation == 0 else float(np.quantile(distances, quantile))
+            counters = _Generation(threshold)
+            rng = np.random.default_rng(substream_seed(seed, generation))
+            if generation > 0:
+                # Beaumont et al.: Gaussian kernel with twice the weighted variance
+                mean = weights @ samples
+                scale = np.sqrt(2 * (weights @ (samples - mean) ** 2))
+                scale = np.where(scale > 0, scale, 1e-6 * (high - low))
+
+            def propose(count):
+                if generation == 0:
+                    return rng.uniform(low, high, size=(count, len(names)))
+                proposals = np.empty((0, len(names)))
+                while len(proposals) < count:   # redraw the ones outside the priors
+                    picked = samples[rng.choice(len(samples), size=count, p=weights)]
+                    moved = picked + rng.normal(0.0, scale, size=picked.shape)
+                    inside = ((low <= moved) & (moved <= high)).all(axis=1)
+                    proposals = np.concatenate([proposals, moved[inside]])
+                return proposals[:count]
+
+            accepted, accepted_distances = [], []
+            while len(accepted) < particles:
+                if generation > 0 and counters.simulations >= limit:
+                    counters.cut_short = True
+                    break
+                missing = particles - len(accepted)
+                count = batch_size or missing
+                if generation > 0:
+                    count = int(min(count, limit - counters.simulations))
+                proposals = propose(count)
+                first = counters.simulations
+                tasks = [(first + i, substream_seed(seed, generation, first + i),
+                          model_params(dict(scenario, **dict(zip(names, proposal.tolist())))),
+                          engine, observed, series, threshold)
+                         for i, proposal in enumerate(proposals)]
+                chunksize = max(1, len(tasks) // (4 * workers))
+                # map returns in proposal order, so which particles are kept does not depend on timing
+                for (number, distance, steps_run, aborted), proposal in zip(
+                        pool.map(simulate, tasks, chunksize=chunksize), proposals):
+                    counters.simulations += 1
+                    counters.steps_run += steps_run
+                    if aborted:
+                        counters.aborted += 1
+                        counters.steps_saved += steps - steps_run
+                    if distance <= threshold and len(accepted) < particles:
+                        accepted.append(proposal)
+                        accepted_distances.append(distance)
+                counters.accepted = len(accepted)
+
+            if counters.cut_short:
+                # Keep the last full generation as the result
+                report = counters.report()
+                reports.append(report)
+                if progress is not None:
+                    progress(report)
+                break
+            accepted = np.array(accepted)
+            if generation == 0:
+                new_weights = np.ones(len(accepted))
+            else:
+                # Uniform priors: the weight is 1 over the proposal density
+                new_weights = 1.0 / _kernel_density(accepted, samples, weights, scale)
+            samples = accepted
+            weights = new_weights / new_weights.sum()
+            distances = np.array(accepted_distances)
+            report = counters.report()
+            reports.append(report)
+            if progress is not None:
+                progress(report)
+
+    mean = weights @ samples
+    simulations = sum(report["simulations"] for report in reports)
+    steps_saved = sum(report["steps_saved"] for report in reports)
+    return {"parameters": names,
+            "samples": samples,
+            "weights": weights,
+            "distances": distances,
+            "mean": mean,
+            "std": np.sqrt(weights @ (samples - mean) ** 2),
+            "generations": reports,
+            "simulations": simulations,
+            "steps_saved": steps_saved,
+            "steps_saved_fraction": steps_saved / (simulations * steps) if simulations and steps else 0.0,
+            "cut_short": reports[-1]["cut_short"]}
+
+
+def write_posterior(result, path):
+    '''
+    Write the last generation of calibrate as CSV, one row per particle.
+    '''
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(result["parameters"] + ["weight", "distance"])
+        for sample, weight, distance in zip(result["samples"].tolist(), result["weights"].tolist(),
+                                            result["distances"].tolist()):
+            writer.writerow([round(value, 6) for value in sample] + [weight, round(distance, 6)])
+
+
+def _print_generation(report):
+    print("threshold {:>10.3f}  {:>6} simulations  {:>6.1%} accepted  {:>6} aborted  "
+          "{:>8} steps saved{}".format(report["threshold"], report["simulations"],
+                                        report["acceptance_rate"], report["aborted"],
+                                        report["steps_saved"],
+                                        "  (cut short, acceptance too low)" if report["cut_short"] else ""),
+          flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit model parameters to observed curves with ABC-SMC.")
+    parser.add_argument("scenario", help="JSON file of the fixed model parameters")
+    parser.add_argument("observed", help="CSV file of the observed series, one row per step")
+    parser.add_argument("output", help="CSV file for the posterior particles")
+    parser.add_argument("--prior", nargs=3, action="append", metavar=("NAME", "LOW", "HIGH"),
+                        help="uniform prior of a fitted parameter (repeat for each); "
+                             "default beta, gamma, delta and mask_factor")
+    parser.add_argument("--series", nargs="+", default=list(DEFAULT_SERIES),
+                        help="compared series (columns of the observed file)")
+    parser.add_argument("--particles", type=int, default=100)
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--quantile", type=float, default=0.5,
+                        help="quantile of the previous distances used as the next threshold")
+    parser.add_argument("--min-acceptance", type=float, default=0.01,
+                        help="give up a generation after particles / this many simulations")
+    parser.add_argument("--engine", default="agent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+    priors = None
+    if args.prior:
+        priors = {name: (float(low), float(high)) for name, low, high in args.prior}
+    result = calibrate(scenario, args.observed, priors, tuple(args.series), args.particles,
+                       args.generations, args.quantile, args.min_acceptance, args.engine,
+                       args.seed, args.workers, progress=_print_generation)
+    write_posterior(result, args.output)
+    if result["cut_short"]:
+        print("Stopped: the last generation accepted too few simulations; the posterior is the one before it")
+    for name, mean, std in zip(result["parameters"], result["mean"], result["std"]):
+        print("{:<12} {:>10.4f} +- {:.4f}".format(name, mean, std))
+    print("{} simulations, {:.1%} of their steps saved by early abort, posterior written to {}".format(
+        result["simulations"], result["steps_saved_fraction"], args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+'''
+Checkpoints of a running SIR model.
+
+A checkpoint holds everything the model needs to carry on as if it had never
+stopped: every agent with its health, position and unique_id, the scheduler's
+activation order and per-health buckets, the step counters, the zones, the
+collected time series and the state of the random number generator. Restoring one and
+stepping on gives bit-identical results to the uninterrupted run.
+
+Checkpoints are plain NumPy arrays, kept in a dict or saved with np.savez, so
+they are compact and fast to write and read. fork() restores one checkpoint
+into several models with different rates, so a shared warm-up only has to be
+run once:
+
+    > model = SIR(..., seed=1)
+    > for _ in range(100):
+    >     model.step()
+    > children = model.fork([{"beta": 5}, {"beta": 5, "mask_fraction": 0.8}])
+'''
+
+import json
+from collections import defaultdict
+
+import numpy as np
+
+from SIR_agent_2020.agents import Susceptible, Susceptible_with_mask, HEALTH_CLASSES, change_health
+from SIR_agent_2020.collector import HealthCollector
+from SIR_agent_2020.model import SIR
+from SIR_agent_2020.zones import Zones
+
+
+# Code of each health class, as stored in a checkpoint
+HEALTH_CODES = {health: code for code, health in enumerate(HEALTH_CLASSES)}
+
+# Rates a fork can override, in percent like the SIR parameters
+RATES = ("gamma", "beta", "epsilon", "alpha", "delta")
+
+
+def snapshot(model):
+    '''
+    Capture the state of an SIR model as a dict of NumPy arrays.
+    '''
+    agents = list(model.schedule._agents) # activation order
+    index = {agent: i for i, agent in enumerate(agents)}
+
+    # Bucket order can differ from the activation order: agents that changed
+    # health went to the back of their new bucket
+    buckets = model.schedule.agents_by_health
+    bucket_codes = [HEALTH_CODES[health] for health in buckets]
+    bucket_sizes = [len(bucket) for bucket in buckets.values()]
+    bucket_order = [index[agent] for bucket in buckets.values() for agent in bucket]
+
+    params = {"initial_susceptible": model.initial_susceptible,
+              "initial_susceptible_with_mask": model.initial_susceptible_with_mask,
+              "initial_infected": model.initial_infected,
+              "initial_recovered": model.initial_recovered,
+              "height": model.height,
+              "width": model.width,
+              "verbose": model.verbose,
+              "synchronous": model.synchronous,
+              "mask_factor": model.mask_factor,
+              "seed": model.seed,
+              "steps": model.schedule.steps,
+              "time": model.schedule.time,
+              "running": model.running}
+    # Rates are stored as the model holds them (fractions), so they come back exactly
+    params.update({rate: getattr(model, rate) for rate in RATES})
+
+    return {"x": np.array([agent.pos[0] for agent in agents], dtype=np.int64),
+            "y": np.array([agent.pos[1] for agent in agents], dtype=np.int64),
+            "health": np.array([HEALTH_CODES[type(agent)] for agent in agents], dtype=np.int8),
+            "unique_id": np.array([agent.unique_id for agent in agents], dtype=np.int64).reshape(-1, 2),
+            "moore": np.array([agent.moore for agent in agents], dtype=bool),
+            "bucket_codes": np.array(bucket_codes, dtype=np.int8),
+            "bucket_sizes": np.array(bucket_sizes, dtype=np.int64),
+            "bucket_order": np.array(bucket_order, dtype=np.int64),
+            "zones": model.zones.stack(),
+            "history": model.datacollector.history(),
+            "params": np.array(json.dumps(params)),
+            **rng_arrays(model.random)}
+
+
+def rng_arrays(rng):
+    '''
+    The state of a random.Random as plain arrays: the state version, the 625
+    words of the Mersenne Twister (624 words and the position in them) and
+    the Gaussian left over from the last normalvariate pair, if any.
+    '''
+    version, words, gauss = rng.getstate()
+    return {"rng_version": np.array(version, dtype=np.int64),
+            "rng_words": np.array(words, dtype=np.uint32),
+            "rng_has_gauss": np.array(gauss is not None),
+            "rng_gauss": np.array(0.0 if gauss is None else gauss, dtype=np.float64)}
+
+
+def rng_state(state):
+    '''
+    The random.Random state stored by rng_arrays, for setstate().
+    '''
+    gauss = float(state["rng_gauss"]) if bool(state["rng_has_gauss"]) else None
+    return int(state["rng_version"]), tuple(state["rng_words"].tolist()), gauss
+
+
+def save_checkpoint(model, path):
+    '''
+    Save a snapshot of the model to path (an .npz file). model can also be a
+    snapshot already taken, which is saved as it is.
+    '''
+    np.savez(path, **(model if isinstance(model, dict) else snapshot(model)))
+
+
+def load_checkpoint(path):
+    '''
+    Read a checkpoint saved by save_checkpoint back into a dict of arrays.
+    '''
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def restore(state, output=None, flush_interval=1000):
+    '''
+    Rebuild an SIR model from a checkpoint.
+    Parameters:
+        state: dict from snapshot() or load_checkpoint(), or the path of a saved checkpoint
+        output:str, file the restored model streams its time series to; the
+            history up to the checkpoint is written to it first
+        flush_interval:int, steps of the time series held in memory between writes
+    Returns the restored model.
+    '''
+    if isinstance(state, str):
+        state = load_checkpoint(state)
+    params = json.loads(str(state["params"]))
+
+    # An empty model draws no random numbers while it is built
+    model = SIR(0, 0, 0, 0, 0, 0, 0, 0, 0,
+                height=params["height"], width=params["width"],
+                verbose=params["verbose"], seed=params["seed"], zones=Zones(*state["zones"]),
+                synchronous=params.get("synchronous", False),
+                mask_factor=params.get("mask_factor", 0.7))
+    for name in ("initial_susceptible", "initial_susceptible_with_mask",
+                 "initial_infected", "initial_recovered") + RATES:
+        setattr(model, name, params[name])
+    model.running = params["running"]
+    model.schedule.steps = params["steps"]
+    model.schedule.time = params["time"]
+    model.datacollector = HealthCollector(output, flush_interval)
+    model.datacollector.extend(state["history"])
+
+    agents = model.add_agents(list(zip(state["x"].tolist(), state["y"].tolist())),
+                              state["health"].tolist(),
+                              [tuple(unique_id) for unique_id in state["unique_id"].tolist()],
+                              state["moore"].tolist())
+
+    buckets = defaultdict(dict)
+    order = iter(state["bucket_order"].tolist())
+    for code, size in zip(state["bucket_codes"].tolist(), state["bucket_sizes"].tolist()):
+        bucket = buckets[HEALTH_CLASSES[code]]
+        for _ in range(size):
+            agent = agents[next(order)]
+            bucket[agent] = agent
+    model.schedule.agents_by_health = buckets
+
+    model.random.setstate(rng_state(state))
+    return model
+
+
+def set_mask_fraction(model, mask_fraction):
+    '''
+    Put masks on (or take them off) randomly chosen susceptible agents, in
+    place, until mask_fraction of the susceptible agents wear one.
+    '''
+    susceptible = [agent for agent in model.schedule._agents if type(agent) is Susceptible]
+    masked = [agent for agent in model.schedule._agents if type(agent) is Susceptible_with_mask]
+    target = int(round((len(susceptible) + len(masked)) * mask_fraction))
+    if target > len(masked):
+        for agent in model.random.sample(susceptible, target - len(masked)):
+            change_health(agent, Susceptible_with_mask)
+    else:
+        for agent in model.random.sample(masked, len(masked) - target):
+            change_health(agent, Susceptible)
+
+
+def fork(model, scenarios):
+    '''
+    Continue a model as several child models, one per scenario.
+    Parameters:
+        model: SIR model, or a checkpoint (dict or path) to fork from
+        scenarios: list of dicts, each overriding any of
+            gamma, beta, epsilon, alpha, delta: rates in percent, like the SIR parameters
+            mask_fraction:float, fraction of susceptible agents wearing a mask
+            mask_factor:float, infection chance of a masked agent relative to an unmasked one
+            seed:int, reseeds the child's generator; without it every child
+                carries on the parent's random stream
+            output:str, file the child streams its time series to
+    Returns the list of child models. The parent is left untouched.
+    '''
+    state = snapshot(model) if isinstance(model, SIR) else model
+    if isinstance(state, str):
+        state = load_checkpoint(state)
+    children = []
+    for scenario in scenarios:
+        unknown = set(scenario) - set(RATES) - {"mask_fraction", "mask_factor", "seed", "output"}
+        if unknown:
+            raise ValueError("Unknown scenario settings: {}".format(", ".join(sorted(unknown))))
+        child = restore(state, output=scenario.get("output"))
+        for rate in RATES:
+            if rate in scenario:
+                setattr(child, rate, scenario[rate]/100)
+        if "mask_factor" in scenario:
+            child.mask_factor = scenario["mask_factor"]
+        if "seed" in scenario:
+            child.seed = scenario["seed"]
+            child.random.seed(child.seed) # reseeds in place, the grid shares this generator
+        if "mask_fraction" in scenario:
+            set_mask_fraction(child, scenario["mask_fraction"])
+        children.append(child)
+    return children
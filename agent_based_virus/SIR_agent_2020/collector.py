@@ -0,0 +1,245 @@
+'''
+Bounded-memory collection of the health time series.
+
+Replaces mesa's DataCollector for the SIR models. Each step's four health
+counts go into a preallocated NumPy buffer. When an output file is given, the
+buffer is written out in chunks every flush_interval steps, so memory stays the
+same however long the run is. Without a file the full history is kept in
+memory, as DataCollector does, but as compact integer arrays.
+'''
+
+import collections.abc
+import glob
+import json
+import os
+
+import numpy as np
+
+
+# Names of the four health series, in column order
+HEALTH_LABELS = ("Susceptible", "Susceptible_with_mask", "Infected", "Recovered")
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet"}
+
+
+class _Series(collections.abc.Sequence):
+    '''
+    One series of a HealthCollector as a read-only sequence of ints, in
+    place of a list of DataCollector.model_vars. Looking up the latest
+    values costs the same however long the run has been; slicing or
+    iterating reads the whole history.
+    '''
+
+    def __init__(self, collector, column):
+        self._collector = collector
+        self._column = column
+
+    def __len__(self):
+        return self._collector.collected
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._collector.history()[index, self._column].tolist()
+        return int(self._collector.row(index)[self._column])
+
+    def __iter__(self):
+        return iter(self._collector.history()[:, self._column].tolist())
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class HealthCollector:
+    '''
+    Records model.health_counts() once per call to collect().
+
+    The output format follows the file extension of path:
+        .csv               a step column plus one column per series
+        .ndjson / .jsonl   one JSON object per step
+        .parquet           a directory of part-NNNNN.parquet files, one per
+                           flushed chunk (needs pyarrow or fastparquet)
+
+    model_vars and get_model_vars_dataframe() give the same view of the data
+    as mesa's DataCollector, so charts and analysis code keep working.
+    '''
+
+    def __init__(self, path=None, flush_interval=1000, labels=HEALTH_LABELS):
+        '''
+        parameters:
+            path:str, file to stream the series to, or None to keep it in memory
+            flush_interval:int, steps held in memory before they are written out
+            labels: names of the series, in the order of the buffer's columns
+        '''
+        if flush_interval < 1:
+            raise ValueError("The flush interval must be at least 1 step")
+        self.labels = tuple(labels)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._buffer = np.empty((flush_interval, len(self.labels)), dtype=np.int64)
+        self._size = 0      # rows of the buffer in use
+        self._written = 0   # rows of the buffer already written to the file
+        self._chunks = []   # full buffers kept when there is no file
+        self.collected = 0  # rows collected so far
+
+        self.format = None
+        if path is not None:
+            extension = os.path.splitext(path)[1].lower()
+            if extension not in FORMATS:
+                raise ValueError("Unsupported output {!r}, expected one of {}".format(
+                    path, ", ".join(sorted(FORMATS))))
+            self.format = FORMATS[extension]
+            self._start_file()
+
+    def _start_file(self):
+        '''
+        Create an empty output, replacing any previous run's.
+        '''
+        if self.format == "parquet":
+            try:
+                import pyarrow
+            except ImportError:
+                try:
+                    import fastparquet
+                except ImportError:
+                    raise ImportError("Parquet output needs pyarrow or fastparquet")
+            os.makedirs(self.path, exist_ok=True)
+            for part in glob.glob(os.path.join(self.path, "part-*.parquet")):
+                os.remove(part)
+        elif self.format == "csv":
+            with open(self.path, "w") as f:
+                f.write(",".join(("step",) + self.labels) + "\n")
+        else:
+            open(self.path, "w").close()
+
+    def collect(self, model):
+        '''
+        Record the current health counts of the model.
+        '''
+        if self._size == self.flush_interval:
+            self._spill()
+        counts = model.health_counts()
+        self._buffer[self._size] = [counts[label] for label in self.labels]
+        self._size += 1
+        self.collected += 1
+
+    def extend(self, rows):
+        '''
+        Record rows collected elsewhere, e.g. the history of a restored
+        checkpoint, as if they had been collected here one by one.
+        '''
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1, len(self.labels))
+        if self.path is None:
+            self._chunks.append(self._buffer[:self._size].copy())
+            self._chunks.append(rows.copy())
+            self._size = 0
+        else:
+            self.flush()
+            self._write(rows, self.collected)
+            self._size = self._written = 0
+        self.collected += len(rows)
+
+    def _spill(self):
+        '''
+        Empty the full buffer, writing it out or keeping it as a chunk.
+        '''
+        if self.path is None:
+            self._chunks.append(self._buffer.copy())
+        else:
+            self.flush()
+        self._size = 0
+        self._written = 0
+
+    def flush(self):
+        '''
+        Write the rows collected since the last flush to the output file.
+        Does nothing when there is no output file.
+        '''
+        if self.path is None or self._written == self._size:
+            return
+        rows = self._buffer[self._written:self._size]
+        self._write(rows, self.collected - len(rows))
+        self._written = self._size
+
+    def _write(self, rows, first_step):
+        '''
+        Append rows, numbered from first_step, to the output file.
+        '''
+        steps = np.arange(first_step, first_step + len(rows))
+        if self.format == "csv":
+            with open(self.path, "a") as f:
+                np.savetxt(f, np.column_stack([steps, rows]), fmt="%d", delimiter=",")
+        elif self.format == "ndjson":
+            with open(self.path, "a") as f:
+                for step, row in zip(steps.tolist(), rows.tolist()):
+                    record = {"step": step}
+                    record.update(zip(self.labels, row))
+                    f.write(json.dumps(record) + "\n")
+        else:
+            frame = self._frame(rows)
+            frame.insert(0, "step", steps)
+            parts = len(glob.glob(os.path.join(self.path, "part-*.parquet")))
+            frame.to_parquet(os.path.join(self.path, "part-{:05d}.parquet".format(parts)), index=False)
+
+    def history(self):
+        '''
+        Every collected row as a (steps, series) array. Reads the output file
+        back when the series was streamed to one.
+        '''
+        if self.path is None:
+            return np.concatenate(self._chunks + [self._buffer[:self._size]])
+        self.flush()
+        if self.format == "csv":
+            data = np.loadtxt(self.path, delimiter=",", skiprows=1, dtype=np.int64, ndmin=2)
+            return data[:, 1:].reshape(-1, len(self.labels))
+        if self.format == "ndjson":
+            with open(self.path) as f:
+                records = [json.loads(line) for line in f]
+            return np.array([[record[label] for label in self.labels] for record in records],
+                            dtype=np.int64).reshape(-1, len(self.labels))
+        import pandas as pd
+        parts = sorted(glob.glob(os.path.join(self.path, "part-*.parquet")))
+        if not parts:
+            return np.empty((0, len(self.labels)), dtype=np.int64)
+        frame = pd.concat([pd.read_parquet(part) for part in parts])
+        return frame[list(self.labels)].to_numpy(dtype=np.int64)
+
+    def row(self, index):
+        '''
+        The counts of row number index of the history (negative from the
+        end, as for a list). Rows still in the buffer, which always include
+        the latest one, are read from it; older ones from the kept chunks, or
+        from the output file.
+        '''
+        if index < 0:
+            index += self.collected
+        if not 0 <= index < self.collected:
+            raise IndexError("Row {} was not collected, there are {}".format(index, self.collected))
+        recent = index - (self.collected - self._size)
+        if recent >= 0:
+            return self._buffer[recent]
+        if self.path is not None:
+            return self.history()[index]
+        for chunk in self._chunks:
+            if index < len(chunk):
+                return chunk[index]
+            index -= len(chunk)
+
+    @property
+    def model_vars(self):
+        '''
+        Series name -> sequence of values, like DataCollector.model_vars.
+        series[-1] and other recent values are read straight from the
+        buffer; the whole series, also when it was streamed to a file, is
+        read when it is sliced or iterated.
+        '''
+        return {label: _Series(self, i) for i, label in enumerate(self.labels)}
+
+    def _frame(self, rows):
+        import pandas as pd
+        return pd.DataFrame(rows, columns=list(self.labels))
+
+    def get_model_vars_dataframe(self):
+        '''
+        Create a pandas DataFrame from the whole history, one row per step.
+        '''
+        return self._frame(self.history())
@@ -0,0 +1,512 @@
+'''
+Multi-core engine: the vectorized engine split into strips of the board.
+
+The torus is cut into vertical strips of columns, one per worker process, and
+each worker keeps the agents standing in its strip as NumPy arrays and steps
+them with the rules of vectorized.py. Within a step the workers exchange,
+through shared memory rather than pickled messages:
+
+    migrants  agents that moved out of a strip are written into a mailbox of
+              the neighboring strip, which appends them before counting
+    halos     the infected counts of each strip's first and last column, so
+              every worker can count the infected in the 3x3 neighborhood of
+              its border cells
+
+The first and last strips are neighbors, so the torus wraps around as in the
+other engines. Births and departures stay local: a newborn placed just across
+a border is handed over with the next step's migrants, which is before it
+can be counted as anyone's neighbor. The main process only sends each
+worker one small message per step and sums the counts the workers leave in
+shared memory.
+
+Each worker draws from its own random stream, so results agree with the
+vectorized engine statistically, not draw for draw
+(python -m SIR_agent_2020.engines --engines vectorized decomposed). The
+speedup over one process can be measured from the agent_based_virus
+directory, e.g.
+
+    > python -m SIR_agent_2020.decomposed --grid 2000 --workers 1 2 4 8
+'''
+
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+
+from SIR_agent_2020.collector import HealthCollector, HEALTH_LABELS
+from SIR_agent_2020.rng import new_seed, spawn_seeds
+from SIR_agent_2020.population import make_population, health_totals
+from SIR_agent_2020.zones import FACTORS, make_zones
+from SIR_agent_2020.vectorized import (VectorizedSIR, SUSCEPTIBLE, SUSCEPTIBLE_WITH_MASK,
+                                       INFECTED, RECOVERED, MOORE_OFFSETS)
+
+
+# Mailbox sides: agents sent to the strip on the left or on the right
+LEFT, RIGHT = 0, 1
+
+
+def _shared(ctx, dtype, shape):
+    '''
+    A zeroed shared memory block for an array of the given dtype and shape.
+    '''
+    return ctx.RawArray("b", max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+
+
+def _view(block, dtype, shape):
+    return np.frombuffer(block, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+class _Strip:
+    '''
+    The agents of one strip of columns, lo <= x < hi, stepped in a worker process.
+    '''
+
+    def __init__(self, index, bounds, height, rates, factors, agents, seed, shared, capacity, barrier):
+        self.index = index
+        self.workers = len(bounds) - 1
+        self.left = (index - 1) % self.workers
+        self.right = (index + 1) % self.workers
+        self.bounds = bounds
+        self.lo, self.hi = bounds[index], bounds[index + 1]
+        self.width = bounds[-1]
+        self.height = height
+        self.beta, self.gamma, self.epsilon, self.alpha, self.delta, self.mask_factor = rates
+        self.infection_factor, self.recovery_factor, self.birth_factor, self.departure_factor = factors
+        self.x, self.y, self.health = agents
+        self.rng = np.random.default_rng(seed)
+        self.capacity = capacity
+        self.barrier = barrier
+        workers = self.workers
+        self.mail = _view(shared["mail"], np.int64, (workers, 2, capacity, 3))
+        self.sent = _view(shared["sent"], np.int64, (workers, 2))
+        self.edges = _view(shared["edges"], np.int64, (workers, 2, height))
+        self.counts = _view(shared["counts"], np.int64, (workers, 4))
+
+    def _move(self, x, y):
+        offsets = MOORE_OFFSETS[self.rng.integers(0, len(MOORE_OFFSETS), size=len(x))]
+        return (x + offsets[:, 0]) % self.width, (y + offsets[:, 1]) % self.height
+
+    def _send(self):
+        '''
+        Write the agents outside the strip into this worker's mailboxes.
+        '''
+        x, y, health = self.x, self.y, self.health
+        out = (x < self.lo) | (x >= self.hi)
+        owner = np.searchsorted(self.bounds, x[out], side="right") - 1
+        if not np.isin(owner, (self.left, self.right)).all():
+            raise RuntimeError("An agent moved past a neighboring strip; strips must be at least 2 columns wide")
+        migrants = np.stack([x[out], y[out], health[out]], axis=1)
+        # With two workers the left and right neighbors are the same, and everything goes right
+        for side, neighbor in ((RIGHT, self.right), (LEFT, self.left)):
+            going = owner == neighbor
+            count = int(going.sum())
+            if count > self.capacity:
+                raise RuntimeError("{} agents left strip {} on one side, more than the mailbox capacity of {}; "
+                                   "raise mailbox_capacity".format(count, self.index, self.capacity))
+            self.mail[self.index, side, :count] = migrants[going]
+            self.sent[self.index, side] = count
+            owner = np.where(going, -1, owner)
+        keep = ~out
+        self.x, self.y, self.health = x[keep], y[keep], health[keep]
+
+    def _receive(self):
+        '''
+        Append the agents the neighbors sent into this strip.
+        '''
+        parts = [(self.left, RIGHT), (self.right, LEFT)]
+        if self.left == self.right:
+            parts = parts[:1]
+        arrivals = [self.mail[sender, side, :self.sent[sender, side]] for sender, side in parts]
+        arrivals = np.concatenate(arrivals) if arrivals else np.empty((0, 3), dtype=np.int64)
+        self.x = np.concatenate([self.x, arrivals[:, 0]])
+        self.y = np.concatenate([self.y, arrivals[:, 1]])
+        self.health = np.concatenate([self.health, arrivals[:, 2].astype(np.int8)])
+
+    def _infected_nearby(self):
+        '''
+        Infected in each cell's 3x3 neighborhood, for the strip's cells, using
+        the neighbors' border columns. Waits for every worker to publish its own.
+        '''
+        columns = self.hi - self.lo
+        sick = self.health == INFECTED
+        cells = np.bincount((self.x[sick] - self.lo) * self.height + self.y[sick],
+                            minlength=columns * self.height).reshape(columns, self.height)
+        self.edges[self.index, LEFT] = cells[0]
+        self.edges[self.index, RIGHT] = cells[-1]
+        self.barrier.wait()
+        padded = np.concatenate([self.edges[self.left, RIGHT][None], cells,
+                                 self.edges[self.right, LEFT][None]])
+        nearby = np.zeros_like(cells)
+        for dx, dy in MOORE_OFFSETS:
+            nearby += np.roll(padded[1 - dx:1 - dx + columns], dy, axis=1)
+        return nearby
+
+    def step(self):
+        '''
+        One step of the strip's agents, in lockstep with the other workers.
+        '''
+        self.x, self.y = self._move(self.x, self.y)
+        self._send()
+        self.barrier.wait() # every mailbox is written
+        self._receive()
+        nearby_cells = self._infected_nearby()
+
+        x, y, health = self.x, self.y, self.health
+        column = x - self.lo
+        n = len(health)
+        nearby = nearby_cells[column, y]
+        transition = self.rng.random(n)
+        leave = self.rng.random(n)
+        birth = self.rng.random(n)
+
+        susceptible = health == SUSCEPTIBLE
+        masked = health == SUSCEPTIBLE_WITH_MASK
+        sick = health == INFECTED
+        recovered = health == RECOVERED
+
+        # The rules of VectorizedSIR.step
+        chance = self.beta * nearby * self.infection_factor[column, y] * np.where(masked, self.mask_factor, 1.0)
+        new_infected = (susceptible | masked) & (nearby > 0) & (transition < chance)
+        departure = self.departure_factor[column, y]
+        removed = (susceptible | masked) & ~new_infected & (leave < self.epsilon * departure)
+
+        new_recovered = sick & (transition < self.gamma * self.recovery_factor[column, y])
+        removed |= sick & ~new_recovered & (leave < (self.delta + self.epsilon) * departure)
+
+        recovered_leave = recovered & (leave < self.epsilon * departure)
+        removed |= recovered_leave
+        new_infected |= recovered & ~recovered_leave & (nearby > 3)
+
+        parents = np.flatnonzero((susceptible | masked) & (birth < self.alpha * self.birth_factor[column, y]))
+        born_x, born_y = self._move(x[parents], y[parents]) # may be across the border until the next step
+        born_health = health[parents]
+
+        health = health.copy()
+        health[new_infected] = INFECTED
+        health[new_recovered] = RECOVERED
+        keep = ~removed
+        self.health = np.concatenate([health[keep], born_health])
+        self.x = np.concatenate([x[keep], born_x])
+        self.y = np.concatenate([y[keep], born_y])
+        self.counts[self.index] = np.bincount(self.health, minlength=4)
+
+    def raster(self):
+        '''
+        Agents of each health per cell, for the strip and the two columns on
+        either side of it (where newborns can be). Returns (first column, counts).
+        '''
+        first = self.lo - 2
+        columns = self.hi - self.lo + 4
+        cells = columns * self.height
+        column = (self.x - first) % self.width
+        index = self.health.astype(np.int64) * cells + column * self.height + self.y
+        return first, np.bincount(index, minlength=4 * cells).reshape(4, columns, self.height)
+
+
+def _serve(conn, barrier, *args):
+    '''
+    Worker process: build the strip, then carry out the main process's
+    commands until told to stop.
+    '''
+    try:
+        strip = _Strip(*args, barrier=barrier)
+        while True:
+            command = conn.recv()
+            if command == "step":
+                strip.step()
+                conn.send(("done", None))
+            elif command == "raster":
+                conn.send(("done", strip.raster()))
+            else:
+                break
+    except Exception:
+        barrier.abort() # release the workers waiting for this one
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class DecomposedSIR:
+    '''
+    A susceptible, infected, and recovered model with the same parameters and
+    the same time series output as SIR, stepped by several worker processes.
+    '''
+
+    height = 50 #starting height/width for the board
+    width = 50
+
+    description = 'A multi-process model for simulating sick, infected, and recovered individuals.'
+
+    def __init__(self,
+                 initial_susceptible,
+                 initial_infected,
+                 initial_recovered,
+                 initial_susceptible_with_mask,
+                 gamma,
+                 beta,
+                 epsilon,
+                 alpha,
+                 delta,
+                 height=height, width=width, verbose=False, seed=None,
+                 output=None, flush_interval=1000, zones=None, population=None,
+                 mask_factor=0.7, workers=None, mailbox_capacity=None):
+        '''
+        Create a new multi-process SIR model. Parameters are the same as for SIR.
+        parameters:
+            seed: int, seed from which the placement and every worker's random stream are derived
+            workers: int, number of worker processes (default: one per core), at most width // 2
+            mailbox_capacity: int, most agents one strip can send to a neighbor in a step
+                (default: 16 times the initial population of a column, at least 4096)
+        '''
+        self.height = height
+        self.width = width
+        self.initial_susceptible = initial_susceptible
+        self.initial_susceptible_with_mask = initial_susceptible_with_mask
+        self.initial_infected = initial_infected
+        self.initial_recovered = initial_recovered
+        self.beta = beta/100
+        self.gamma = gamma/100
+        self.epsilon = epsilon/100
+        self.alpha = alpha/100
+        self.delta = delta/100
+        self.mask_factor = mask_factor
+        self.verbose = verbose
+        self.zones = make_zones(zones, self.width, self.height)
+        self.seed = seed if seed is not None else new_seed()
+        self.steps = 0
+        # Strips at least 2 columns wide, so an agent (or a newborn, then moved) only reaches the next one
+        self.workers = max(1, min(workers or os.cpu_count() or 1, self.width // 2))
+        self._processes = []
+
+        if population is None:
+            # The same placement as VectorizedSIR with this seed
+            rng = np.random.default_rng(self.seed)
+            health = np.repeat(
+                np.array([SUSCEPTIBLE, SUSCEPTIBLE_WITH_MASK, INFECTED, RECOVERED], dtype=np.int8),
+                [initial_susceptible, initial_susceptible_with_mask, initial_infected, initial_recovered])
+            x = rng.integers(0, self.width, size=len(health))
+            y = rng.integers(0, self.height, size=len(health))
+        else:
+            x, y, health = make_population(population, self.width, self.height)
+            (self.initial_susceptible, self.initial_susceptible_with_mask,
+             self.initial_infected, self.initial_recovered) = health_totals(health)
+        self.counts = np.bincount(health, minlength=4)
+        if mailbox_capacity is None:
+            mailbox_capacity = max(4096, 16 * len(health) // self.width)
+        self.mailbox_capacity = mailbox_capacity
+
+        self.bounds = np.linspace(0, self.width, self.workers + 1).astype(np.int64)
+        self._start(x, y, health, mailbox_capacity)
+
+        self.datacollector = HealthCollector(output, flush_interval)
+
+        self.running = True
+        self.datacollector.collect(self) #stores the initial counts
+
+    def _start(self, x, y, health, capacity):
+        '''
+        Allocate the shared memory and start one worker per strip.
+        '''
+        ctx = multiprocessing.get_context()
+        workers = self.workers
+        shared = {"mail": _shared(ctx, np.int64, (workers, 2, capacity, 3)),
+                  "sent": _shared(ctx, np.int64, (workers, 2)),
+                  "edges": _shared(ctx, np.int64, (workers, 2, self.height)),
+                  "counts": _shared(ctx, np.int64, (workers, 4))}
+        self._counts = _view(shared["counts"], np.int64, (workers, 4))
+        barrier = ctx.Barrier(workers)
+        # Held for the workers' lifetime: a block freed here goes back to the
+        # multiprocessing heap and the next model's blocks would be placed over it
+        self._shared, self._barrier = shared, barrier
+        rates = (self.beta, self.gamma, self.epsilon, self.alpha, self.delta, self.mask_factor)
+        owner = np.searchsorted(self.bounds, x, side="right") - 1
+        self._conns = []
+        for index, seed in enumerate(spawn_seeds(self.seed, workers)):
+            lo, hi = self.bounds[index], self.bounds[index + 1]
+            mine = owner == index
+            factors = tuple(getattr(self.zones, name)[lo:hi] for name in FACTORS)
+            conn, child = ctx.Pipe()
+            process = ctx.Process(target=_serve, daemon=True,
+                                  args=(child, barrier, index, self.bounds, self.height, rates, factors,
+                                        (x[mine], y[mine], health[mine]), seed, shared, capacity))
+            process.start()
+            child.close()
+            self._conns.append(conn)
+            self._processes.append(process)
+
+    def _command(self, command):
+        '''
+        Send a command to every worker and return their replies, raising if any failed.
+        '''
+        for conn in self._conns:
+            conn.send(command)
+        replies, errors = [], []
+        for index, conn in enumerate(self._conns):
+            try:
+                status, value = conn.recv()
+            except EOFError:
+                status, value = "error", "the worker process exited"
+            if status == "error":
+                errors.append("worker {}: {}".format(index, value))
+            replies.append(value)
+        if errors:
+            self.close()
+            # A worker that failed first makes the others fail at the barrier; show its error first
+            errors.sort(key=lambda error: "BrokenBarrierError" in error)
+            raise RuntimeError("Decomposed step failed in " + "\n".join(errors))
+        return replies
+
+    def get_health_count(self, health):
+        '''
+        Returns the current number of agents with the given health code.
+        '''
+        return int(self.counts[health])
+
+    def spawn_seeds(self, count):
+        '''
+        Seeds of count independent random streams derived from this model's
+        seed, e.g. for replicates run in parallel.
+        '''
+        return spawn_seeds(self.seed, count)
+
+    def health_counts(self):
+        '''
+        Returns the current number of agents of each health, keyed by series name.
+        '''
+        return dict(zip(HEALTH_LABELS, self.counts.tolist()))
+
+    def step(self):
+        '''
+        Function to take one time step of our model
+        '''
+        self._command("step")
+        self.counts = self._counts.sum(axis=0)
+        self.steps += 1
+        self.datacollector.collect(self) #stores the counts after this step
+
+        if self.verbose:
+            print([self.steps] + self.counts.tolist())
+
+        if self.counts[INFECTED] == 0: #if number of infected is equal to zero, stop running
+            self.running = False
+
+    def health_raster(self):
+        '''
+        Number of agents of each health in every cell, as an array of shape
+        (4, width, height) indexed [health code][x][y].
+        '''
+        raster = np.zeros((4, self.width, self.height), dtype=np.int64)
+        for first, cells in self._command("raster"):
+            columns = (first + np.arange(cells.shape[1])) % self.width
+            np.add.at(raster, (slice(None), columns), cells)
+        return raster
+
+    def run_model(self, step_count=200, progress=None):
+        '''
+        Function for running model. Stops early when there are no more infected.
+        Parameters:
+        step_count:int, maximum number of times the function will run
+        progress: callable, called with the model after every step
+        '''
+        if self.verbose:
+            print('Initial counts: ', self.health_counts())
+
+        for _ in range(step_count):
+            self.step() #calls the step function, which records the counts
+            if progress is not None:
+                progress(self)
+            if not self.running: #stops early once no one is infected
+                break
+        self.datacollector.flush()
+
+        if self.verbose:
+            print('Final counts: ', self.health_counts())
+
+    def close(self):
+        '''
+        Stop the worker processes. The model cannot step any more afterwards.
+        '''
+        for conn in self._conns:
+            try:
+                conn.send("stop")
+            except (OSError, ValueError): # already gone
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._conns, self._processes = [], []
+        self._shared = self._barrier = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, "_processes", None):
+            self.close()
+
+
+def speedup_benchmark(grid=2000, density=1.0, steps=10, workers=(1, 2, 4), seed=0):
+    '''
+    Seconds per step of one run with each number of workers, against the
+    single-process vectorized engine.
+    Parameters:
+        grid:int, side of the (square) board
+        density:float, agents per cell
+        steps:int, steps timed (after one warm-up step)
+        workers: iterable of int, numbers of worker processes to time
+        seed:int, seed of the models
+    Returns a list of dicts, the vectorized engine first (workers 0).
+    '''
+    population = int(grid * grid * density)
+    infected = max(1, population // 100)
+    params = dict(initial_susceptible=(population - infected) // 2,
+                  initial_susceptible_with_mask=(population - infected) // 2,
+                  initial_infected=infected, initial_recovered=0,
+                  gamma=5, beta=10, epsilon=2, alpha=2, delta=1,
+                  height=grid, width=grid, seed=seed)
+    results = []
+    for count in [0] + list(workers):
+        if count:
+            model = DecomposedSIR(workers=count, **params)
+        else:
+            model = VectorizedSIR(**params)
+        model.step()
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+        seconds = (time.perf_counter() - start) / steps
+        if count:
+            model.close()
+        results.append({"workers": getattr(model, "workers", 0), "seconds_per_step": seconds,
+                        "final_infected": int(model.counts[INFECTED])})
+    for row in results:
+        row["speedup"] = results[0]["seconds_per_step"] / row["seconds_per_step"]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the speedup of the decomposed engine.")
+    parser.add_argument("--grid", type=int, default=2000)
+    parser.add_argument("--density", type=float, default=1.0, help="agents per cell")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print("{} cores available".format(os.cpu_count()))
+    for row in speedup_benchmark(args.grid, args.density, args.steps, args.workers, args.seed):
+        name = "{} workers".format(row["workers"]) if row["workers"] else "vectorized"
+        print("{:<12} {:>8.3f} s/step  speedup {:>5.2f}  infected {}".format(
+            name, row["seconds_per_step"], row["speedup"], row["final_infected"]))
+
+
+if __name__ == "__main__":
+    main()
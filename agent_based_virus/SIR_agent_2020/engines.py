@@ -0,0 +1,164 @@
+'''
+Selecting between the interchangeable SIR engines.
+
+Every engine takes the SIR constructor parameters and exposes the same
+DataCollector series (Susceptible, Susceptible_with_mask, Infected,
+Recovered), so callers can switch engines without changing anything else.
+'''
+
+import argparse
+import contextlib
+
+import numpy as np
+
+from SIR_agent_2020.model import SIR
+from SIR_agent_2020.collector import HEALTH_LABELS
+from SIR_agent_2020.vectorized import VectorizedSIR
+from SIR_agent_2020.metapopulation import PatchSIR
+from SIR_agent_2020.decomposed import DecomposedSIR
+
+
+ENGINES = {
+    "agent": SIR,               # one mesa agent per person
+    "vectorized": VectorizedSIR,  # NumPy arrays, batched updates
+    "patch": PatchSIR,          # per-cell counts, tau-leaping
+    "decomposed": DecomposedSIR,  # the vectorized engine in strips, one worker process each
+}
+
+
+def make_model(engine="agent", seed=None, **params):
+    '''
+    Build a model with the given engine from the SIR constructor parameters.
+    Parameters:
+        engine:str, key of ENGINES
+        seed:int, seed for the engine's random numbers
+        params: keyword arguments of SIR.__init__
+    '''
+    try:
+        model_cls = ENGINES[engine]
+    except KeyError:
+        raise ValueError("Unknown engine {!r}, expected one of {}".format(
+            engine, ", ".join(ENGINES)))
+    return model_cls(seed=seed, **params)
+
+
+def close_model(model):
+    '''
+    Release what the model holds outside the process (the decomposed
+    engine's worker processes); the other engines have nothing to close.
+    '''
+    if hasattr(model, "close"):
+        model.close()
+
+
+@contextlib.contextmanager
+def open_model(engine="agent", seed=None, **params):
+    '''
+    make_model as a context manager, closing the model on the way out:
+
+        with open_model("decomposed", seed=1, **params) as model:
+            model.run_model(100)
+    '''
+    model = make_model(engine, seed=seed, **params)
+    try:
+        yield model
+    finally:
+        close_model(model)
+
+
+def _summaries(engine, params, steps, replicates, seed):
+    '''
+    Final count of every series plus peak infected, one row per replicate.
+    '''
+    rows = []
+    for replicate in range(replicates):
+        with open_model(engine, seed=seed + replicate, **params) as model:
+            model.run_model(steps)
+            series = model.datacollector.model_vars
+        rows.append([series[label][-1] for label in HEALTH_LABELS] + [max(series["Infected"])])
+    return np.array(rows, dtype=float)
+
+
+def compare_engines(params, steps=50, replicates=20, seed=0, engines=("agent", "vectorized")):
+    '''
+    Statistical equivalence check between two engines.
+
+    Runs the same scenario on both engines and compares the replicate means of
+    the final size of every series and of the infected peak with a two-sample
+    z statistic (difference of means over its standard error).
+    Returns a dict of metric -> (mean first engine, mean second engine, z).
+    '''
+    first, second = (_summaries(engine, params, steps, replicates, seed) for engine in engines)
+    metrics = ["final " + label for label in HEALTH_LABELS] + ["peak Infected"]
+    result = {}
+    for i, metric in enumerate(metrics):
+        a, b = first[:, i], second[:, i]
+        error = np.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+        z = 0.0 if error == 0 else (a.mean() - b.mean()) / error
+        result[metric] = (float(a.mean()), float(b.mean()), float(z))
+    return result
+
+
+def check_seeding(params, engine="agent", steps=50, seed=0):
+    '''
+    Check that an engine's seeded runs are reproducible: two models built
+    with the same seed and stepped in turn, in the same process, give
+    identical get_model_vars_dataframe() frames, and a model with another
+    seed gives a different one.
+    Returns a dict with "same_seed_identical" and "other_seed_differs".
+    Raises AssertionError if either does not hold.
+    '''
+    models = [make_model(engine, seed=s, **params) for s in (seed, seed, seed + 1)]
+    try:
+        # Interleaved, so models sharing a generator would drift apart
+        for _ in range(steps):
+            for model in models:
+                if model.running:
+                    model.step()
+        first, second, other = (model.datacollector.get_model_vars_dataframe() for model in models)
+    finally:
+        for model in models:
+            close_model(model)
+    result = {"same_seed_identical": first.equals(second),
+              "other_seed_differs": not first.equals(other)}
+    assert result["same_seed_identical"], "two {} models with seed {} differ".format(engine, seed)
+    assert result["other_seed_differs"], "{} models with seeds {} and {} agree".format(engine, seed, seed + 1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare two engines on one scenario, or check that their seeded runs are reproducible.")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=["agent", "vectorized"],
+                        help="the two engines to compare, or any number with --seeding")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--replicates", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-z", type=float, default=3.0,
+                        help="fail if any |z| is above this")
+    parser.add_argument("--seeding", action="store_true",
+                        help="instead, check that runs of each engine with the same seed are identical")
+    args = parser.parse_args(argv)
+
+    params = dict(initial_susceptible=400, initial_infected=20, initial_recovered=0,
+                  initial_susceptible_with_mask=400, gamma=5, beta=10,
+                  epsilon=2, alpha=2, delta=1)
+    if args.seeding:
+        for engine in args.engines:
+            try:
+                check_seeding(params, engine, args.steps, args.seed)
+            except AssertionError as error:
+                raise SystemExit("seeding check failed: {}".format(error))
+            print("{:<12} same seed identical, other seed differs".format(engine))
+        return
+    if len(args.engines) != 2:
+        parser.error("--engines takes two engines to compare")
+    result = compare_engines(params, args.steps, args.replicates, args.seed, args.engines)
+    for metric, (a, b, z) in result.items():
+        print("{:<30} {:>10.1f} {:>10.1f} {:>7.2f}".format(metric, a, b, z))
+    if any(abs(z) > args.max_z for _, _, z in result.values()):
+        raise SystemExit("engines differ by more than {} standard errors".format(args.max_z))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+'''
+Adaptive replicate ensembles of one scenario.
+
+Instead of guessing how many replicates a scenario needs, run_ensemble runs
+them in parallel batches and stops as soon as the confidence intervals of the
+mean curves (and of the mean peak infected) are narrower than asked, or the
+replicate budget is spent. Every finished run is folded into streaming
+statistics and dropped, so memory does not grow with the number of runs:
+
+    mean, standard deviation   Welford's running update, per step and series
+    quantile bands             the P^2 estimator (Jain and Chlamtac, 1985),
+                               five markers per quantile, step and series
+
+besides the same for the peak number of infected and for the time to
+extinction of the runs that reached it. A run that stops early (no one
+infected) keeps its last counts for the remaining steps.
+
+Batches are folded in replicate order and every replicate's seed is the
+substream of the ensemble seed keyed by its number, so the result depends on
+the seed and batch size only, not on which worker finished first.
+
+Run from the agent_based_virus directory, e.g.
+
+    > python -m SIR_agent_2020.ensemble scenario.json curves.csv --ci-width 10
+
+where scenario.json holds model parameters as for run_headless.py's --config.
+'''
+
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from SIR_agent_2020.engines import open_model
+from SIR_agent_2020.rng import substream_seed
+from SIR_agent_2020.sweep import model_params
+from SIR_agent_2020.collector import HEALTH_LABELS
+
+
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class RunningStats:
+    '''
+    Mean and variance of a stream of equally shaped arrays, one array at a
+    time (Welford's algorithm).
+    '''
+
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self._m2 = self._m2 + delta * (value - self.mean)
+
+    def std(self):
+        '''
+        Sample standard deviation (0 until there are two values).
+        '''
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self._m2 / (self.count - 1))
+
+    def ci_half_width(self, confidence=0.95):
+        '''
+        Half width of the normal confidence interval of the mean (infinite
+        until there are two values).
+        '''
+        if self.count < 2:
+            return np.full_like(self.mean, np.inf)
+        return NormalDist().inv_cdf((1 + confidence) / 2) * self.std() / np.sqrt(self.count)
+
+
+class P2Quantile:
+    '''
+    Streaming estimate of the p-quantile of every element of a stream of
+    equally shaped arrays, in constant memory (the P^2 algorithm).
+    '''
+
+    def __init__(self, p, shape=()):
+        self.p = p
+        self.count = 0
+        self._first = []                      # the first 5 values, until the markers exist
+        self._heights = None                  # (5,) + shape marker heights
+        self._positions = None                # (5,) + shape marker positions
+        self._desired = np.array([0, 2 * p, 4 * p, 2 + 2 * p, 4])
+        self._increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+        self.shape = shape
+
+    def add(self, value):
+        value = np.asarray(value, dtype=float)
+        self.count += 1
+        if self._heights is None:
+            self._first.append(value)
+            if len(self._first) == 5:
+                self._heights = np.sort(np.stack(self._first), axis=0)
+                self._positions = np.broadcast_to(
+                    np.arange(5.0).reshape((5,) + (1,) * value.ndim), self._heights.shape).copy()
+                self._first = []
+            return
+
+        q, n = self._heights, self._positions
+        q[0] = np.minimum(q[0], value)
+        q[4] = np.maximum(q[4], value)
+        # Cell k of the value (q[k] <= value < q[k + 1]); the markers above it move up one
+        k = (value >= q[1]).astype(int) + (value >= q[2]) + (value >= q[3])
+        for i in range(1, 5):
+            n[i] += k < i
+        self._desired = self._desired + self._increments
+
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            adjust = ((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))
+            if not adjust.any():
+                continue
+            d = np.where(d >= 0, 1.0, -1.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                neighbor = np.where(d > 0, q[i + 1], q[i - 1])
+                neighbor_position = np.where(d > 0, n[i + 1], n[i - 1])
+                linear = q[i] + d * (neighbor - q[i]) / (neighbor_position - n[i])
+            inside = (q[i - 1] < parabolic) & (parabolic < q[i + 1])
+            q[i] = np.where(adjust, np.where(inside, parabolic, linear), q[i])
+            n[i] = np.where(adjust, n[i] + d, n[i])
+
+    def value(self):
+        '''
+        The current estimate (exact while there are fewer than 5 values).
+        '''
+        if self._heights is not None:
+            return self._heights[2].copy()
+        if not self._first:
+            return np.full(self.shape, np.nan)
+        return np.quantile(np.stack(self._first), self.p, axis=0)
+
+
+class StreamingSummary:
+    '''
+    RunningStats plus one P2Quantile per quantile, for one quantity.
+    '''
+
+    def __init__(self, quantiles=DEFAULT_QUANTILES, shape=()):
+        self.stats = RunningStats(shape)
+        self.quantiles = [P2Quantile(p, shape) for p in quantiles]
+
+    def add(self, value):
+        self.stats.add(value)
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+    def result(self, confidence=0.95):
+        return {"count": self.stats.count,
+                "mean": self.stats.mean,
+                "std": self.stats.std(),
+                "ci_half_width": self.stats.ci_half_width(confidence),
+                "quantiles": {quantile.p: quantile.value() for quantile in self.quantiles}}
+
+
+def run_series(task):
+    '''
+    Run one replicate and return its counts. Runs in a worker process.
+    task: (replicate, seed, params, steps, engine)
+    Returns (replicate, (steps + 1, 4) array of counts, peak infected,
+    extinction step or None).
+    '''
+    replicate, seed, params, steps, engine = task
+    with open_model(engine, seed=seed, **params) as model:
+        series = np.empty((steps + 1, len(HEALTH_LABELS)), dtype=np.int64)
+        series[0] = [model.health_counts()[label] for label in HEALTH_LABELS]
+        steps_run = 0
+        while steps_run < steps and model.running:
+            model.step()
+            steps_run += 1
+            counts = model.health_counts()
+            series[steps_run] = [counts[label] for label in HEALTH_LABELS]
+    series[steps_run + 1:] = series[steps_run] # stopped early: the counts stay as they were
+    infected = series[:, HEALTH_LABELS.index("Infected")]
+    extinct = np.flatnonzero(infected[:steps_run + 1] == 0)
+    return replicate, series, int(infected.max()), int(extinct[0]) if len(extinct) else None
+
+
+def run_ensemble(params, steps=200, ci_width=10.0, relative=False, confidence=0.95,
+                 min_replicates=10, max_replicates=1000, batch_size=None,
+                 engine="agent", seed=0, workers=None, quantiles=DEFAULT_QUANTILES):
+    '''
+    Run replicates of one scenario until the mean curves are known well enough.
+    Parameters:
+        params: dict, model parameters (filled in with sweep.DEFAULT_PARAMS)
+        steps:int, steps per run
+        ci_width:float, stop once the confidence interval of every mean (each
+            series at every step, and the peak infected) is at most this wide
+        relative:bool, ci_width is a fraction of the mean (at least 1 person)
+            rather than a number of people
+        confidence:float, confidence level of the intervals
+        min_replicates:int, runs before the intervals are trusted
+        max_replicates:int, budget: stop after this many runs regardless
+        batch_size:int, runs between convergence checks (default: one per worker)
+        engine:str, engine name from engines.ENGINES
+        seed:int, ensemble seed; replicate r uses its substream keyed by r
+        workers:int, number of worker processes (default: one per CPU)
+        quantiles: iterable of float, quantile bands to estimate
+    Returns a dict with "replicates", "converged", "ci_width" (the widest
+    relative or absolute interval when it stopped), "series" (label ->
+    summary of its curve, arrays of steps + 1), "peak_infected" and
+    "extinction_step" (summaries of scalars), where a summary is
+    {"count", "mean", "std", "ci_half_width", "quantiles": {p: value}}.
+    '''
+    params = model_params(params)
+    workers = workers or os.cpu_count() or 1
+    batch_size = batch_size or workers
+    curves = StreamingSummary(quantiles, (steps + 1, len(HEALTH_LABELS)))
+    peak = StreamingSummary(quantiles)
+    extinction = StreamingSummary(quantiles)
+
+    def widest():
+        widths = [2 * curves.stats.ci_half_width(confidence), 2 * peak.stats.ci_half_width(confidence)]
+        if relative:
+            widths = [width / np.maximum(np.abs(stats.mean), 1.0)
+                      for width, stats in zip(widths, (curves.stats, peak.stats))]
+        return max(float(np.max(width)) for width in widths)
+
+    started = 0
+    width = np.inf
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while started < max_replicates:
+            batch = range(started, min(started + batch_size, max_replicates))
+            tasks = [(replicate, substream_seed(seed, replicate), params, steps, engine)
+                     for replicate in batch]
+            started = batch.stop
+            # map returns in replicate order, so the P^2 markers do not depend on timing
+            for _, series, peak_infected, extinction_step in pool.map(run_series, tasks):
+                curves.add(series)
+                peak.add(peak_infected)
+                if extinction_step is not None:
+                    extinction.add(extinction_step)
+            width = widest()
+            if started >= min_replicates and width <= ci_width:
+                break
+
+    summary = curves.result(confidence)
+    series = {label: {"count": summary["count"],
+                      "mean": summary["mean"][:, i],
+                      "std": summary["std"][:, i],
+                      "ci_half_width": summary["ci_half_width"][:, i],
+                      "quantiles": {p: value[:, i] for p, value in summary["quantiles"].items()}}
+              for i, label in enumerate(HEALTH_LABELS)}
+    return {"replicates": started,
+            "converged": started >= min_replicates and width <= ci_width,
+            "ci_width": width,
+            "series": series,
+            "peak_infected": peak.result(confidence),
+            "extinction_step": extinction.result(confidence)}
+
+
+def write_curves(result, path):
+    '''
+    Write the summarized curves of run_ensemble as CSV, one row per step.
+    '''
+    quantiles = sorted(result["series"][HEALTH_LABELS[0]]["quantiles"])
+    columns = ["mean", "ci_half_width"] + ["q{:g}".format(100 * p) for p in quantiles]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["step"] + ["{}_{}".format(label, column)
+                                    for label in HEALTH_LABELS for column in columns])
+        for step in range(len(result["series"][HEALTH_LABELS[0]]["mean"])):
+            row = [step]
+            for label in HEALTH_LABELS:
+                summary = result["series"][label]
+                row += [round(float(summary["mean"][step]), 3), round(float(summary["ci_half_width"][step]), 3)]
+                row += [round(float(summary["quantiles"][p][step]), 3) for p in quantiles]
+            writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run replicates of a scenario until its mean curves converge.")
+    parser.add_argument("scenario", help="JSON file of model parameters")
+    parser.add_argument("output", help="CSV file for the mean and quantile curves")
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--ci-width", type=float, default=10.0,
+                        help="widest confidence interval of any mean to stop at")
+    parser.add_argument("--relative", action="store_true",
+                        help="--ci-width is a fraction of the mean instead of people")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--min-replicates", type=int, default=10)
+    parser.add_argument("--max-replicates", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--engine", default="agent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.scenario) as f:
+        params = json.load(f)
+    result = run_ensemble(params, args.steps, args.ci_width, args.relative, args.confidence,
+                          args.min_replicates, args.max_replicates, args.batch_size,
+                          args.engine, args.seed, args.workers)
+    write_curves(result, args.output)
+    peak = result["peak_infected"]
+    print("{} replicates, {}converged (widest interval {:.3g}), peak infected {:.1f} +- {:.1f}".format(
+        result["replicates"], "" if result["converged"] else "not ", result["ci_width"],
+        float(peak["mean"]), float(peak["ci_half_width"])))
+    print("curves written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
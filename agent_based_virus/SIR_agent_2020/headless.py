@@ -0,0 +1,188 @@
+'''
+Command-line runner for the SIR model, without the visualization server.
+
+Builds one model from command-line options and/or a JSON config file, runs it
+until the step limit or until no one is infected, streams the time series to a
+file and every few seconds prints the throughput and the live counts. Run from
+the agent_based_virus directory, e.g.
+
+    > python run_headless.py --beta 10 --gamma 5 --steps 500 --seed 1 --output run.csv
+    > python run_headless.py --config scenario.json --report-interval 30
+
+where scenario.json holds any of the options below, with underscores:
+
+    {"initial_infected": 20, "beta": 10, "height": 200, "width": 200, "steps": 1000}
+
+Options given on the command line take precedence over the config file.
+'''
+
+import argparse
+import json
+import sys
+import time
+
+from SIR_agent_2020.engines import ENGINES, make_model
+from SIR_agent_2020.sweep import DEFAULT_PARAMS, model_params
+from SIR_agent_2020.collector import HEALTH_LABELS
+from SIR_agent_2020.profiling import format_report
+from SIR_agent_2020.trajectory import TrajectoryRecorder
+
+
+# Settings of the run itself, as opposed to the model parameters
+RUN_DEFAULTS = {"steps": 200,
+                "seed": None,
+                "engine": "agent",
+                "output": "timeseries.csv",
+                "flush_interval": 1000,
+                "report_interval": 5.0,
+                "profile": False,
+                "trajectory": None,
+                "record_interval": 1}
+
+SHORT_LABELS = dict(zip(HEALTH_LABELS, ("S", "M", "I", "R")))
+
+
+class ProgressReporter:
+    '''
+    Passed as run_model's progress callback: prints the steps per second and
+    the current counts at most once every interval seconds.
+    '''
+
+    def __init__(self, interval=5.0, stream=sys.stdout):
+        self.interval = interval
+        self.stream = stream
+        self.start = self.last = time.perf_counter()
+        self.steps = self.last_steps = 0
+
+    def __call__(self, model):
+        self.steps += 1
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.report(model, (self.steps - self.last_steps) / (now - self.last))
+            self.last, self.last_steps = now, self.steps
+
+    def report(self, model, steps_per_sec):
+        counts = model.health_counts()
+        print("step {:>7}  {:>9.2f} steps/s  ".format(self.steps, steps_per_sec)
+              + "  ".join("{}={}".format(SHORT_LABELS[label], counts[label]) for label in HEALTH_LABELS),
+              file=self.stream, flush=True)
+
+    def finish(self, model):
+        '''
+        Report the whole run: average steps per second and final counts.
+        '''
+        elapsed = time.perf_counter() - self.start
+        self.report(model, self.steps / elapsed if elapsed > 0 else 0.0)
+        return elapsed
+
+
+def settings_from(args, config=None):
+    '''
+    Merge the defaults, a config dict and the options given on the command
+    line (those not left as None), in that order of precedence.
+    Returns (model parameters, run settings).
+    '''
+    settings = dict(DEFAULT_PARAMS, **RUN_DEFAULTS)
+    settings.update(config or {})
+    settings.update({name: value for name, value in vars(args).items()
+                     if value is not None and name != "config"})
+    unknown = set(settings) - set(DEFAULT_PARAMS) - set(RUN_DEFAULTS) - {"mask_fraction", "mask_factor", "zones", "population"}
+    if unknown:
+        raise ValueError("Unknown settings: {}".format(", ".join(sorted(unknown))))
+    run = {name: settings.pop(name) for name in RUN_DEFAULTS}
+    return model_params(settings), run
+
+
+def run(params, steps=200, seed=None, engine="agent", output="timeseries.csv",
+        flush_interval=1000, report_interval=5.0, profile=False, trajectory=None,
+        record_interval=1, stream=sys.stdout):
+    '''
+    Build a model and run it, printing progress to stream.
+    Parameters:
+        params: dict, model parameters (rates in percent)
+        steps:int, maximum number of steps; stops earlier once no one is infected
+        seed:int, seed of the model; a fresh one is drawn (and printed) if None
+        engine:str, engine name from engines.ENGINES
+        output:str, .csv/.ndjson/.parquet file for the time series
+        flush_interval:int, steps of the time series held in memory between writes
+        report_interval:float, seconds between progress lines
+        profile:bool, time every phase of the steps and print where the time went
+        trajectory:str, directory to record every agent's position and health to (see trajectory.py)
+        record_interval:int, steps between recorded frames
+    Returns the finished model.
+    '''
+    model = make_model(engine, seed=seed, output=output,
+                       flush_interval=flush_interval, **params)
+    if profile and not hasattr(model, "enable_profiling"):
+        raise ValueError("The {} engine cannot be profiled".format(engine))
+    profiler = model.enable_profiling() if profile else None
+    recorder = None
+    if trajectory is not None:
+        recorder = TrajectoryRecorder(trajectory, model, record_interval) # records the initial state
+    print("{} engine, seed {}, {} agents on {}x{}".format(
+        engine, model.seed, sum(model.health_counts().values()), params["width"], params["height"]),
+        file=stream, flush=True)
+    progress = ProgressReporter(report_interval, stream)
+    def callback(model):
+        progress(model)
+        if recorder is not None:
+            recorder(model)
+    model.run_model(steps, progress=callback)
+    elapsed = progress.finish(model)
+    print("{} steps in {:.1f}s{}, time series written to {}".format(
+        progress.steps, elapsed, "" if model.running else " (no infected left)", output),
+        file=stream, flush=True)
+    if recorder is not None:
+        recorder.close()
+        print("{} frames recorded to {} in {:.1f}s".format(recorder.frames, trajectory, recorder.elapsed),
+              file=stream, flush=True)
+    if profiler is not None:
+        print(format_report(profiler.run_report()), file=stream, flush=True)
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the SIR model without the visualization.")
+    parser.add_argument("--config", help="JSON file of settings; command-line options override it")
+    parser.add_argument("--initial-susceptible", type=int)
+    parser.add_argument("--initial-susceptible-with-mask", type=int)
+    parser.add_argument("--initial-infected", type=int)
+    parser.add_argument("--initial-recovered", type=int)
+    parser.add_argument("--mask-fraction", type=float,
+                        help="share of the initial susceptible population wearing a mask")
+    parser.add_argument("--mask-factor", type=float,
+                        help="infection chance of a masked person relative to an unmasked one (default 0.7)")
+    for rate, meaning in (("gamma", "recovery rate"), ("beta", "infection rate"),
+                          ("epsilon", "removal rate"), ("alpha", "entry rate"), ("delta", "death rate")):
+        parser.add_argument("--" + rate, type=float, help=meaning + ", in percent")
+    parser.add_argument("--zones", help=".npy, .npz or image file of per-cell rate multipliers (see zones.py)")
+    parser.add_argument("--population", help=".npy or .npz file of the initial agents, replacing the "
+                                             "initial counts (see population.py)")
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--steps", type=int, help="maximum number of steps (default 200)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--engine", choices=sorted(ENGINES))
+    parser.add_argument("--output", help=".csv, .ndjson or .parquet file (default timeseries.csv)")
+    parser.add_argument("--flush-interval", type=int)
+    parser.add_argument("--report-interval", type=float, help="seconds between progress lines")
+    parser.add_argument("--profile", action="store_true", default=None,
+                        help="time every phase of the steps and print where the time went")
+    parser.add_argument("--trajectory", help="directory to record every agent's position and health "
+                                             "to, for replay (see trajectory.py)")
+    parser.add_argument("--record-interval", type=int, help="steps between recorded frames (default 1)")
+    args = parser.parse_args(argv)
+
+    config = None
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    try:
+        params, settings = settings_from(args, config)
+        run(params, **settings)
+    except ValueError as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    main()
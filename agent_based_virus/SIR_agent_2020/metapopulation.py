@@ -0,0 +1,236 @@
+'''
+Patch-based (metapopulation) SIR engine.
+
+Every cell of the torus is a compartment holding counts of susceptible,
+masked susceptible, infected and recovered people instead of individual
+agents. Each step draws, per cell and health, how many people do each thing
+(tau-leaping with a leap of one step), so the cost depends on the size of
+the board and hardly on the number of people: 10^7 people on a 1000x1000
+board take about 1.5 seconds per step. With only a few people per cell the
+vectorized engine is faster.
+
+The rules are those of the vectorized engine, applied to counts:
+    - everyone moves to one of the 9 cells of their Moore neighborhood
+      (staying is one of them), each with probability 1/9
+    - susceptible people are infected with probability beta * infected nearby,
+      times the cell's infection multiplier (zones.py) and mask_factor for masked
+      people; those not infected leave with probability epsilon
+    - infected people recover with probability gamma (times the cell's
+      recovery multiplier); those not recovered leave with probability
+      delta + epsilon
+    - recovered people leave with probability epsilon; the rest are infected
+      again where more than 3 infected are nearby
+    - each susceptible person (masked or not) gives birth with probability
+      alpha to one of their own kind, in a random cell of their neighborhood
+    - departure and birth probabilities are scaled by the cell's multipliers too
+It records the same four series as the other engines, so its results can be
+compared directly against them (python -m SIR_agent_2020.engines --engines agent patch).
+'''
+
+import numpy as np
+
+from SIR_agent_2020.collector import HealthCollector, HEALTH_LABELS
+from SIR_agent_2020.rng import new_seed, spawn_seeds
+from SIR_agent_2020.population import make_population, health_totals
+from SIR_agent_2020.zones import make_zones
+from SIR_agent_2020.vectorized import INFECTED, MOORE_OFFSETS
+
+
+class PatchSIR:
+    '''
+    A susceptible, infected, and recovered model with the same parameters and
+    the same time series output as SIR, stored as per-cell counts.
+    '''
+
+    height = 50 #starting height/width for the board
+    width = 50
+
+    description = 'A patch-based model for simulating sick, infected, and recovered populations.'
+
+    def __init__(self,
+                 initial_susceptible,
+                 initial_infected,
+                 initial_recovered,
+                 initial_susceptible_with_mask,
+                 gamma,
+                 beta,
+                 epsilon,
+                 alpha,
+                 delta,
+                 height=height, width=width, verbose=False, seed=None,
+                 output=None, flush_interval=1000, zones=None, population=None,
+                 mask_factor=0.7):
+        '''
+        Create a new patch-based SIR model. Parameters are the same as for SIR.
+        parameters:
+            seed: int, seed for the model's numpy random generator (drawn if not given)
+        '''
+        self.height = height
+        self.width = width
+        self.initial_susceptible = initial_susceptible
+        self.initial_susceptible_with_mask = initial_susceptible_with_mask
+        self.initial_infected = initial_infected
+        self.initial_recovered = initial_recovered
+        self.beta = beta/100
+        self.gamma = gamma/100
+        self.epsilon = epsilon/100
+        self.alpha = alpha/100
+        self.delta = delta/100
+        self.mask_factor = mask_factor
+        self.verbose = verbose
+        self.zones = make_zones(zones, self.width, self.height)
+        self.infection_factor = self.zones.infection # indexed [x, y]
+        self.recovery_factor = self.zones.recovery
+        self.birth_factor = self.zones.birth
+        self.departure_factor = self.zones.departure
+        self.seed = seed if seed is not None else new_seed()
+        self.rng = np.random.default_rng(self.seed)
+        self.steps = 0
+
+        cells = self.width * self.height
+        if population is None:
+            # Everyone starts in a uniformly random cell, like the other engines
+            uniform = np.full(cells, 1 / cells)
+            self.cells = np.stack([self.rng.multinomial(n, uniform).reshape(self.width, self.height)
+                                   for n in (initial_susceptible, initial_susceptible_with_mask,
+                                             initial_infected, initial_recovered)])
+        else:
+            x, y, health = make_population(population, self.width, self.height)
+            (self.initial_susceptible, self.initial_susceptible_with_mask,
+             self.initial_infected, self.initial_recovered) = health_totals(health)
+            index = health.astype(np.int64) * cells + x * self.height + y
+            self.cells = np.bincount(index, minlength=4 * cells).reshape(4, self.width, self.height)
+        self._count()
+
+        self.datacollector = HealthCollector(output, flush_interval)
+
+        self.running = True
+        self.datacollector.collect(self) #stores the initial counts
+
+    def _count(self):
+        '''
+        Recount the number of people of each health.
+        '''
+        self.counts = self.cells.sum(axis=(1, 2))
+
+    def get_health_count(self, health):
+        '''
+        Returns the current number of people with the given health code.
+        '''
+        return int(self.counts[health])
+
+    def spawn_seeds(self, count):
+        '''
+        Seeds of count independent random streams derived from this model's
+        seed, e.g. for replicates run in parallel.
+        '''
+        return spawn_seeds(self.seed, count)
+
+    def health_counts(self):
+        '''
+        Returns the current number of people of each health, keyed by series name.
+        '''
+        return dict(zip(HEALTH_LABELS, self.counts.tolist()))
+
+    def _diffuse(self, cells):
+        '''
+        Send the people in each cell to the 9 cells of its Moore neighborhood,
+        each equally likely. Splits the counts one direction at a time with
+        binomial draws (a multinomial split) so memory stays a few boards, and
+        only draws for the cells that have anyone in them.
+        '''
+        occupied = np.flatnonzero(cells)
+        remaining = cells.ravel()[occupied]
+        moved = np.zeros_like(cells)
+        part = np.zeros_like(cells)
+        for i, (dx, dy) in enumerate(MOORE_OFFSETS):
+            if i == len(MOORE_OFFSETS) - 1:
+                going = remaining
+            else:
+                going = self.rng.binomial(remaining, 1 / (len(MOORE_OFFSETS) - i))
+                remaining = remaining - going
+            part.ravel()[occupied] = going
+            moved += np.roll(part, (dx, dy), axis=(-2, -1))
+        return moved
+
+    def infected_nearby(self):
+        '''
+        Number of infected people in each cell's 3x3 neighborhood on the torus,
+        as a (width, height) array.
+        '''
+        sick = self.cells[INFECTED]
+        nearby = np.zeros_like(sick)
+        for dx, dy in MOORE_OFFSETS:
+            nearby += np.roll(sick, (dx, dy), axis=(0, 1))
+        return nearby
+
+    def step(self):
+        '''
+        Function to take one time step of our model
+        '''
+        self.cells = self._diffuse(self.cells)
+        susceptible, masked, sick, recovered = self.cells
+        nearby = self.infected_nearby()
+        binomial = self.rng.binomial
+
+        # Susceptible (masked or not): infection, then departure unless infected
+        chance = self.beta * nearby * self.infection_factor
+        infected_s = binomial(susceptible, np.minimum(chance, 1.0))
+        infected_m = binomial(masked, np.minimum(chance * self.mask_factor, 1.0))
+        leaving = np.minimum(self.epsilon * self.departure_factor, 1.0)
+        left_s = binomial(susceptible - infected_s, leaving)
+        left_m = binomial(masked - infected_m, leaving)
+
+        # Infected: recovery, then death or departure unless recovered
+        recovering = binomial(sick, np.minimum(self.gamma * self.recovery_factor, 1.0))
+        left_i = binomial(sick - recovering, np.minimum((self.delta + self.epsilon) * self.departure_factor, 1.0))
+
+        # Recovered: departure, then reinfection if more than 3 infected nearby
+        left_r = binomial(recovered, leaving)
+        reinfected = np.where(nearby > 3, recovered - left_r, 0)
+
+        # Susceptible people (masked or not) give birth to their own kind next to them
+        born = self._diffuse(binomial(np.stack([susceptible, masked]),
+                                      np.minimum(self.alpha * self.birth_factor, 1.0)))
+
+        self.cells = np.stack([susceptible - infected_s - left_s + born[0],
+                               masked - infected_m - left_m + born[1],
+                               sick - recovering - left_i + infected_s + infected_m + reinfected,
+                               recovered - left_r - reinfected + recovering])
+        self._count()
+        self.steps += 1
+        self.datacollector.collect(self) #stores the counts after this step
+
+        if self.verbose:
+            print([self.steps] + self.counts.tolist())
+
+        if self.counts[INFECTED] == 0: #if number of infected is equal to zero, stop running
+            self.running = False
+
+    def health_raster(self):
+        '''
+        Number of people of each health in every cell, as an array of shape
+        (4, width, height) indexed [health code][x][y].
+        '''
+        return self.cells
+
+    def run_model(self, step_count=200, progress=None):
+        '''
+        Function for running model. Stops early when there are no more infected.
+        Parameters:
+        step_count:int, maximum number of times the function will run
+        progress: callable, called with the model after every step
+        '''
+        if self.verbose:
+            print('Initial counts: ', self.health_counts())
+
+        for _ in range(step_count):
+            self.step() #calls the step function, which records the counts
+            if progress is not None:
+                progress(self)
+            if not self.running: #stops early once no one is infected
+                break
+        self.datacollector.flush()
+
+        if self.verbose:
+            print('Final counts: ', self.health_counts())
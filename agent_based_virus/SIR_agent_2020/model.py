@@ -1,11 +1,15 @@
 import random
 
+import numpy as np
 from mesa import Model
-from mesa.space import MultiGrid
-from mesa.datacollection import DataCollector
 
-from SIR_agent_2020.agents import Susceptible, Susceptible_with_mask, Infected, Recovered
+from SIR_agent_2020.rng import new_seed, spawn_seeds
+from SIR_agent_2020.collector import HealthCollector
+from SIR_agent_2020.agents import Susceptible, Susceptible_with_mask, Infected, Recovered, HEALTH_CLASSES
 from SIR_agent_2020.schedule import RandomActivationByHealth
+from SIR_agent_2020.space import HealthGrid, gc_paused
+from SIR_agent_2020.zones import make_zones
+from SIR_agent_2020.population import make_population, health_totals
 
 
 class SIR(Model):
@@ -19,6 +23,8 @@ class SIR(Model):
 
     description = 'A model for simulating sick, infected, and recovered individuals.'
 
+    profiler = None # set by enable_profiling
+
     def __init__(self,
                  initial_susceptible,
                  initial_infected,
@@ -29,7 +35,9 @@ class SIR(Model):
                  epsilon,
                  alpha,
                  delta,
-                 height=height, width=width, verbose = False):
+                 height=height, width=width, verbose = False, seed=None,
+                 output=None, flush_interval=1000, zones=None, population=None,
+                 synchronous=False, mask_factor=0.7):
         '''
         Create a new SIR model.
         parameters:
@@ -44,14 +52,24 @@ class SIR(Model):
             alpha:float, entry rate to board
             height:int, width of board
             width:int, width of board
+            seed:int, seed for the model's random number generator; all randomness
+                in the model, its agents and its scheduler comes from it. A new seed
+                is drawn (and kept in self.seed) if not given.
+            output:str, .csv/.ndjson/.parquet file the time series is streamed to; kept
+                in memory if not given
+            flush_interval:int, steps of the time series held in memory between writes
+            zones: zones.Zones, or the path of a file to load them from, with per-cell
+                multipliers of the infection, recovery, birth and departure rates; the
+                original high population density area if not given
+            population: explicit initial agents instead of initial_* placed at random:
+                (x, y, health) arrays, a (4, width, height) count raster or a file
+                holding either (see population.py)
+            synchronous:bool, let every agent decide against the same state (after
+                everyone has moved) and apply all changes at the end of the step, instead
+                of one agent at a time (see RandomActivationByHealth.step_synchronous)
+            mask_factor:float, infection chance of a masked susceptible relative to an
+                unmasked one
         '''
-        #initializing the datacolector with initial susceptible/infected/recovered
-        self.datacollector = DataCollector(
-            {"Susceptible": lambda m: initial_susceptible,
-            "Susceptible_with_mask": lambda m: initial_susceptible_with_mask,
-             "Infected": lambda m: initial_infected,
-             "Recovered": lambda m: initial_recovered})
-
         # Set starting parameters for board and rates
         self.height = height
         self.width = width
@@ -64,58 +82,71 @@ class SIR(Model):
         self.epsilon = epsilon/100
         self.alpha = alpha/100
         self.delta = delta/100
+        self.mask_factor = mask_factor
         self.verbose = verbose
+        self.synchronous = synchronous
+        self.zones = make_zones(zones, self.width, self.height)
+        # Lists of lists, looked up by the agents as [x][y]
+        factors = self.zones.lists()
+        self.infection_factor = factors["infection"]
+        self.recovery_factor = factors["recovery"]
+        self.birth_factor = factors["birth"]
+        self.departure_factor = factors["departure"]
+        self.seed = seed if seed is not None else new_seed()
+        self.random = random.Random(self.seed)
 
         #sets up grid and data collector to store values
         self.schedule = RandomActivationByHealth(self)
-        self.grid = MultiGrid(self.height, self.width, torus=True)
-        self.datacollector = DataCollector(
-            {"Susceptible": lambda m: m.schedule.get_health_count(Susceptible),
-            "Susceptible_with_mask": lambda m: m.schedule.get_health_count(Susceptible_with_mask),
-             "Infected": lambda m: m.schedule.get_health_count(Infected),
-             "Recovered": lambda m: m.schedule.get_health_count(Recovered)})
-
-        # Creates a susceptible individual:
-        for i in range(self.initial_susceptible):
-            x = random.randrange(self.width) #random x within board
-            y = random.randrange(self.height) #random y within board
-            susceptible = Susceptible((x, y), self, True) #sets location as susceptible
-            self.grid.place_agent(susceptible, (x, y)) #places agent on board
-            self.schedule.add(susceptible) #adds agent to model schedule
-
-        # Creates a musked susceptible individual:
-        for i in range(self.initial_susceptible_with_mask):
-            x = random.randrange(self.width) #random x within board
-            y = random.randrange(self.height) #random y within board
-            susceptible_with_mask = Susceptible_with_mask((x, y), self, True) #sets location as masked susceptible
-            self.grid.place_agent(susceptible_with_mask, (x, y)) #places agent on board
-            self.schedule.add(susceptible_with_mask) #adds agent to model schedule
-
-        # Creates an infected individual:
-        for i in range(self.initial_infected):
-            x = random.randrange(self.width) #random x within board
-            y = random.randrange(self.height) #random y within board
-            infected = Infected((x, y), self, True) #sets location as infected
-            self.grid.place_agent(infected, (x, y)) #places infected on board
-            self.schedule.add(infected) #adds agent to model schedule
-
-        # Creates a recovered individual:
-        for i in range(self.initial_recovered):
-            x = random.randrange(self.width) #random x within board
-            y = random.randrange(self.height) #random y within board
-            recovered = Recovered((x, y), self, True) #sets location as recovered
-            self.grid.place_agent(recovered, (x, y)) #places agent on board
-            self.schedule.add(recovered) #adds agent to model scheduler
+        self.grid = HealthGrid(self.width, self.height, torus=True, rng=self.random) #keeps per-cell infected counts for the agents' infection checks
+        self.datacollector = HealthCollector(output, flush_interval) #records health_counts() once per step
+
+        if population is None:
+            # Every agent draws its x then its y, susceptible first, then masked, infected and recovered
+            codes = ([0] * self.initial_susceptible + [1] * self.initial_susceptible_with_mask
+                     + [2] * self.initial_infected + [3] * self.initial_recovered)
+            randrange = self.random.randrange
+            positions = [(randrange(self.width), randrange(self.height)) for _ in codes]
+        else:
+            x, y, health = make_population(population, self.width, self.height)
+            (self.initial_susceptible, self.initial_susceptible_with_mask,
+             self.initial_infected, self.initial_recovered) = health_totals(health)
+            positions = list(zip(x.tolist(), y.tolist()))
+            codes = health.tolist()
+        self.add_agents(positions, codes) #places the agents on the board and adds them to the schedule
 
         self.running = True
-        self.datacollector.collect(self) #runs the lamda functions in the datacollector and stores the values
+        self.datacollector.collect(self) #stores the initial counts
+
+    def add_agents(self, positions, codes, unique_ids=None, moore=None):
+        '''
+        Create agents in bulk, put them on the grid and at the back of the
+        schedule. Gives the same model as creating, placing and scheduling
+        them one at a time.
+        Parameters:
+            positions: list of (x, y)
+            codes: list of health codes (index in HEALTH_CLASSES), one per agent
+            unique_ids: list of unique ids, the positions if not given
+            moore: list of bool, whether each agent moves diagonally; all True if not given
+        Returns the list of new agents.
+        '''
+        with gc_paused():
+            if unique_ids is None:
+                agents = [HEALTH_CLASSES[code](pos, self, True) for pos, code in zip(positions, codes)]
+            else:
+                agents = [HEALTH_CLASSES[code](unique_id, self, diagonal)
+                          for unique_id, code, diagonal in zip(unique_ids, codes, moore)]
+                for agent, pos in zip(agents, positions):
+                    agent.pos = pos
+            self.grid.place_agents(agents)
+            self.schedule.add_agents(agents)
+        return agents
 
     def step(self):
         '''
         Function to take one time step of our model
         '''
-        self.datacollector.collect(self) #runs the lamda functions in the datacollector and stores the values
-        self.schedule.step() #model takes one step
+        self.schedule.step(synchronous=self.synchronous) #model takes one step
+        self.datacollector.collect(self) #stores the counts after this step
         if self.verbose:
             print([self.schedule.time,
                    self.schedule.get_health_count(Susceptible),
@@ -126,11 +157,91 @@ class SIR(Model):
         if self.schedule.get_health_count(Infected) == 0: #if number of infected is equal to zero, stop running
             self.running = False
 
-    def run_model(self, step_count=200):
+    def spawn_seeds(self, count):
+        '''
+        Seeds of count independent random streams derived from this model's
+        seed, e.g. for replicates run in parallel.
+        '''
+        return spawn_seeds(self.seed, count)
+
+    def checkpoint(self, path=None):
+        '''
+        Snapshot of the whole model state, saved to path (.npz) if given.
+        See checkpoint.py.
+        '''
+        from SIR_agent_2020.checkpoint import snapshot, save_checkpoint
+        state = snapshot(self)
+        if path is not None:
+            save_checkpoint(state, path)
+        return state
+
+    @classmethod
+    def restore(cls, state, output=None, flush_interval=1000):
+        '''
+        Rebuild a model from a checkpoint (a snapshot or the path of a saved one),
+        ready to carry on exactly where it was taken.
+        '''
+        from SIR_agent_2020.checkpoint import restore
+        return restore(state, output, flush_interval)
+
+    def fork(self, scenarios):
+        '''
+        Continue this model as one child model per scenario, a dict of rates
+        (in percent), mask_fraction, seed and output to override.
+        '''
+        from SIR_agent_2020.checkpoint import fork
+        return fork(self, scenarios)
+
+    def health_counts(self):
+        '''
+        Returns the current number of agents of each health, keyed by series name.
+        '''
+        return {"Susceptible": self.schedule.get_health_count(Susceptible),
+                "Susceptible_with_mask": self.schedule.get_health_count(Susceptible_with_mask),
+                "Infected": self.schedule.get_health_count(Infected),
+                "Recovered": self.schedule.get_health_count(Recovered)}
+
+    def enable_profiling(self):
+        '''
+        Start timing every phase of the model's steps. Returns the
+        profiling.StepProfiler holding the per-step and per-run reports.
+        '''
+        from SIR_agent_2020.profiling import StepProfiler
+        if self.profiler is None:
+            self.profiler = StepProfiler(self)
+            self.profiler.install()
+        return self.profiler
+
+    def disable_profiling(self):
+        '''
+        Stop timing; returns the profiler with what it measured, if there was one.
+        '''
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.uninstall()
+            self.profiler = None
+        return profiler
+
+    def health_raster(self):
+        '''
+        Number of agents of each health in every cell, as an array of shape
+        (4, width, height) indexed [health code][x][y].
+        '''
+        raster = np.zeros((len(HEALTH_CLASSES), self.width, self.height), dtype=np.int64)
+        for code, health in enumerate(HEALTH_CLASSES):
+            bucket = self.schedule.agents_by_health[health]
+            if bucket:
+                x, y = np.array([agent.pos for agent in bucket]).T
+                raster[code] = np.bincount(x * self.height + y,
+                                           minlength=self.width * self.height).reshape(self.width, self.height)
+        return raster
+
+    def run_model(self, step_count=200, progress=None):
         '''
-        Function for running model.
+        Function for running model. Stops early when there are no more infected.
         Parameters:
-        step_count:int, number of times the function will run
+        step_count:int, maximum number of times the function will run
+        progress: callable, called with the model after every step
         '''
         #print statements for number of initial individuals
         if self.verbose:
@@ -144,8 +255,12 @@ class SIR(Model):
                 self.schedule.get_health_count(Recovered))
 
         for _ in range(step_count):
-            self.datacollector.collect(self) #runs the lamda functions in the datacollector and stores the values
-            self.step() #calls the step function
+            self.step() #calls the step function, which records the counts
+            if progress is not None:
+                progress(self)
+            if not self.running: #stops early once no one is infected
+                break
+        self.datacollector.flush() #writes out whatever is left in memory
 
         #print statements for number of final individuals
         if self.verbose:
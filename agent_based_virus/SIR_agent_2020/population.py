@@ -0,0 +1,99 @@
+'''
+Explicit initial populations.
+
+By default every engine places its initial_* agents uniformly at random. A
+model's population parameter places a given population instead, e.g. one
+taken from a checkpoint or a census raster. It can be any of:
+
+    (x, y, health)        three equally long arrays, one entry per agent, with
+                          health codes 0 susceptible, 1 masked, 2 infected,
+                          3 recovered (checkpoint.snapshot's "x", "y" and
+                          "health" arrays are one)
+    (N, 3)                an array with one row of x, y, health per agent
+    (4, width, height)    a raster of the number of people of each health in
+                          every cell
+    a path                .npy holding either of the above as an (N, 3)
+                          array of x, y, health or a raster, or .npz with
+                          arrays x, y and health, or one named raster
+
+The initial_* counts given to the model are replaced by those of the population.
+'''
+
+import os
+
+import numpy as np
+
+
+HEALTHS = 4 # number of health codes
+
+
+def population_from_raster(raster):
+    '''
+    x, y and health arrays of a (4, width, height) count raster, ordered by
+    health, then x, then y.
+    '''
+    raster = np.asarray(raster)
+    if raster.ndim != 3 or len(raster) != HEALTHS:
+        raise ValueError("A population raster must have shape (4, width, height), not {}".format(raster.shape))
+    if (raster < 0).any():
+        raise ValueError("A population raster must not have negative counts")
+    counts = raster.astype(np.int64).ravel()
+    cells = np.repeat(np.arange(len(counts)), counts)
+    health, x, y = np.unravel_index(cells, raster.shape)
+    return x, y, health
+
+
+def load_population(path):
+    '''
+    Read a population from a .npy or .npz file, as a raster or x, y, health arrays.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        array = np.load(path)
+        if array.ndim == 2 and array.shape[1] == 3:
+            return tuple(array.T)
+        return array
+    if extension == ".npz":
+        with np.load(path) as data:
+            if {"x", "y", "health"} <= set(data.files):
+                return data["x"], data["y"], data["health"]
+            if len(data.files) == 1:
+                return data[data.files[0]]
+            raise ValueError("{} must hold arrays x, y and health, or one raster".format(path))
+    raise ValueError("Populations are loaded from .npy or .npz files, not {}".format(path))
+
+
+def make_population(population, width, height):
+    '''
+    x, y and health arrays (int64, int64, int8) of a model's population
+    parameter (see the module docstring), checked against the board.
+    '''
+    if isinstance(population, str):
+        population = load_population(population)
+    if isinstance(population, np.ndarray) and population.ndim == 2 and population.shape[1] == 3:
+        population = tuple(population.T) # rows of x, y, health, as load_population reads them
+    if isinstance(population, np.ndarray):
+        if population.ndim != 3 or population.shape[0] != HEALTHS:
+            raise ValueError("A population array must have shape (N, 3) or (4, width, height), not {}".format(
+                population.shape))
+        if population.shape[1:] != (width, height):
+            raise ValueError("The population raster is {}x{}, the board is {}x{}".format(
+                population.shape[1], population.shape[2], width, height))
+        x, y, health = population_from_raster(population)
+    else:
+        x, y, health = (np.asarray(array).ravel() for array in population)
+        if not len(x) == len(y) == len(health):
+            raise ValueError("The population's x, y and health arrays differ in length")
+    x, y, health = x.astype(np.int64), y.astype(np.int64), health.astype(np.int8)
+    if len(x) and not (0 <= x.min() and x.max() < width and 0 <= y.min() and y.max() < height):
+        raise ValueError("The population has agents outside the {}x{} board".format(width, height))
+    if len(health) and not (0 <= health.min() and health.max() < HEALTHS):
+        raise ValueError("Health codes must be 0 to {}".format(HEALTHS - 1))
+    return x, y, health
+
+
+def health_totals(health):
+    '''
+    Number of agents of each health code, as a list of 4 ints.
+    '''
+    return np.bincount(health, minlength=HEALTHS).tolist()
@@ -0,0 +1,236 @@
+'''
+Opt-in timing of where SIR.step spends its time.
+
+    > profiler = model.enable_profiling()
+    > model.run_model(100)
+    > print(format_report(profiler.run_report()))
+
+While profiling is on, the model's grid, scheduler and collector methods the
+agents call are wrapped (on those objects only, so other models are not
+affected) to add up wall time and call counts per phase:
+
+    move         grid.random_neighbor + grid.move_agent (RandomWalker.random_move)
+    infection    the rest of the agent's step: reading the infected counts and
+                 drawing the random numbers that decide what happens
+    transition   changing health (scheduler buckets and infected counts)
+    birth        picking a cell, placing the new agent and scheduling it
+    departure    taking the agent off the grid and out of the schedule
+    bookkeeping  the scheduler's shuffle and loop
+    collection   recording the time series
+
+The agent phases are split by the health the agent had when its step began,
+except in the scheduler's synchronous mode, where each pass over all agents
+is timed as a whole (moves as move, decisions as infection).
+Calls made from inside another timed call (e.g. the grid's _place_agent
+during move_agent) count towards the outer one. When profiling is off
+nothing is wrapped and the scheduler takes its usual loop, so it costs
+nothing.
+'''
+
+import time
+from collections import defaultdict
+
+
+AGENT_PHASES = ("move", "infection", "transition", "birth", "departure")
+MODEL_PHASES = ("bookkeeping", "collection")
+
+
+class StepProfiler:
+    '''
+    Accumulates the time and calls of every phase, for the current step and
+    for the whole run since profiling was enabled.
+    '''
+
+    def __init__(self, model):
+        self.model = model
+        self.health = None      # health class of the agent being stepped
+        self._depth = 0         # > 0 while inside a timed call
+        self._inner = 0.0       # time of the timed calls within the current agent's step
+        self._pending = 0.0     # random_neighbor time, until we know whether it was for a move or a birth
+        self._step = defaultdict(lambda: [0.0, 0])  # (health, phase) -> [seconds, calls], this step
+        self._run = defaultdict(lambda: [0.0, 0])   # the same, summed over the run
+        self._agent_seconds = 0.0 # time of the agents' steps during the current scheduler step
+        self._last_step = {}
+        self._step_seconds = 0.0
+        self._run_seconds = 0.0
+        self.steps = 0
+        self._wrapped = []
+
+    def _add(self, health, phase, seconds, calls=1):
+        entry = self._step[health, phase]
+        entry[0] += seconds
+        entry[1] += calls
+
+    def _timed(self, phase, method):
+        '''
+        Wrap a bound method so its top-level calls add to the given phase.
+        '''
+        def timed(*args, **kwargs):
+            if self._depth:
+                return method(*args, **kwargs)
+            self._depth = 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self._depth = 0
+                self._inner += seconds
+                if phase is None: # picking a neighboring cell, claimed by the next move or birth
+                    self._pending += seconds
+                else:
+                    self._add(self.health, phase, seconds + self._pending)
+                    self._pending = 0.0
+        return timed
+
+    def _timed_schedule(self, method):
+        '''
+        Wrap the scheduler's step: its time not spent in the agents' steps is bookkeeping.
+        '''
+        def step(*args, **kwargs):
+            self._agent_seconds = 0.0
+            start = time.perf_counter()
+            method(*args, **kwargs)
+            self._add(None, "bookkeeping", time.perf_counter() - start - self._agent_seconds)
+        return step
+
+    def _timed_collect(self, method):
+        def collect(*args, **kwargs):
+            start = time.perf_counter()
+            method(*args, **kwargs)
+            self._add(None, "collection", time.perf_counter() - start)
+        return collect
+
+    def _timed_step(self, method):
+        '''
+        Wrap the model's step, closing this step's report when it returns.
+        '''
+        def step(*args, **kwargs):
+            start = time.perf_counter()
+            method(*args, **kwargs)
+            self.end_step(time.perf_counter() - start)
+        return step
+
+    def install(self):
+        '''
+        Wrap the model's step and its grid, scheduler and collector methods,
+        and have the scheduler time each agent's step.
+        '''
+        model = self.model
+        for owner, name, wrapper in ((model, "step", self._timed_step),
+                                     (model.schedule, "step", self._timed_schedule),
+                                     (model.datacollector, "collect", self._timed_collect)):
+            setattr(owner, name, wrapper(getattr(owner, name)))
+            self._wrapped.append((owner, name))
+        for owner, name, phase in ((model.grid, "random_neighbor", None),
+                                   (model.grid, "move_agent", "move"),
+                                   (model.grid, "place_agent", "birth"),
+                                   (model.schedule, "add", "birth"),
+                                   (model.grid, "_remove_agent", "departure"),
+                                   (model.schedule, "remove", "departure"),
+                                   (model.schedule, "change_health", "transition"),
+                                   (model.grid, "count_infected", "transition")):
+            setattr(owner, name, self._timed(phase, getattr(owner, name)))
+            self._wrapped.append((owner, name))
+        model.schedule.profiler = self
+
+    def uninstall(self):
+        '''
+        Remove the wrappers, leaving the class methods in place again.
+        '''
+        for owner, name in self._wrapped:
+            delattr(owner, name)
+        self._wrapped = []
+        self.model.schedule.profiler = None
+
+    def step_agent(self, agent):
+        '''
+        Step one agent, timing it. Called by the scheduler instead of agent.step().
+        '''
+        self.health = type(agent)
+        self._inner = 0.0
+        start = time.perf_counter()
+        agent.step()
+        seconds = time.perf_counter() - start
+        self._agent_seconds += seconds
+        self._add(self.health, "infection", seconds - self._inner)
+
+    def timed_pass(self, phase, function, *args):
+        '''
+        Time one pass over all agents of the scheduler's synchronous step.
+        With a phase the whole pass counts towards it; without one the timed
+        calls made during it count towards their own phases and the rest is
+        bookkeeping. Returns what function returns.
+        '''
+        self.health = None
+        self._inner = 0.0
+        self._depth = 1 if phase is not None else 0
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            self._depth = 0
+            self._agent_seconds += seconds
+            if phase is not None:
+                self._add(None, phase, seconds)
+            else:
+                self._add(None, "bookkeeping", seconds - self._inner)
+
+    def end_step(self, seconds):
+        '''
+        Close the current step, which took seconds in total, and add it to the run.
+        '''
+        self._step_seconds = seconds
+        self._run_seconds += seconds
+        self.steps += 1
+        for key, (phase_seconds, calls) in self._step.items():
+            entry = self._run[key]
+            entry[0] += phase_seconds
+            entry[1] += calls
+        self._last_step = self._step
+        self._step = defaultdict(lambda: [0.0, 0])
+
+    def _report(self, totals, seconds, steps):
+        phases = {phase: {"seconds": 0.0, "calls": 0} for phase in AGENT_PHASES + MODEL_PHASES}
+        by_health = {}
+        for (health, phase), (phase_seconds, calls) in totals.items():
+            phases[phase]["seconds"] += phase_seconds
+            phases[phase]["calls"] += calls
+            if phase in AGENT_PHASES:
+                name = health.__name__ if health is not None else "all agents" # synchronous passes
+                entry = by_health.setdefault(name, {}).setdefault(
+                    phase, {"seconds": 0.0, "calls": 0})
+                entry["seconds"] += phase_seconds
+                entry["calls"] += calls
+        return {"steps": steps, "seconds": seconds, "phases": phases, "by_health": by_health}
+
+    def step_report(self):
+        '''
+        Time and calls of each phase during the last step, in total and per
+        health: {"steps", "seconds", "phases": {phase: {"seconds", "calls"}},
+        "by_health": {health: {phase: {"seconds", "calls"}}}}.
+        '''
+        return self._report(self._last_step, self._step_seconds, min(self.steps, 1))
+
+    def run_report(self):
+        '''
+        The same as step_report, summed over every step since profiling began.
+        '''
+        return self._report(self._run, self._run_seconds, self.steps)
+
+
+def format_report(report):
+    '''
+    A report from step_report or run_report as a printable table.
+    '''
+    total = report["seconds"] or 1.0
+    lines = ["{} steps in {:.3f}s".format(report["steps"], report["seconds"]),
+             "{:<24} {:<12} {:>10} {:>7} {:>10}".format("health", "phase", "seconds", "share", "calls")]
+    rows = [(health, phase, entry) for health, phases in sorted(report["by_health"].items())
+            for phase, entry in phases.items()]
+    rows += [("", phase, report["phases"][phase]) for phase in MODEL_PHASES]
+    for health, phase, entry in rows:
+        lines.append("{:<24} {:<12} {:>10.4f} {:>6.1%} {:>10}".format(
+            health, phase, entry["seconds"], entry["seconds"] / total, entry["calls"]))
+    return "\n".join(lines)
@@ -1,26 +1,27 @@
 '''
 Generalized behavior for random walking, one grid cell at a time.
-Does not need changing from base mesa model.
+Moves like the base mesa model, using the grid's precomputed neighborhoods
+(space.HealthGrid.random_neighbor) instead of building them on every move.
 '''
 
-import random
 
-from mesa import Agent
-
-
-class RandomWalker(Agent):
+class RandomWalker:
     '''
     Class implementing random walker methods in a generalized manner.
 
     Not indended to be used on its own, but to inherit its methods to multiple
     other agents.
 
+    Sets the same unique_id and model attributes as mesa's Agent but does not
+    inherit from it: Agent has no __slots__, so every subclass instance would
+    carry a __dict__ again. Subclasses must declare __slots__ too.
     '''
 
+    __slots__ = ("unique_id", "model", "pos", "moore")
+
     grid = None
     x = None
     y = None
-    moore = True
 
     def __init__(self, pos, model, moore=True):
         '''
@@ -30,16 +31,21 @@ class RandomWalker(Agent):
         moore: If True, may move in all 8 directions.
                 Otherwise, only up, down, left, right.
         '''
-        super().__init__(pos, model)
+        self.unique_id = pos
+        self.model = model
         self.pos = pos
         self.moore = moore
 
+    def step(self):
+        '''
+        A single step of the agent.
+        '''
+        pass
+
     def random_move(self):
         '''
         Step one cell in any allowable direction.
         '''
-        # Pick the next cell from the adjacent cells.
-        next_moves = self.model.grid.get_neighborhood(self.pos, self.moore, True)
-        next_move = random.choice(next_moves)
-        # Now move:
-        self.model.grid.move_agent(self, next_move)
+        # Pick the next cell from the adjacent cells, and move there.
+        grid = self.model.grid
+        grid.move_agent(self, grid.random_neighbor(self.pos, self.moore))
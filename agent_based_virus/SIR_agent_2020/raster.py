@@ -0,0 +1,264 @@
+'''
+Raster view of the board for the visualization server.
+
+CanvasGrid sends one portrayal dict (with an image path) per agent every frame,
+which the websocket and the browser cannot keep up with on large boards.
+HealthRasterModule sends the board as one byte per cell instead:
+
+    0                          empty cell
+    1 + 63*code + (count - 1)  count agents (capped at 63), most of them of
+                               health code (0 susceptible, 1 masked,
+                               2 infected, 3 recovered)
+
+Boards wider or taller than max_cells are summed into blocks of cells first.
+Frames are base64 encoded and, when few cells changed since the previous
+frame, only the changed cells are sent (as uint32 indices plus their bytes).
+The previous frame is kept per browser connection: serve the module with a
+ClientServer, which tells it which connection each frame is for, so every
+open tab is sent the changes since the frame that tab drew last.
+
+Payload size and server-side render time can be measured from the
+agent_based_virus directory, e.g.
+
+    > python -m SIR_agent_2020.raster --grids 200 1000
+'''
+
+import argparse
+import base64
+import json
+import time
+
+import numpy as np
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler, VisualizationElement
+
+from SIR_agent_2020.engines import make_model
+
+
+# Most agents a cell's byte can tell apart
+MAX_COUNT = 63
+
+# Colors of the four health codes, as in the chart
+HEALTH_COLORS = ["#FF0000", "#FFFF00", "#99D500", "#0000FF"]
+
+
+def downsample(raster, max_cells):
+    '''
+    Sum a (4, width, height) raster into square blocks so neither side has
+    more than max_cells blocks.
+    '''
+    _, width, height = raster.shape
+    block = -(-max(width, height) // max_cells) # ceiling division
+    if block == 1:
+        return raster
+    padded = np.zeros((raster.shape[0], -(-width // block) * block, -(-height // block) * block),
+                      dtype=raster.dtype)
+    padded[:, :width, :height] = raster
+    return padded.reshape(raster.shape[0], padded.shape[1] // block, block,
+                          padded.shape[2] // block, block).sum(axis=(2, 4))
+
+
+def encode_cells(raster):
+    '''
+    One byte per cell of a (4, width, height) raster, laid out as image rows
+    (top row first, y pointing up like CanvasGrid).
+    '''
+    total = raster.sum(axis=0)
+    dominant = raster.argmax(axis=0)
+    cells = np.where(total > 0, 1 + MAX_COUNT * dominant + np.minimum(total, MAX_COUNT) - 1, 0)
+    return np.ascontiguousarray(cells.T[::-1], dtype=np.uint8)
+
+
+def _b64(array):
+    return base64.b64encode(array.tobytes()).decode("ascii")
+
+
+class HealthRasterModule(VisualizationElement):
+    '''
+    Draws the board as a raster of cell colors (dominant health) and opacity
+    (number of agents). The canvas takes its shape from the model's width and
+    height, scaled to fit canvas_size pixels.
+    '''
+
+    local_includes = ["SIR_agent_2020/resources/HealthRasterModule.js"]
+    per_client = True   # render takes the client the frame is for, see ClientServer
+
+    def __init__(self, canvas_size=600, max_cells=200, keyframe_interval=50):
+        '''
+        parameters:
+            canvas_size:int, pixels of the longer side of the canvas
+            max_cells:int, most cells sent along either side of the board
+            keyframe_interval:int, frames between complete frames
+        '''
+        self.canvas_size = canvas_size
+        self.max_cells = max_cells
+        self.keyframe_interval = keyframe_interval
+        self._clients = {}   # client -> (model, cells, frames since the last complete one)
+        self.js_code = "elements.push(new HealthRasterModule({}, {}));".format(
+            canvas_size, json.dumps(HEALTH_COLORS))
+
+    def render(self, model, client=None):
+        '''
+        The frame of the model for one client (a connection of ClientServer,
+        or None when there is a single viewer), with the cells changed since
+        the last frame that client was sent.
+        '''
+        cells = encode_cells(downsample(model.health_raster(), self.max_cells))
+        rows, cols = cells.shape
+        occupied = cells[cells > 0]
+        # Cells with twice the average count of an occupied cell are drawn fully opaque
+        scale = 2 * ((occupied - 1) % MAX_COUNT + 1).mean() if len(occupied) else 1
+        frame = {"cols": cols, "rows": rows, "max_count": MAX_COUNT,
+                 "scale": min(MAX_COUNT, max(1, int(round(scale))))}
+        # A new client, a new model (after Reset) or a new board shape needs a complete frame
+        last_model, previous, since_keyframe = self._clients.get(client, (None, None, 0))
+        keyframe = (model is not last_model or previous is None or previous.shape != cells.shape
+                    or since_keyframe >= self.keyframe_interval)
+        if not keyframe:
+            changed = np.flatnonzero(cells != previous)
+            # 5 bytes per changed cell against 1 per cell for a complete frame
+            keyframe = 5 * len(changed) >= cells.size
+        if keyframe:
+            frame["cells"] = _b64(cells)
+            since_keyframe = 0
+        else:
+            frame["index"] = _b64(changed.astype("<u4"))
+            frame["values"] = _b64(cells.ravel()[changed])
+            since_keyframe += 1
+        self._clients[client] = (model, cells, since_keyframe)
+        return frame
+
+    def forget(self, client):
+        '''
+        Drop the last frame sent to a client that has gone.
+        '''
+        self._clients.pop(client, None)
+
+
+class ClientSocketHandler(SocketHandler):
+    '''
+    A SocketHandler that has its frames rendered for its own connection.
+    '''
+
+    def open(self):
+        super().open()
+        self.application.open_client(self)
+
+    def on_message(self, message):
+        # Tornado handles one message at a time, so the server can hold the current client
+        self.application.client = self
+        try:
+            super().on_message(message)
+        finally:
+            self.application.client = None
+
+    def on_close(self):
+        self.application.close_client(self)
+
+
+class ClientServer(ModularServer):
+    '''
+    A ModularServer that passes the connection a frame is for to the
+    elements with per_client set, so state they keep between frames (the
+    previous raster of HealthRasterModule) is kept per browser tab.
+    '''
+
+    socket_handler = (r'/ws', ClientSocketHandler)
+    handlers = [ModularServer.page_handler, socket_handler,
+                ModularServer.static_handler, ModularServer.local_handler]
+
+    client = None   # connection whose message is being handled
+
+    def __init__(self, model_cls, visualization_elements, name="Mesa Model", model_params={}):
+        self.clients = set()   # open connections
+        super().__init__(model_cls, visualization_elements, name, model_params)
+
+    def render_model(self):
+        return [element.render(self.model, self.client) if getattr(element, "per_client", False)
+                else element.render(self.model)
+                for element in self.visualization_elements]
+
+    def open_client(self, client):
+        self.clients.add(client)
+
+    def close_client(self, client):
+        self.clients.discard(client)
+        for element in self.visualization_elements:
+            if getattr(element, "per_client", False):
+                element.forget(client)
+
+
+def _canvas_payload(model):
+    '''
+    Size of the frame CanvasGrid would send for the model, in bytes of JSON.
+    '''
+    from SIR_agent_2020.server import canvas_element
+    return len(json.dumps(canvas_element.render(model)))
+
+
+def frame_benchmark(grids=(200, 1000), engine="vectorized", density=1.0, steps=20,
+                    max_cells=200, seed=0):
+    '''
+    Payload size and server-side render time of HealthRasterModule frames.
+    Parameters:
+        grids: iterable of int, side of each (square) board
+        engine:str, engine name from engines.ENGINES
+        density:float, agents per cell
+        steps:int, frames rendered (after the first, complete one)
+        max_cells:int, as for HealthRasterModule
+        seed:int, seed of the models
+    Returns a list of dicts, one per grid. With the agent engine it also
+    gives the size of the per-agent CanvasGrid frame for comparison.
+    '''
+    results = []
+    for grid in grids:
+        population = int(grid * grid * density)
+        infected = max(1, population // 100)
+        model = make_model(engine, seed=seed,
+                           initial_susceptible=(population - infected) // 2,
+                           initial_susceptible_with_mask=(population - infected) // 2,
+                           initial_infected=infected, initial_recovered=0,
+                           gamma=5, beta=10, epsilon=2, alpha=2, delta=1,
+                           height=grid, width=grid)
+        element = HealthRasterModule(max_cells=max_cells)
+        start = time.perf_counter()
+        keyframe = json.dumps(element.render(model))
+        keyframe_seconds = time.perf_counter() - start
+
+        sizes, seconds = [], []
+        for _ in range(steps):
+            model.step()
+            start = time.perf_counter()
+            sizes.append(len(json.dumps(element.render(model))))
+            seconds.append(time.perf_counter() - start)
+        result = {"grid": grid, "population": population, "engine": engine,
+                  "keyframe_bytes": len(keyframe), "keyframe_ms": 1000 * keyframe_seconds,
+                  "frame_bytes": float(np.mean(sizes)), "frame_ms": 1000 * float(np.mean(seconds))}
+        if engine == "agent":
+            start = time.perf_counter()
+            result["canvas_grid_bytes"] = _canvas_payload(model)
+            result["canvas_grid_ms"] = 1000 * (time.perf_counter() - start)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure HealthRasterModule frames.")
+    parser.add_argument("--grids", type=int, nargs="+", default=[200, 1000])
+    parser.add_argument("--engine", default="vectorized")
+    parser.add_argument("--density", type=float, default=1.0, help="agents per cell")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--max-cells", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for row in frame_benchmark(args.grids, args.engine, args.density, args.steps,
+                               args.max_cells, args.seed):
+        line = ("{grid}x{grid} ({population} agents, {engine}): keyframe {keyframe_bytes} B "
+                "in {keyframe_ms:.1f} ms, frames {frame_bytes:.0f} B in {frame_ms:.1f} ms").format(**row)
+        if "canvas_grid_bytes" in row:
+            line += ", CanvasGrid {canvas_grid_bytes} B in {canvas_grid_ms:.0f} ms".format(**row)
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+/*
+Draws the frames of background.py's ChartDeltaModule: the values of every
+series at every step since the previous frame ("steps" and "values"), added
+to a line chart like mesa's ChartModule. Only the last max_points steps are
+kept on the chart.
+*/
+var ChartDeltaModule = function(series, canvas_width, canvas_height) {
+	var max_points = 2000;
+
+	// Create the tag:
+	var canvas = $("<canvas width='" + canvas_width + "' height='" + canvas_height + "' " +
+	               "style='border:1px dotted'></canvas>")[0];
+	$("#elements").append(canvas);
+	var context = canvas.getContext("2d");
+
+	var datasets = series.map(function(s) {
+		return {label: s.Label, strokeColor: s.Color, data: []};
+	});
+	var data = {labels: [], datasets: datasets};
+	var options = {
+		animation: false,
+		datasetFill: false,
+		pointDot: false,
+		bezierCurve: false
+	};
+	var chart = new Chart(context).Line(data, options);
+	var points = 0;
+
+	this.render = function(data) {
+		for (var i = 0; i < data.steps.length; i++) {
+			chart.addData(data.values[i], data.steps[i]);
+			if (++points > max_points) {
+				chart.removeData();
+				points--;
+			}
+		}
+	};
+
+	this.reset = function() {
+		chart.destroy();
+		data.labels = [];
+		points = 0;
+		chart = new Chart(context).Line(data, options);
+	};
+};
@@ -0,0 +1,105 @@
+/*
+Draws the frames of raster.py's HealthRasterModule: one byte per cell, either
+the whole board ("cells") or only the cells changed since the last frame
+("index" and "values"), all base64 encoded.
+
+The board is painted into an ImageData of one pixel per cell, which is then
+scaled up onto the canvas, so drawing costs the same however many agents
+there are. The time taken by the last frame is shown under the canvas.
+*/
+var HealthRasterModule = function(canvas_size, colors) {
+	// Create the tag:
+	var canvas = $("<canvas width='" + canvas_size + "' height='" + canvas_size + "' " +
+	               "style='border:1px dotted'></canvas>")[0];
+	var status = $("<p style='font-size:small'></p>")[0];
+	$("#elements").append(canvas);
+	$("#elements").append(status);
+	var context = canvas.getContext("2d");
+
+	// One pixel per cell, drawn onto the canvas scaled up
+	var buffer = document.createElement("canvas");
+	var bufferContext = buffer.getContext("2d");
+	var image = null;
+	var cells = null;
+	var scale = null; // count drawn fully opaque in the current image
+
+	// RGB of each health code
+	var rgb = colors.map(function(color) {
+		return [1, 3, 5].map(function(i) { return parseInt(color.substr(i, 2), 16); });
+	});
+
+	var decode = function(text) {
+		var raw = atob(text);
+		var bytes = new Uint8Array(raw.length);
+		for (var i = 0; i < raw.length; i++)
+			bytes[i] = raw.charCodeAt(i);
+		return bytes;
+	};
+
+	var resize = function(cols, rows) {
+		// Keep the board's shape, with the longer side canvas_size pixels
+		var cell = canvas_size / Math.max(cols, rows);
+		canvas.width = Math.round(cols * cell);
+		canvas.height = Math.round(rows * cell);
+		buffer.width = cols;
+		buffer.height = rows;
+		image = bufferContext.createImageData(cols, rows);
+		cells = new Uint8Array(cols * rows);
+	};
+
+	var paint = function(i, value, max_count, scale) {
+		var p = 4 * i;
+		if (value === 0) {
+			image.data[p + 3] = 0;
+			return;
+		}
+		var code = Math.floor((value - 1) / max_count);
+		var count = (value - 1) % max_count + 1;
+		var color = rgb[code];
+		image.data[p] = color[0];
+		image.data[p + 1] = color[1];
+		image.data[p + 2] = color[2];
+		image.data[p + 3] = Math.round(255 * (0.3 + 0.7 * Math.min(1, count / scale)));
+	};
+
+	this.render = function(data) {
+		var start = performance.now();
+		if (data.cells !== undefined) {
+			if (image === null || buffer.width !== data.cols || buffer.height !== data.rows)
+				resize(data.cols, data.rows);
+			cells = decode(data.cells);
+			for (var i = 0; i < cells.length; i++)
+				paint(i, cells[i], data.max_count, data.scale);
+		}
+		else if (image !== null) {
+			var index = new Uint32Array(decode(data.index).buffer);
+			var values = decode(data.values);
+			for (var j = 0; j < index.length; j++)
+				cells[index[j]] = values[j];
+			if (data.scale !== scale) // every cell's opacity changes
+				for (var k = 0; k < cells.length; k++)
+					paint(k, cells[k], data.max_count, data.scale);
+			else
+				for (var m = 0; m < index.length; m++)
+					paint(index[m], values[m], data.max_count, data.scale);
+		}
+		else
+			return; // a change to a frame we never got, wait for the next complete one
+		scale = data.scale;
+		bufferContext.putImageData(image, 0, 0);
+		context.clearRect(0, 0, canvas.width, canvas.height);
+		context.imageSmoothingEnabled = false;
+		context.drawImage(buffer, 0, 0, canvas.width, canvas.height);
+		var size = (data.cells || data.index + data.values).length;
+		status.textContent = data.cols + " x " + data.rows + " cells, " +
+			(data.cells !== undefined ? "complete" : "changed cells") + " frame of " +
+			(size / 1024).toFixed(1) + " KB drawn in " + (performance.now() - start).toFixed(1) + " ms";
+	};
+
+	this.reset = function() {
+		image = null;
+		scale = null;
+		context.clearRect(0, 0, canvas.width, canvas.height);
+		status.textContent = "";
+	};
+};
@@ -0,0 +1,34 @@
+'''
+Seeds for the models' random number generators.
+
+Every model owns its generator, seeded from one integer. Replicates that run
+side by side (in threads, processes or on other machines) get their seeds from
+numpy's SeedSequence, which spawns statistically independent streams from a
+parent seed.
+'''
+
+import numpy as np
+
+
+def new_seed():
+    '''
+    A fresh seed drawn from OS entropy, for models created without one, so the
+    seed of every run can still be recorded and replayed.
+    '''
+    return int(np.random.SeedSequence().entropy)
+
+
+def spawn_seeds(seed, count):
+    '''
+    Seeds of count independent substreams of the given parent seed.
+    '''
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(count)]
+
+
+def substream_seed(seed, *key):
+    '''
+    Seed of the substream of the given parent seed identified by key, a tuple
+    of non-negative ints (e.g. scenario and replicate number). The same key
+    always gives the same seed, whatever other substreams were drawn.
+    '''
+    return int(np.random.SeedSequence(seed, spawn_key=key).generate_state(1)[0])
@@ -1,4 +1,3 @@
-import random
 from collections import defaultdict
 
 from mesa.time import RandomActivation
@@ -13,55 +12,143 @@ class RandomActivationByHealth(RandomActivation):
     default behavior for an ABM.
 
     Assumes that all agents have a step() method.
+
+    Agents are kept in insertion-ordered dicts (used as ordered sets) instead
+    of lists, so add and remove are O(1) while the activation order behaves
+    exactly like the list version: new agents go to the back, removed agents
+    leave the rest of the order untouched, and each step reshuffles it.
     '''
-    agents_by_health = defaultdict(list)
+    agents_by_health = defaultdict(dict)
+    profiler = None # a profiling.StepProfiler times every agent's step when set
 
     def __init__(self, model):
         super().__init__(model)
-        self.agents_by_health = defaultdict(list)
+        self._agents = {}   #agent -> agent, in activation order
+        self.agents_by_health = defaultdict(dict)
+
+    @property
+    def agents(self):
+        '''
+        List of scheduled agents in their current activation order.
+        '''
+        return list(self._agents)
+
+    @agents.setter
+    def agents(self, agents):
+        self._agents = {agent: agent for agent in agents}
 
     def add(self, agent):
         '''
         Add an Agent object to the schedule
         
         '''
-        self.agents.append(agent) # An Agent to be added to the schedule.
+        self._agents[agent] = agent # An Agent to be added to the schedule.
         agent_class = type(agent) 
-        self.agents_by_health[agent_class].append(agent) # An Agent to be added to the schedule.
+        self.agents_by_health[agent_class][agent] = agent # An Agent to be added to the schedule.
+
+    def add_agents(self, agents):
+        '''
+        Add many agents at once, in order, as add does for one.
+        '''
+        self._agents.update(zip(agents, agents))
+        buckets = self.agents_by_health
+        for agent in agents:
+            buckets[type(agent)][agent] = agent
 
     def remove(self, agent):
         '''
         Remove all instances of a given agent from the schedule.
         '''
-
-        while agent in self.agents: 
-            self.agents.remove(agent) # remove agent
+        self._agents.pop(agent, None) # remove agent
 
         agent_class = type(agent)
-        while agent in self.agents_by_health[agent_class]:
-            self.agents_by_health[agent_class].remove(agent)
+        self.agents_by_health[agent_class].pop(agent, None)
 
-    def step(self, by_health=False):
+    def change_health(self, agent, health_class):
+        '''
+        Give a scheduled agent a new health in place: it becomes an instance of
+        health_class and moves to that health's bucket, keeping its place in
+        the activation order.
+        '''
+        del self.agents_by_health[type(agent)][agent]
+        agent.__class__ = health_class
+        self.agents_by_health[health_class][agent] = agent
+
+    def step(self, by_health=False, synchronous=False):
         '''
         Executes the step of each agent health, one at a time, in random order.
+        With synchronous, every agent moves and decides against the same state
+        and all the decisions are applied together (see step_synchronous).
         '''
-        if by_health: # If True, run all agents of a single health before running the next one.
-            for agent_class in self.agents_by_health:
+        if synchronous:
+            self.step_synchronous()
+        elif by_health: # If True, run all agents of a single health before running the next one.
+            for agent_class in list(self.agents_by_health):
                 self.step_health(agent_class) 
-            self.steps += 1
-            self.time += 1
         else: # if not, 
-            super().step()
+            self._agents = self._shuffled(self._agents)
+            if self.profiler is None:
+                for agent in list(self._agents):
+                    agent.step()
+            else:
+                for agent in list(self._agents):
+                    self.profiler.step_agent(agent)
+        self.steps += 1
+        self.time += 1
+
+    def step_synchronous(self):
+        '''
+        Step every agent against a frozen state, in three passes:
+            1. everyone moves (moves do not depend on anyone's health)
+            2. everyone decides what happens to them (agent.decide), reading
+               the grid after the moves; nothing is changed yet, so the
+               decisions do not depend on the order they are taken in
+            3. all infections, recoveries, departures and births are applied
+        Newborns are added after everyone has decided, so they first act next
+        step. This is the update rule of the vectorized engine.
+        '''
+        agents = list(self._agents)
+        if self.profiler is None:
+            self.model.grid.move_agents(agents)
+            decisions = [agent.decide() for agent in agents]
+            self._apply(agents, decisions)
+        else:
+            self.profiler.timed_pass("move", self.model.grid.move_agents, agents)
+            decisions = self.profiler.timed_pass("infection", lambda: [agent.decide() for agent in agents])
+            self.profiler.timed_pass(None, self._apply, agents, decisions)
+        self.steps += 1
+        self.time += 1
+
+    def _apply(self, agents, decisions):
+        for agent, decision in zip(agents, decisions):
+            agent.apply(decision)
 
     def step_health(self, health):
         '''
         Shuffle order and run all agents of a given health.
         '''
-        agents = self.agents_by_health[health] # Class object of the health to run.
+        agents = self._shuffled(self.agents_by_health[health]) # Class object of the health to run.
+        self.agents_by_health[health] = agents
 
-        random.shuffle(agents) # random shuffled the agents
-        for agent in agents:
-            agent.step() # run agents of a given health
+        if self.profiler is None:
+            for agent in list(agents):
+                agent.step() # run agents of a given health
+        else:
+            for agent in list(agents):
+                self.profiler.step_agent(agent)
+
+    def move_health(self, health):
+        '''
+        Move all agents of a given health at once, in their current order,
+        without stepping them.
+        '''
+        self.model.grid.move_agents(self.agents_by_health[health])
+
+    def get_agent_count(self):
+        '''
+        Returns the current number of agents in the queue.
+        '''
+        return len(self._agents)
 
     def get_health_count(self, health_class):
         '''
@@ -69,3 +156,11 @@ class RandomActivationByHealth(RandomActivation):
         '''
         # print(health_class, len(self.agents_by_health[health_class]))
         return len(self.agents_by_health[health_class])
+
+    def _shuffled(self, agents):
+        '''
+        Return a new ordered set holding the given agents in random order.
+        '''
+        order = list(agents)
+        self.model.random.shuffle(order) # random shuffled the agents, with the model's generator
+        return {agent: agent for agent in order}
@@ -1,9 +1,11 @@
-from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.modules import CanvasGrid, ChartModule
 from mesa.visualization.UserParam import UserSettableParameter
 
 from SIR_agent_2020.agents import Susceptible,Susceptible_with_mask, Infected, Recovered
 from SIR_agent_2020.model import SIR
+from SIR_agent_2020.raster import ClientServer, HealthRasterModule, HEALTH_COLORS
+from SIR_agent_2020.trajectory import TrajectoryReader, ReplayModel
+from SIR_agent_2020.background import BackgroundServer, ChartDeltaModule
 
 """
 Citation:
@@ -43,11 +45,14 @@ def agent_portrayal(agent):
     return portrayal
 
 
-canvas_element = CanvasGrid(agent_portrayal, 50, 50, 600, 600)
-chart_element = ChartModule([{"Label": "Susceptible", "Color": "#FF0000"},
-                             {"Label": "Susceptible_with_mask", "Color": "#FFFF00"},
-                             {"Label": "Infected", "Color": "#99D500"},
-                             {"Label": "Recovered", "Color":"#0000FF"}])
+# One image per agent; only readable (and fast enough) on the default 50x50 board
+canvas_element = CanvasGrid(agent_portrayal, SIR.width, SIR.height, 600, 600)
+# One byte per cell, sized to the model's board, for boards of any size
+raster_element = HealthRasterModule(canvas_size=600, max_cells=200)
+chart_element = ChartModule([{"Label": "Susceptible", "Color": HEALTH_COLORS[0]},
+                             {"Label": "Susceptible_with_mask", "Color": HEALTH_COLORS[1]},
+                             {"Label": "Infected", "Color": HEALTH_COLORS[2]},
+                             {"Label": "Recovered", "Color": HEALTH_COLORS[3]}])
 
 model_params = {"verbose": UserSettableParameter('checkbox', "Verbose?", False),
                 "initial_susceptible": UserSettableParameter('slider', 'Initial Susceptible Population', 150, 0, 300),
@@ -58,6 +63,32 @@ model_params = {"verbose": UserSettableParameter('checkbox', "Verbose?", False),
                 "epsilon": UserSettableParameter('slider', "Population Decrease Rate", 15, 0, 50),
                 "alpha": UserSettableParameter('slider', "Population Increase Rate", 20, 0, 50),
                 "beta": UserSettableParameter('slider', "Infection Rate", 0, 1, 100),
-                "delta": UserSettableParameter('slider', "mortalty Rate", 5, 1, 15)}
+                "delta": UserSettableParameter('slider', "mortalty Rate", 5, 1, 15),
+                "width": UserSettableParameter('slider', "Board Width", SIR.width, 10, 1000, 10),
+                "height": UserSettableParameter('slider', "Board Height", SIR.height, 10, 1000, 10)}
 
-server = ModularServer(SIR, [canvas_element, chart_element], "Susceptible, Susceptible_with_mask, Infected, Recovered", model_params)
+server = ClientServer(SIR, [raster_element, chart_element], "Susceptible, Susceptible_with_mask, Infected, Recovered", model_params)
+
+
+def replay_server(path):
+    '''
+    A server playing back the recording in path (see trajectory.py). The
+    Start step slider seeks to any recorded step on Reset.
+    '''
+    reader = TrajectoryReader(path)
+    elements = [HealthRasterModule(canvas_size=600, max_cells=200), chart_element]
+    if reader.width * reader.height <= SIR.width * SIR.height:
+        elements.insert(0, CanvasGrid(agent_portrayal, reader.width, reader.height, 600, 600))
+    params = {"path": path,
+              "start": UserSettableParameter('slider', "Start step", 0, 0, int(reader.steps[-1]), reader.interval)}
+    return ClientServer(ReplayModel, elements, "Replay of " + path, params)
+
+
+def background_server(frame_rate=5.0, idle_timeout=1.0):
+    '''
+    The same model and sliders, with the model stepping in a background
+    thread and frames sampled at most frame_rate times a second (see background.py).
+    '''
+    elements = [HealthRasterModule(canvas_size=600, max_cells=200), ChartDeltaModule(chart_element.series)]
+    return BackgroundServer(SIR, elements, "Susceptible, Susceptible_with_mask, Infected, Recovered",
+                            model_params, frame_rate, idle_timeout)
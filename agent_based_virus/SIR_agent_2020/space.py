@@ -0,0 +1,219 @@
+'''
+MultiGrid that keeps track of where the infected agents are, so the agents
+can look up how many infected neighbors they have without scanning the cells
+around them, and that moves agents using precomputed neighborhood tables.
+'''
+
+import gc
+import itertools
+import random
+from contextlib import contextmanager
+
+from mesa.space import MultiGrid
+
+
+# Offsets of get_neighborhood(pos, moore, include_center=True), in its order
+NEIGHBOR_OFFSETS = {moore: tuple((dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                                 if moore or dx == 0 or dy == 0)
+                    for moore in (True, False)}
+
+
+@contextmanager
+def gc_paused():
+    '''
+    Switch off the cyclic garbage collector while building large numbers of
+    objects (cells, agents) that all stay alive, so it does not rescan them
+    over and over while they are made.
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class HealthGrid(MultiGrid):
+    '''
+    A MultiGrid which maintains, for every cell, the number of infected agents
+    in it and the number of infected agents in its Moore neighborhood (the
+    cell itself plus the 8 surrounding cells, wrapping around on a torus).
+
+    The counts are updated whenever an agent with sick set is placed, moved or
+    removed, so reading them is O(1):
+        grid.infected[x][y]         infected agents in cell (x, y)
+        grid.infected_nearby[x][y]  infected agents in the 3x3 block around it
+
+    Empty cells are tracked in a set instead of mesa's list so placing and
+    removing agents does not scan the whole board.
+
+    The coordinates of every cell's Moore and von Neumann neighborhoods are
+    precomputed per axis, so random_neighbor picks a cell without building
+    the neighborhood list. It draws the same random number as
+    random.choice(get_neighborhood(pos, moore, True)) and returns the same cell.
+    '''
+
+    def __init__(self, width, height, torus, rng=None):
+        # What MultiGrid.__init__ sets up, built in bulk: it calls default_val()
+        # once per cell, which took seconds on a 1000x1000 board
+        self.width = width
+        self.height = height
+        self.torus = torus
+        with gc_paused():
+            self.grid = [[set() for _ in range(height)] for _ in range(width)]
+            self.empties = set(itertools.product(range(width), range(height)))
+        self.random = rng if rng is not None else random.Random()
+        self.infected = [[0] * height for _ in range(width)]
+        self.infected_nearby = [[0] * height for _ in range(width)]
+        # Rows/columns touched by the 3x3 block around each coordinate
+        self._x_block = [self._block(x, width) for x in range(width)]
+        self._y_block = [self._block(y, height) for y in range(height)]
+        # moore -> (x -> neighbors' x, y -> neighbors' y), lined up with NEIGHBOR_OFFSETS.
+        # Neighborhoods that are cut off by an edge, or that wrap onto themselves
+        # on boards narrower than 3 cells, are looked up once and cached instead.
+        self._tables = None
+        self._neighborhoods = {}
+        if torus and width >= 3 and height >= 3:
+            self._tables = {moore: ([tuple((x + dx) % width for dx, _ in offsets) for x in range(width)],
+                                    [tuple((y + dy) % height for _, dy in offsets) for y in range(height)])
+                            for moore, offsets in NEIGHBOR_OFFSETS.items()}
+
+    def _block(self, i, length):
+        '''
+        Sorted coordinates within one cell of i along an axis of the given length.
+        '''
+        if self.torus:
+            return tuple(sorted({(i + d) % length for d in (-1, 0, 1)}))
+        return tuple(j for j in (i - 1, i, i + 1) if 0 <= j < length)
+
+    def _place_agent(self, pos, agent):
+        '''
+        Place the agent at the correct location.
+        '''
+        x, y = pos
+        self.grid[x][y].add(agent)
+        self.empties.discard(pos)
+        if agent.sick:
+            self.count_infected(pos, 1)
+
+    def _remove_agent(self, pos, agent):
+        '''
+        Remove the agent from the given location.
+        '''
+        x, y = pos
+        cell = self.grid[x][y]
+        cell.remove(agent)
+        if not cell:
+            self.empties.add(pos)
+        if agent.sick:
+            self.count_infected(pos, -1)
+
+    def place_agents(self, agents):
+        '''
+        Place many agents, each at its pos, in one pass. The same as calling
+        place_agent on each of them.
+        '''
+        cells = self.grid
+        for agent in agents:
+            x, y = agent.pos
+            cells[x][y].add(agent)
+        self.empties.difference_update([agent.pos for agent in agents])
+        for agent in agents:
+            if agent.sick:
+                self.count_infected(agent.pos, 1)
+
+    def move_agent(self, agent, pos):
+        '''
+        Move an agent from its current position to a new position. The same
+        as mesa's, with the cell updates inlined.
+        '''
+        x, y = old = agent.pos
+        cell = self.grid[x][y]
+        cell.remove(agent)
+        if not cell:
+            self.empties.add(old)
+        x, y = pos
+        self.grid[x][y].add(agent)
+        self.empties.discard(pos)
+        if agent.sick and pos != old:
+            self.count_infected(old, -1)
+            self.count_infected(pos, 1)
+        agent.pos = pos
+
+    def random_neighbor(self, pos, moore=True):
+        '''
+        A random cell of pos's neighborhood, the center included.
+        '''
+        x, y = pos
+        if self._tables is None:
+            key = (pos, moore)
+            cells = self._neighborhoods.get(key)
+            if cells is None:
+                cells = self._neighborhoods[key] = tuple(self.get_neighborhood(pos, moore, True))
+            return self.random.choice(cells)
+        columns, rows = self._tables[moore]
+        xs = columns[x]
+        i = self.random.randrange(len(xs)) # what random.choice draws for a list of that length
+        return xs[i], rows[y][i]
+
+    def move_agents(self, agents):
+        '''
+        Move each of the given agents, in order, to a random cell of its
+        neighborhood: the same moves, drawn from the same random numbers, as
+        calling random_move on each of them in turn, in one pass.
+        '''
+        if self._tables is None:
+            for agent in list(agents):
+                self.move_agent(agent, self.random_neighbor(agent.pos, agent.moore))
+            return
+        # random_neighbor and move_agent inlined, with everything bound to locals
+        randrange = self.random.randrange
+        tables = self._tables
+        cells = self.grid
+        empties = self.empties
+        count_infected = self.count_infected
+        for agent in list(agents):
+            x, y = old = agent.pos
+            columns, rows = tables[agent.moore]
+            xs = columns[x]
+            i = randrange(len(xs))
+            nx, ny = pos = xs[i], rows[y][i]
+            cell = cells[x][y]
+            cell.remove(agent)
+            if not cell:
+                empties.add(old)
+            cells[nx][ny].add(agent)
+            empties.discard(pos)
+            if agent.sick and pos != old:
+                count_infected(old, -1)
+                count_infected(pos, 1)
+            agent.pos = pos
+
+    def count_infected(self, pos, change):
+        '''
+        Add change to the infected count of a cell and of every neighborhood
+        that contains it.
+        '''
+        x, y = pos
+        self.infected[x][y] += change
+        y_block = self._y_block[y]
+        for nx in self._x_block[x]:
+            column = self.infected_nearby[nx]
+            for ny in y_block:
+                column[ny] += change
+
+    def is_cell_empty(self, pos):
+        '''
+        Returns a bool of the contents of a cell.
+        '''
+        x, y = pos
+        return not self.grid[x][y]
+
+    def find_empty(self):
+        '''
+        Pick a random empty cell.
+        '''
+        if self.exists_empty_cells():
+            return self.random.choice(sorted(self.empties))
+        return None
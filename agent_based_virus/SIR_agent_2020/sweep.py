@@ -0,0 +1,234 @@
+'''
+Headless parameter sweeps over the SIR rates.
+
+Every combination of a parameter grid is run for a number of replicates on a
+process pool. Each finished run is appended to one CSV file as soon as it
+completes, so an interrupted sweep can be resumed by running it again with the
+same grid and output file. A row the interruption cut short is dropped from
+the file and run again.
+
+Run from the agent_based_virus directory, e.g.
+
+    > python -m SIR_agent_2020.sweep grid.json results.csv --replicates 20
+
+where grid.json maps parameter names to a value or a list of values:
+
+    {"beta": [5, 10, 20], "gamma": [5, 10], "mask_fraction": [0, 0.5, 1]}
+'''
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from SIR_agent_2020.engines import open_model
+from SIR_agent_2020.rng import substream_seed
+from SIR_agent_2020.collector import HEALTH_LABELS
+
+
+# Parameters used for anything the grid does not set
+DEFAULT_PARAMS = {"initial_susceptible": 150,
+                  "initial_susceptible_with_mask": 150,
+                  "initial_infected": 150,
+                  "initial_recovered": 0,
+                  "gamma": 10,
+                  "beta": 10,
+                  "epsilon": 15,
+                  "alpha": 20,
+                  "delta": 5,
+                  "height": 50,
+                  "width": 50}
+
+SUMMARY_FIELDS = (["steps_run", "peak_infected", "peak_step", "extinction_step"]
+                  + ["final_" + label for label in HEALTH_LABELS]
+                  + ["seconds"])
+
+
+def expand_grid(grid):
+    '''
+    Turn a dict of parameter -> value or list of values into the list of
+    every combination.
+    '''
+    names = sorted(grid)
+    values = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def model_params(scenario):
+    '''
+    SIR constructor parameters for one scenario of expand_grid, filled in
+    with DEFAULT_PARAMS.
+
+    mask_fraction is not a model parameter: it splits the initial susceptible
+    population (masked plus unmasked) into a masked share.
+    '''
+    params = dict(DEFAULT_PARAMS)
+    params.update(scenario)
+    mask_fraction = params.pop("mask_fraction", None)
+    if mask_fraction is not None:
+        total = params["initial_susceptible"] + params["initial_susceptible_with_mask"]
+        params["initial_susceptible_with_mask"] = int(round(total * mask_fraction))
+        params["initial_susceptible"] = total - params["initial_susceptible_with_mask"]
+    return params
+
+
+def run_one(task):
+    '''
+    Run one replicate and summarize it. Runs in a worker process.
+    task: (scenario_id, replicate, seed, scenario, steps, engine)
+    '''
+    scenario_id, replicate, seed, scenario, steps, engine = task
+    start = time.perf_counter()
+    with open_model(engine, seed=seed, **model_params(scenario)) as model:
+        counts = model.health_counts()
+        peak_infected, peak_step, extinction_step = counts["Infected"], 0, None
+        steps_run = 0
+        while steps_run < steps and model.running:
+            model.step()
+            steps_run += 1
+            counts = model.health_counts()
+            if counts["Infected"] > peak_infected:
+                peak_infected, peak_step = counts["Infected"], steps_run
+            if counts["Infected"] == 0 and extinction_step is None:
+                extinction_step = steps_run
+
+    row = {"scenario": scenario_id, "replicate": replicate, "seed": seed}
+    row.update(scenario)
+    row.update({"steps_run": steps_run,
+                "peak_infected": peak_infected,
+                "peak_step": peak_step,
+                "extinction_step": "" if extinction_step is None else extinction_step,
+                "seconds": round(time.perf_counter() - start, 4)})
+    for label in HEALTH_LABELS:
+        row["final_" + label] = counts[label]
+    return row
+
+
+def completed_runs(path):
+    '''
+    (scenario, replicate) pairs already written to a results file.
+    '''
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="") as f:
+        return {(int(row["scenario"]), int(row["replicate"])) for row in csv.DictReader(f)}
+
+
+def _complete_lines_size(f, block=1 << 16):
+    '''
+    Bytes of the binary file f up to the end of its last complete line.
+    '''
+    end = f.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - block)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+def prepare_output(path, fields):
+    '''
+    Get a results file ready for a sweep with the given columns to append
+    to, returning whether it needs a header. A row cut short by an
+    interruption is removed, so that run is done again; a file holding a
+    sweep with other columns is refused rather than mixed with this one.
+    '''
+    if not os.path.exists(path):
+        return True
+    with open(path, "rb+") as f:
+        size = _complete_lines_size(f)
+        f.truncate(size)
+    if size == 0:
+        return True
+    with open(path, newline="") as f:
+        header = next(csv.reader(f))
+    if header != fields:
+        raise ValueError("{} holds a sweep with the columns {}, not {}; resume it with the same grid "
+                         "or write to another file".format(path, ",".join(header), ",".join(fields)))
+    return False
+
+
+def run_sweep(grid, path, replicates=10, steps=200, engine="agent", seed=0,
+              workers=None, chunk_size=None, shard=(0, 1)):
+    '''
+    Run every scenario of grid replicates times and append one summary row
+    per run to the CSV file at path as runs finish.
+    Parameters:
+        grid: dict, parameter -> value or list of values (see expand_grid)
+        path:str, CSV file to write; runs already in it are skipped (see prepare_output)
+        replicates:int, runs per scenario
+        steps:int, maximum steps per run (runs also stop when Infected reaches 0)
+        engine:str, engine name from engines.ENGINES
+        seed:int, sweep seed; each run's seed is the substream of it keyed by
+            (scenario, replicate), so resumed and sharded sweeps reproduce it
+        workers:int, number of worker processes (default: one per CPU)
+        chunk_size:int, most runs queued on the pool at once (default: 4 per worker)
+        shard: (index, count), only run the runs whose number % count == index,
+               to split one sweep over several machines
+    Returns the number of runs done by this call.
+    '''
+    scenarios = expand_grid(grid)
+    fields = ["scenario", "replicate", "seed"] + sorted({name for s in scenarios for name in s}) + SUMMARY_FIELDS
+    write_header = prepare_output(path, fields)
+    done = completed_runs(path)
+    shard_index, shard_count = shard
+    tasks = [(scenario_id, replicate, substream_seed(seed, scenario_id, replicate), scenario, steps, engine)
+             for scenario_id, scenario in enumerate(scenarios)
+             for replicate in range(replicates)
+             if (scenario_id * replicates + replicate) % shard_count == shard_index
+             and (scenario_id, replicate) not in done]
+
+    workers = workers or os.cpu_count() or 1
+    chunk_size = chunk_size or 4 * workers
+
+    finished = 0
+    with open(path, "a", newline="") as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        if write_header:
+            writer.writeheader()
+        queued = iter(tasks)
+        pending = set()
+        while True:
+            # Keep at most chunk_size runs queued so huge sweeps do not build
+            # millions of futures up front
+            for task in itertools.islice(queued, chunk_size - len(pending)):
+                pending.add(pool.submit(run_one, task))
+            if not pending:
+                break
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                writer.writerow(future.result())
+                finished += 1
+            f.flush()
+    return finished
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of the SIR model.")
+    parser.add_argument("grid", help="JSON file mapping parameters to a value or list of values")
+    parser.add_argument("output", help="CSV file to append results to (resumes if it exists)")
+    parser.add_argument("--replicates", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--engine", default="agent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--shard", default="0/1", help="INDEX/COUNT part of the sweep to run")
+    args = parser.parse_args(argv)
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+    shard = tuple(int(part) for part in args.shard.split("/"))
+    finished = run_sweep(grid, args.output, args.replicates, args.steps, args.engine,
+                         args.seed, args.workers, args.chunk_size, shard)
+    print("{} runs written to {}".format(finished, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+'''
+Recording every agent's position and health, and replaying the recording.
+
+The DataCollector series only hold the four health counts. A
+TrajectoryRecorder also keeps where every agent was and what health it had,
+every interval steps, in a directory of three files:
+
+    frames.bin   one packed 9 byte record (id, x, y, health) per agent per
+                 recorded step, frame after frame, each frame sorted by id
+    index.bin    one row of 7 int64 per frame: step, first record, number of
+                 records, and the S, M, I, R counts
+    meta.json    board size, engine and recording interval
+
+Both .bin files are only ever appended to. TrajectoryReader memory-maps
+frames.bin, so any frame is a slice found through the index and reading one
+frame of 10^6 agents only touches that frame's ~9MB of the file. ReplayModel
+steps through a recording like a model, for CanvasGrid, HealthRasterModule and
+ChartModule (see server.replay_server).
+
+Agents of the agent engine get ids in the order the recorder first sees them;
+the vectorized engine numbers its agents itself (VectorizedSIR.ids). The
+patch and decomposed engines have no individual agents to record.
+
+Record a run from the agent_based_virus directory with, e.g.
+
+    > python run_headless.py --engine vectorized --width 1000 --height 1000 --trajectory run.traj
+'''
+
+import itertools
+import json
+import operator
+import os
+import time
+
+import numpy as np
+from mesa import Model
+
+from SIR_agent_2020.agents import HEALTH_CLASSES
+from SIR_agent_2020.collector import HealthCollector, HEALTH_LABELS
+from SIR_agent_2020.space import HealthGrid, gc_paused
+
+
+# One agent in one frame
+RECORD = np.dtype([("id", "<u4"), ("x", "<u2"), ("y", "<u2"), ("health", "u1")])
+# Columns of index.bin
+INDEX_COLUMNS = ("step", "offset", "count") + HEALTH_LABELS
+
+MAX_ID = np.iinfo(RECORD["id"]).max
+MAX_SIDE = np.iinfo(RECORD["x"]).max + 1
+
+_pos = operator.attrgetter("pos")
+
+
+def _files(path):
+    return (os.path.join(path, "frames.bin"), os.path.join(path, "index.bin"),
+            os.path.join(path, "meta.json"))
+
+
+def _model_step(model):
+    '''
+    Number of steps the model has taken.
+    '''
+    schedule = getattr(model, "schedule", None)
+    return model.steps if schedule is None else schedule.steps
+
+
+class TrajectoryRecorder:
+    '''
+    Appends a frame of every agent's id, position and health to a recording
+    directory every interval steps, starting with the model's state when the
+    recorder is made. Pass it as run_model's progress callback:
+
+        with TrajectoryRecorder("run.traj", model, interval=5) as recorder:
+            model.run_model(200, progress=recorder)
+
+    A frame costs a few array operations per agent (plus building the arrays
+    from the agent objects on the agent engine); elapsed holds the time spent
+    recording, and a larger interval bounds it.
+    '''
+
+    def __init__(self, path, model, interval=1, buffer_size=1 << 22):
+        '''
+        parameters:
+            path:str, directory to record to; a previous recording in it is replaced
+            model: an agent or vectorized engine model
+            interval:int, steps between frames
+            buffer_size:int, bytes of frames buffered in memory between writes
+        '''
+        if not (hasattr(model, "ids") or hasattr(model, "schedule")):
+            raise ValueError("The {} engine has no individual agents to record".format(
+                type(model).__name__))
+        if max(model.width, model.height) > MAX_SIDE:
+            raise ValueError("Boards up to {0}x{0} can be recorded".format(MAX_SIDE))
+        if interval < 1:
+            raise ValueError("The recording interval must be at least 1 step")
+        self.path = path
+        self.interval = interval
+        self.frames = 0     # frames recorded
+        self.records = 0    # records in all frames
+        self.elapsed = 0.0  # seconds spent recording
+        self._ids = {}      # agent -> id, agent engine only
+        self._next_id = 0
+
+        os.makedirs(path, exist_ok=True)
+        frames, index, meta = _files(path)
+        with open(meta, "w") as f:
+            json.dump({"width": model.width, "height": model.height,
+                       "engine": type(model).__name__, "interval": interval,
+                       "record": RECORD.descr, "index": INDEX_COLUMNS}, f, indent=1)
+        self._frames = open(frames, "wb", buffering=buffer_size)
+        self._index = open(index, "wb")
+        self.record(model)
+
+    def __call__(self, model):
+        '''
+        Record the model if it is at a multiple of interval steps.
+        '''
+        if _model_step(model) % self.interval == 0:
+            self.record(model)
+
+    def _agents(self, model):
+        '''
+        ids, x, y and health codes of every agent of the model, as arrays.
+        '''
+        if hasattr(model, "ids"):
+            return model.ids, model.x, model.y, model.health
+        # Agent engine: go through the health buckets, so the codes come for free
+        known, fresh = self._ids, {}
+        ids, positions, sizes = [], [], []
+        for health in HEALTH_CLASSES:
+            agents = list(model.schedule.agents_by_health[health])
+            bucket_ids = list(map(known.get, agents))
+            for i, agent_id in enumerate(bucket_ids):
+                if agent_id is None:   # born (or added) since the last frame
+                    bucket_ids[i] = self._next_id
+                    self._next_id += 1
+            fresh.update(zip(agents, bucket_ids))
+            ids += bucket_ids
+            positions.append(map(_pos, agents))
+            sizes.append(len(agents))
+        self._ids = fresh   # forget the agents that have left
+        n = len(ids)
+        xy = np.fromiter(itertools.chain.from_iterable(itertools.chain(*positions)),
+                         dtype=np.int64, count=2 * n).reshape(n, 2)
+        health = np.repeat(np.arange(len(HEALTH_CLASSES), dtype=np.int8), sizes)
+        return np.array(ids, dtype=np.int64), xy[:, 0], xy[:, 1], health
+
+    def record(self, model):
+        '''
+        Append a frame of the model's current state.
+        '''
+        start = time.perf_counter()
+        ids, x, y, health = self._agents(model)
+        order = None
+        if len(ids) > 1 and (ids[1:] < ids[:-1]).any():
+            order = np.argsort(ids, kind="stable")
+        if len(ids) and ids.max() > MAX_ID:
+            raise ValueError("Agent ids above {} cannot be recorded".format(MAX_ID))
+        records = np.empty(len(ids), dtype=RECORD)
+        for field, values in zip(RECORD.names, (ids, x, y, health)):
+            records[field] = values if order is None else values[order]
+        self._frames.write(records.data)
+        counts = np.bincount(health, minlength=len(HEALTH_LABELS))
+        row = np.array([_model_step(model), self.records, len(records)] + counts.tolist(), dtype="<i8")
+        self._index.write(row.data)
+        self.frames += 1
+        self.records += len(records)
+        self.elapsed += time.perf_counter() - start
+
+    def flush(self):
+        '''
+        Write out the buffered frames, so readers see everything recorded so far.
+        '''
+        self._frames.flush()
+        self._index.flush()
+
+    def close(self):
+        if not self._frames.closed:
+            self._frames.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    '''
+    Random access to the frames of a recording. The index is read when the
+    reader is opened; frames are read from the memory-mapped frames.bin only
+    when they are used.
+    '''
+
+    def __init__(self, path):
+        '''
+        parameters:
+            path:str, directory written by a TrajectoryRecorder
+        '''
+        frames, index, meta = _files(path)
+        with open(meta) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.width = self.meta["width"]
+        self.height = self.meta["height"]
+        self.interval = self.meta["interval"]
+        self.index = np.fromfile(index, dtype="<i8")
+        self.index = self.index[:len(self.index) // len(INDEX_COLUMNS) * len(INDEX_COLUMNS)]
+        self.index = self.index.reshape(-1, len(INDEX_COLUMNS))
+        size = os.path.getsize(frames) // RECORD.itemsize
+        if size:
+            self.records = np.memmap(frames, dtype=RECORD, mode="r", shape=(size,))
+        else:
+            self.records = np.empty(0, dtype=RECORD)
+        # A recording that is still being written can have frames not flushed yet
+        self.index = self.index[self.index[:, 1] + self.index[:, 2] <= size]
+        self.steps = self.index[:, 0]
+        self.counts = self.index[:, 3:]   # (frames, 4) health counts
+
+    def __len__(self):
+        return len(self.index)
+
+    def position(self, step):
+        '''
+        Number of the last frame recorded at or before step.
+        '''
+        return max(0, int(np.searchsorted(self.steps, step, side="right")) - 1)
+
+    def frame(self, position):
+        '''
+        The records of frame number position, as a read-only view into the file.
+        '''
+        _, offset, count = self.index[position, :3]
+        return self.records[offset:offset + count]
+
+    def frame_at(self, step):
+        '''
+        The records of the last frame recorded at or before step.
+        '''
+        return self.frame(self.position(step))
+
+    def track(self, agent_id):
+        '''
+        Where one agent was, from the frames it is in: a (frames, 4) int64
+        array of step, x, y and health. Reads a few records of each frame.
+        '''
+        rows = []
+        for position, step in enumerate(self.steps.tolist()):
+            frame = self.frame(position)
+            i = int(np.searchsorted(frame["id"], agent_id))
+            if i < len(frame) and frame["id"][i] == agent_id:
+                record = frame[i]
+                rows.append((step, record["x"], record["y"], record["health"]))
+        return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+    def close(self):
+        '''
+        Drop the memory map; views of frames taken before stay valid.
+        '''
+        self.records = np.empty(0, dtype=RECORD)
+
+
+class ReplayModel(Model):
+    '''
+    Plays a recording back one frame per step, with the attributes the
+    visualization elements read from a model: grid (built from the frame when
+    it is first used), health_raster(), health_counts() and a datacollector
+    holding the counts up to the current frame.
+    '''
+
+    description = 'A replay of a recorded SIR run.'
+
+    def __init__(self, path, start=0):
+        '''
+        parameters:
+            path:str, directory written by a TrajectoryRecorder, or a TrajectoryReader
+            start:int, step to start from (the last frame at or before it)
+        '''
+        self.reader = TrajectoryReader(path) if isinstance(path, str) else path
+        self.width = self.reader.width
+        self.height = self.reader.height
+        self.seek(start)
+
+    def seek(self, step):
+        '''
+        Go to the last frame recorded at or before step.
+        '''
+        self.position = self.reader.position(step)
+        self.datacollector = HealthCollector()
+        self.datacollector.extend(self.reader.counts[:self.position + 1])
+        self._grid = None
+        self.running = self.position + 1 < len(self.reader)
+
+    @property
+    def steps(self):
+        '''
+        Model step of the current frame.
+        '''
+        return int(self.reader.steps[self.position])
+
+    def frame(self):
+        '''
+        The records of the current frame.
+        '''
+        return self.reader.frame(self.position)
+
+    def step(self):
+        '''
+        Go to the next frame.
+        '''
+        if self.position + 1 < len(self.reader):
+            self.position += 1
+            self._grid = None
+            self.datacollector.collect(self)
+        self.running = self.position + 1 < len(self.reader)
+
+    def run_model(self, step_count=200, progress=None):
+        '''
+        Play up to step_count frames, calling progress with the model after each.
+        '''
+        for _ in range(step_count):
+            if not self.running:
+                break
+            self.step()
+            if progress is not None:
+                progress(self)
+
+    def health_counts(self):
+        '''
+        Returns the number of agents of each health in the current frame, keyed by series name.
+        '''
+        return dict(zip(HEALTH_LABELS, self.reader.counts[self.position].tolist()))
+
+    def health_raster(self):
+        '''
+        Number of agents of each health in every cell, as an array of shape
+        (4, width, height) indexed [health code][x][y].
+        '''
+        frame = self.frame()
+        cells = self.width * self.height
+        index = (frame["health"].astype(np.int64) * cells + frame["x"].astype(np.int64) * self.height
+                 + frame["y"])
+        return np.bincount(index, minlength=len(HEALTH_CLASSES) * cells).reshape(
+            len(HEALTH_CLASSES), self.width, self.height)
+
+    @property
+    def grid(self):
+        '''
+        A HealthGrid holding one agent of the recorded health class per
+        record of the current frame, for CanvasGrid.
+        '''
+        if self._grid is None:
+            frame = self.frame()
+            grid = HealthGrid(self.width, self.height, torus=True)
+            with gc_paused():
+                agents = [HEALTH_CLASSES[code](agent_id, self, True)
+                          for agent_id, code in zip(frame["id"].tolist(), frame["health"].tolist())]
+                for agent, pos in zip(agents, zip(frame["x"].tolist(), frame["y"].tolist())):
+                    agent.pos = pos
+                grid.place_agents(agents)
+            self._grid = grid
+        return self._grid
@@ -0,0 +1,235 @@
+'''
+Array-backed SIR engine.
+
+Instead of one Python object per person, every agent is a row in a handful of
+NumPy arrays (x, y and a health code) and each step is a fixed number of
+batched array operations, so populations of 10^6 agents on 1000x1000 boards
+are practical.
+
+The rules are the ones in agents.py, applied to every agent at once against
+the state at the start of the step (after everyone has moved), rather than
+one agent at a time with each change visible to the agents activated after
+it. The two engines therefore agree statistically, not draw for draw.
+'''
+
+import numpy as np
+
+from SIR_agent_2020.collector import HealthCollector, HEALTH_LABELS
+from SIR_agent_2020.rng import new_seed, spawn_seeds
+from SIR_agent_2020.population import make_population, health_totals
+from SIR_agent_2020.zones import make_zones
+
+
+# Health codes stored in VectorizedSIR.health
+SUSCEPTIBLE = 0
+SUSCEPTIBLE_WITH_MASK = 1
+INFECTED = 2
+RECOVERED = 3
+
+# Moore neighborhood including the center, as used by RandomWalker.random_move
+MOORE_OFFSETS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+
+class VectorizedSIR:
+    '''
+    A susceptible, infected, and recovered model with the same parameters and
+    the same time series output as SIR, stored as NumPy arrays.
+    '''
+
+    height = 50 #starting height/width for the board
+    width = 50
+
+    description = 'A vectorized model for simulating sick, infected, and recovered individuals.'
+
+    def __init__(self,
+                 initial_susceptible,
+                 initial_infected,
+                 initial_recovered,
+                 initial_susceptible_with_mask,
+                 gamma,
+                 beta,
+                 epsilon,
+                 alpha,
+                 delta,
+                 height=height, width=width, verbose=False, seed=None,
+                 output=None, flush_interval=1000, zones=None, population=None,
+                 mask_factor=0.7):
+        '''
+        Create a new vectorized SIR model. Parameters are the same as for SIR.
+        parameters:
+            seed: int, seed for the model's numpy random generator (drawn if not given)
+        '''
+        self.height = height
+        self.width = width
+        self.initial_susceptible = initial_susceptible
+        self.initial_susceptible_with_mask = initial_susceptible_with_mask
+        self.initial_infected = initial_infected
+        self.initial_recovered = initial_recovered
+        self.beta = beta/100
+        self.gamma = gamma/100
+        self.epsilon = epsilon/100
+        self.alpha = alpha/100
+        self.delta = delta/100
+        self.mask_factor = mask_factor
+        self.verbose = verbose
+        self.zones = make_zones(zones, self.width, self.height)
+        self.infection_factor = self.zones.infection # indexed [x, y]
+        self.recovery_factor = self.zones.recovery
+        self.birth_factor = self.zones.birth
+        self.departure_factor = self.zones.departure
+        self.seed = seed if seed is not None else new_seed()
+        self.rng = np.random.default_rng(self.seed)
+        self.steps = 0
+
+        if population is None:
+            # Agents are created in the same order as SIR: susceptible, masked, infected, recovered
+            self.health = np.repeat(
+                np.array([SUSCEPTIBLE, SUSCEPTIBLE_WITH_MASK, INFECTED, RECOVERED], dtype=np.int8),
+                [initial_susceptible, initial_susceptible_with_mask, initial_infected, initial_recovered])
+            self.x = self.rng.integers(0, self.width, size=len(self.health))
+            self.y = self.rng.integers(0, self.height, size=len(self.health))
+        else:
+            self.x, self.y, self.health = make_population(population, self.width, self.height)
+            (self.initial_susceptible, self.initial_susceptible_with_mask,
+             self.initial_infected, self.initial_recovered) = health_totals(self.health)
+        # Every agent's id, for following it from step to step; newborns get new ones
+        self.ids = np.arange(len(self.health), dtype=np.int64)
+        self.next_id = len(self.health)
+        self._count()
+
+        self.datacollector = HealthCollector(output, flush_interval)
+
+        self.running = True
+        self.datacollector.collect(self) #stores the initial counts
+
+    def _count(self):
+        '''
+        Recount the number of agents of each health.
+        '''
+        self.counts = np.bincount(self.health, minlength=4)
+
+    def get_health_count(self, health):
+        '''
+        Returns the current number of agents with the given health code.
+        '''
+        return int(self.counts[health])
+
+    def spawn_seeds(self, count):
+        '''
+        Seeds of count independent random streams derived from this model's
+        seed, e.g. for replicates run in parallel.
+        '''
+        return spawn_seeds(self.seed, count)
+
+    def health_counts(self):
+        '''
+        Returns the current number of agents of each health, keyed by series name.
+        '''
+        return dict(zip(HEALTH_LABELS, self.counts.tolist()))
+
+    def infected_nearby(self):
+        '''
+        Number of infected agents in each cell's 3x3 neighborhood on the torus,
+        as a (width, height) array.
+        '''
+        sick = self.health == INFECTED
+        cells = np.bincount(self.x[sick] * self.height + self.y[sick],
+                            minlength=self.width * self.height)
+        cells = cells.reshape(self.width, self.height)
+        nearby = np.zeros_like(cells)
+        for dx, dy in MOORE_OFFSETS:
+            nearby += np.roll(cells, (dx, dy), axis=(0, 1))
+        return nearby
+
+    def _move(self, x, y):
+        '''
+        Move every given position one cell in a random Moore direction (or stay).
+        '''
+        offsets = MOORE_OFFSETS[self.rng.integers(0, len(MOORE_OFFSETS), size=len(x))]
+        return (x + offsets[:, 0]) % self.width, (y + offsets[:, 1]) % self.height
+
+    def step(self):
+        '''
+        Function to take one time step of our model
+        '''
+        self.x, self.y = self._move(self.x, self.y)
+        x, y, health = self.x, self.y, self.health
+        n = len(health)
+        nearby = self.infected_nearby()[x, y]
+        transition = self.rng.random(n)
+        leave = self.rng.random(n)
+        birth = self.rng.random(n)
+
+        susceptible = health == SUSCEPTIBLE
+        masked = health == SUSCEPTIBLE_WITH_MASK
+        sick = health == INFECTED
+        recovered = health == RECOVERED
+
+        # Susceptible (masked or not): infection, then departure unless infected
+        chance = self.beta * nearby * self.infection_factor[x, y] * np.where(masked, self.mask_factor, 1.0)
+        new_infected = (susceptible | masked) & (nearby > 0) & (transition < chance)
+        departure = self.departure_factor[x, y]
+        removed = (susceptible | masked) & ~new_infected & (leave < self.epsilon * departure)
+
+        # Infected: recovery, then death or departure unless recovered
+        new_recovered = sick & (transition < self.gamma * self.recovery_factor[x, y])
+        removed |= sick & ~new_recovered & (leave < (self.delta + self.epsilon) * departure)
+
+        # Recovered: departure, then reinfection if more than 3 infected nearby
+        recovered_leave = recovered & (leave < self.epsilon * departure)
+        removed |= recovered_leave
+        new_infected |= recovered & ~recovered_leave & (nearby > 3)
+
+        # Susceptible agents (masked or not) give birth to their own kind next to them
+        parents = np.flatnonzero((susceptible | masked) & (birth < self.alpha * self.birth_factor[x, y]))
+        born_x, born_y = self._move(x[parents], y[parents])
+        born_health = health[parents]
+
+        health = health.copy()
+        health[new_infected] = INFECTED
+        health[new_recovered] = RECOVERED
+        keep = ~removed
+        self.health = np.concatenate([health[keep], born_health])
+        self.x = np.concatenate([x[keep], born_x])
+        self.y = np.concatenate([y[keep], born_y])
+        self.ids = np.concatenate([self.ids[keep], np.arange(self.next_id, self.next_id + len(parents))])
+        self.next_id += len(parents)
+        self._count()
+        self.steps += 1
+        self.datacollector.collect(self) #stores the counts after this step
+
+        if self.verbose:
+            print([self.steps] + self.counts.tolist())
+
+        if self.counts[INFECTED] == 0: #if number of infected is equal to zero, stop running
+            self.running = False
+
+    def health_raster(self):
+        '''
+        Number of agents of each health in every cell, as an array of shape
+        (4, width, height) indexed [health code][x][y].
+        '''
+        cells = self.width * self.height
+        index = self.health.astype(np.int64) * cells + self.x * self.height + self.y
+        return np.bincount(index, minlength=4 * cells).reshape(4, self.width, self.height)
+
+    def run_model(self, step_count=200, progress=None):
+        '''
+        Function for running model. Stops early when there are no more infected.
+        Parameters:
+        step_count:int, maximum number of times the function will run
+        progress: callable, called with the model after every step
+        '''
+        if self.verbose:
+            print('Initial counts: ', dict(zip(HEALTH_LABELS, self.counts.tolist())))
+
+        for _ in range(step_count):
+            self.step() #calls the step function, which records the counts
+            if progress is not None:
+                progress(self)
+            if not self.running: #stops early once no one is infected
+                break
+        self.datacollector.flush()
+
+        if self.verbose:
+            print('Final counts: ', dict(zip(HEALTH_LABELS, self.counts.tolist())))
@@ -0,0 +1,144 @@
+'''
+Per-cell multipliers of the model's rates.
+
+Every engine multiplies the infection, recovery, birth and departure rates of
+an agent by the value of its cell in a (width, height) array. The arrays are
+built once when the model is created, so a step costs the same however
+detailed the map is.
+
+The default reproduces the original model: a high population density area
+(16 <= x, y <= 34) with 1.2 times the infection and 1.25 times the recovery
+rate, and 1 everywhere else. Other maps are loaded from a file with
+load_zones:
+
+    .npy   a (width, height) density map, or a (4, width, height) stack of the
+           infection, recovery, birth and departure multipliers
+    .npz   arrays named infection, recovery, birth and/or departure (missing
+           ones are 1)
+    image  (.png, .jpg, ..., needs Pillow) a grayscale density map, resized
+           to the board, with the top row of the image at the top of the board
+
+A density map d (0 to 1) gives every cell the original area's multipliers
+scaled by d: infection 1 + 0.2 d, recovery 1 + 0.25 d, birth and departure 1.
+'''
+
+import os
+
+import numpy as np
+
+
+FACTORS = ("infection", "recovery", "birth", "departure")
+
+# Multipliers of the original high population density area
+DENSE_MULTIPLIERS = {"infection": 1.2, "recovery": 1.25, "birth": 1.0, "departure": 1.0}
+
+
+class Zones:
+    '''
+    The four (width, height) multiplier arrays, indexed [x][y] like the grid.
+    '''
+
+    def __init__(self, infection=None, recovery=None, birth=None, departure=None, shape=None):
+        '''
+        parameters:
+            infection, recovery, birth, departure: (width, height) arrays;
+                any left as None are 1 everywhere
+            shape: (width, height), needed only if no array is given
+        '''
+        given = [array for array in (infection, recovery, birth, departure) if array is not None]
+        if shape is None:
+            if not given:
+                raise ValueError("Zones needs at least one array or a shape")
+            shape = np.shape(given[0])
+        self.shape = tuple(shape)
+        for name, array in zip(FACTORS, (infection, recovery, birth, departure)):
+            array = np.ones(self.shape) if array is None else np.asarray(array, dtype=float)
+            if array.shape != self.shape:
+                raise ValueError("The {} multipliers have shape {}, expected {}".format(
+                    name, array.shape, self.shape))
+            if (array < 0).any():
+                raise ValueError("The {} multipliers must not be negative".format(name))
+            setattr(self, name, array)
+
+    @classmethod
+    def from_density(cls, density):
+        '''
+        Multipliers of a density map (0 to 1), scaling those of the original
+        high population density area.
+        '''
+        density = np.asarray(density, dtype=float)
+        return cls(**{name: 1 + density * (DENSE_MULTIPLIERS[name] - 1) for name in FACTORS})
+
+    def stack(self):
+        '''
+        The four arrays as one (4, width, height) array, in FACTORS order.
+        '''
+        return np.stack([getattr(self, name) for name in FACTORS])
+
+    def lists(self):
+        '''
+        The four arrays as lists of lists, which the agents index faster
+        than NumPy arrays.
+        '''
+        return {name: getattr(self, name).tolist() for name in FACTORS}
+
+
+def default_zones(width, height):
+    '''
+    The original model's zones: the high population density area, cut off
+    by the edges of boards smaller than 35 x 35.
+    '''
+    zones = Zones(shape=(width, height))
+    for name in FACTORS:
+        getattr(zones, name)[16:35, 16:35] = DENSE_MULTIPLIERS[name]
+    return zones
+
+
+def _load_image(path, width, height):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("Loading zones from an image needs Pillow")
+    image = Image.open(path).convert("L").resize((width, height), Image.NEAREST)
+    # Image rows run top to bottom; the board's y runs bottom to top
+    return np.asarray(image, dtype=float)[::-1].T / 255
+
+
+def load_zones(path, width, height):
+    '''
+    Read the zones of a width x height board from a .npy, .npz or image file.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        array = np.load(path)
+        if array.ndim == 3 and len(array) == len(FACTORS):
+            zones = Zones(*array)
+        else:
+            zones = Zones.from_density(array)
+    elif extension == ".npz":
+        with np.load(path) as data:
+            unknown = set(data.files) - set(FACTORS)
+            if unknown:
+                raise ValueError("Unknown zone arrays in {}: {}".format(path, ", ".join(sorted(unknown))))
+            zones = Zones(shape=(width, height), **{name: data[name] for name in data.files})
+    else:
+        zones = Zones.from_density(_load_image(path, width, height))
+    if zones.shape != (width, height):
+        raise ValueError("Zones in {} are {}x{}, the board is {}x{}".format(
+            path, zones.shape[0], zones.shape[1], width, height))
+    return zones
+
+
+def make_zones(zones, width, height):
+    '''
+    The Zones for a model's zones parameter: None for the default, a path to
+    load, or a Zones object (checked against the board).
+    '''
+    if zones is None:
+        return default_zones(width, height)
+    if isinstance(zones, str):
+        return load_zones(zones, width, height)
+    if zones.shape != (width, height):
+        raise ValueError("Zones are {}x{}, the board is {}x{}".format(
+            zones.shape[0], zones.shape[1], width, height))
+    return zones
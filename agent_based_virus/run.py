@@ -1,5 +1,21 @@
+import argparse
+
 ##Pulls in the server.py file from the SIR_agent directory
-from SIR_agent_2020.server import server
+from SIR_agent_2020.server import server, replay_server, background_server
+
+parser = argparse.ArgumentParser(description="Launch the interactive visualization.")
+parser.add_argument("replay", nargs="?",
+                    help="recording directory to play back instead (see SIR_agent_2020/trajectory.py)")
+parser.add_argument("--background", action="store_true",
+                    help="step the model in a background thread and sample frames from it")
+parser.add_argument("--frame-rate", type=float, default=5.0,
+                    help="most frames per second sampled with --background")
+args = parser.parse_args()
+
+if args.replay:
+    server = replay_server(args.replay)
+elif args.background:
+    server = background_server(args.frame_rate)
 
 ##Launches the server and produces interactive visualization
 server.launch()
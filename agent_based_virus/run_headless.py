@@ -0,0 +1,5 @@
+##Pulls in the command-line runner from the SIR_agent directory
+from SIR_agent_2020.headless import main
+
+##Runs the model without the visualization, options are given on the command line
+main()
@@ -0,0 +1,63 @@
+'''
+Tests of the background model runner behind the visualization server.
+'''
+
+import time
+
+import pytest
+
+try:
+    import mesa.visualization.ModularVisualization
+except Exception as error: # the mesa server needs a tornado that imports on this Python
+    pytest.skip("mesa's visualization server cannot be imported: {}".format(error), allow_module_level=True)
+
+from SIR_agent_2020.background import ModelRunner
+from SIR_agent_2020.engines import make_model
+
+
+# Everyone recovers within a few hundred steps, so the run ends by itself
+PARAMS = dict(initial_susceptible=50, initial_susceptible_with_mask=50, initial_infected=10,
+              initial_recovered=0, gamma=3, beta=1, epsilon=0, alpha=0, delta=0, width=20, height=20)
+
+
+def test_every_client_gets_every_step_once():
+    model = make_model("vectorized", seed=2, **PARAMS)
+    runner = ModelRunner(model, frame_rate=200.0, idle_timeout=10.0)
+    runner.open("first")
+    runner.open("second")
+    steps = {"first": [], "second": []}
+    samples = {"first": 0, "second": 0}
+    deadline = time.monotonic() + 60
+    requests = 0
+    while not runner.finished and time.monotonic() < deadline:
+        runner.resume()
+        # The second tab asks for a frame a third as often as the first
+        for client in ("first", "second") if requests % 3 == 0 else ("first",):
+            sample = runner.take(client)
+            if sample is not None:
+                steps[client] += [step for step, _ in sample[2]]
+                samples[client] += 1
+        requests += 1
+        time.sleep(0.002)
+    runner.stop()
+    assert runner.finished and runner.error is None
+    for client in steps:
+        sample = runner.take(client)
+        if sample is not None:
+            steps[client] += [step for step, _ in sample[2]]
+        assert steps[client] == list(range(runner.steps + 1))
+    assert min(samples.values()) > 1 # the steps came in several frames
+
+
+def test_closed_client_does_not_hold_counts():
+    model = make_model("vectorized", seed=2, **PARAMS)
+    runner = ModelRunner(model, idle_timeout=10.0)
+    runner.open("watching")
+    runner.open("gone")
+    runner.resume()
+    while not runner.finished:
+        time.sleep(0.01)
+    runner.take("watching")
+    assert len(runner._rows) == runner.steps + 1 # "gone" has not been sent any yet
+    runner.close("gone")
+    assert runner._rows == []
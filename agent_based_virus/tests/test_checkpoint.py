@@ -0,0 +1,62 @@
+'''
+Tests of model checkpoints.
+'''
+
+import numpy as np
+
+from SIR_agent_2020 import checkpoint
+from SIR_agent_2020.checkpoint import load_checkpoint, restore, save_checkpoint, snapshot
+from SIR_agent_2020.model import SIR
+
+
+def _model():
+    return SIR(initial_susceptible=150, initial_infected=20, initial_recovered=0,
+               initial_susceptible_with_mask=150, gamma=5, beta=10, epsilon=2, alpha=2, delta=1,
+               height=20, width=20, seed=7)
+
+
+def _assert_same_state(first, second):
+    a, b = snapshot(first), snapshot(second)
+    assert sorted(a) == sorted(b)
+    for name in a:
+        assert np.array_equal(a[name], b[name]), name
+
+
+def test_saved_checkpoint_carries_on_like_the_uninterrupted_run(tmp_path):
+    model = _model()
+    model.run_model(10)
+    path = str(tmp_path / "run.npz")
+    save_checkpoint(model, path)
+    assert not any(array.dtype == object for array in load_checkpoint(path).values())
+
+    restored = restore(path)
+    _assert_same_state(model, restored)
+    model.run_model(20)
+    restored.run_model(20)
+    _assert_same_state(model, restored)
+    assert model.datacollector.get_model_vars_dataframe().equals(
+        restored.datacollector.get_model_vars_dataframe())
+
+
+def test_checkpoint_keeps_a_pending_gaussian():
+    model = _model()
+    model.run_model(5)
+    model.random.gauss(0, 1) # leaves the second value of the pair for the next call
+    restored = SIR.restore(model.checkpoint())
+    assert model.random.gauss(0, 1) == restored.random.gauss(0, 1)
+    assert model.random.random() == restored.random.random()
+
+
+def test_checkpoint_to_a_file_returns_what_it_saved(tmp_path, monkeypatch):
+    model = _model()
+    model.run_model(5)
+    taken = []
+    original = checkpoint.snapshot
+    monkeypatch.setattr(checkpoint, "snapshot", lambda model: taken.append(1) or original(model))
+    path = str(tmp_path / "run.npz")
+    state = model.checkpoint(path)
+    assert len(taken) == 1 # the model is captured once, for both the file and the result
+    saved = load_checkpoint(path)
+    assert sorted(saved) == sorted(state)
+    for name in state:
+        assert np.array_equal(saved[name], state[name]), name
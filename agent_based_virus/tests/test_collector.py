@@ -0,0 +1,48 @@
+'''
+Tests of the health series collector.
+'''
+
+import numpy as np
+import pytest
+
+from SIR_agent_2020.collector import HealthCollector, HEALTH_LABELS
+
+
+class Counter:
+    '''
+    Stands in for a model: every call to health_counts gives new counts.
+    '''
+
+    def __init__(self):
+        self.calls = 0
+
+    def health_counts(self):
+        self.calls += 1
+        return {label: (i + 1) * self.calls for i, label in enumerate(HEALTH_LABELS)}
+
+
+@pytest.mark.parametrize("name", [None, "series.csv", "series.ndjson"])
+def test_model_vars_hold_the_whole_history(tmp_path, name):
+    collector = HealthCollector(None if name is None else str(tmp_path / name), flush_interval=7)
+    model = Counter()
+    for _ in range(20):
+        collector.collect(model)
+    collector.extend([[100, 200, 300, 400]] * 3)
+    for _ in range(5):
+        collector.collect(model)
+    history = collector.history()
+    assert history.shape == (28, 4)
+    for i, label in enumerate(HEALTH_LABELS):
+        series = collector.model_vars[label]
+        assert len(series) == 28
+        assert list(series) == history[:, i].tolist()
+        assert [series[step] for step in range(-28, 28)] == history[:, i].tolist() * 2
+        assert series[3:9] == history[3:9, i].tolist()
+        assert series[-1] == (i + 1) * model.calls
+    with pytest.raises(IndexError):
+        collector.model_vars["Infected"][28]
+
+
+def test_flush_interval_below_one_is_refused():
+    with pytest.raises(ValueError):
+        HealthCollector(flush_interval=0)
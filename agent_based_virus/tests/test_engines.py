@@ -0,0 +1,46 @@
+'''
+Tests of the interchangeable engines.
+'''
+
+import contextlib
+
+import pytest
+
+from SIR_agent_2020.engines import ENGINES, compare_engines, open_model
+
+
+SCENARIOS = {
+    # The infection dies out, most people are still susceptible at the end
+    "contained": dict(initial_susceptible=200, initial_susceptible_with_mask=200, initial_infected=20,
+                      initial_recovered=0, gamma=10, beta=2, epsilon=2, alpha=2, delta=1,
+                      width=30, height=30),
+    # Everyone is infected within a few steps
+    "epidemic": dict(initial_susceptible=200, initial_susceptible_with_mask=200, initial_infected=20,
+                     initial_recovered=0, gamma=5, beta=10, epsilon=2, alpha=2, delta=1,
+                     width=20, height=20),
+}
+
+
+@pytest.mark.parametrize("scenario", sorted(SCENARIOS))
+def test_vectorized_engine_matches_agent_engine(scenario):
+    result = compare_engines(SCENARIOS[scenario], steps=30, replicates=8, seed=0,
+                             engines=("agent", "vectorized"))
+    for metric, (agent_mean, vectorized_mean, z) in result.items():
+        assert abs(z) <= 3, "{}: {} on the agent engine, {} vectorized (z = {:.2f})".format(
+            metric, agent_mean, vectorized_mean, z)
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_seeded_runs_are_reproducible(engine):
+    params = SCENARIOS["epidemic"]
+    with contextlib.ExitStack() as stack:
+        models = [stack.enter_context(open_model(engine, seed=seed, **params)) for seed in (4, 4, 5)]
+        # Stepped in turn, so models sharing a random generator would drift apart
+        for _ in range(30):
+            for model in models:
+                if model.running:
+                    model.step()
+        same, again, other = (model.datacollector.get_model_vars_dataframe() for model in models)
+    assert len(same) > 1
+    assert same.equals(again)
+    assert not same.equals(other)
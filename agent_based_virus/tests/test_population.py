@@ -0,0 +1,54 @@
+'''
+Tests of the explicit initial populations.
+'''
+
+import numpy as np
+import pytest
+
+from SIR_agent_2020.population import make_population, population_from_raster
+
+
+def test_arrays_rows_and_raster_give_the_same_agents():
+    x, y, health = np.array([0, 4, 2]), np.array([1, 0, 3]), np.array([2, 0, 3])
+    raster = np.zeros((4, 5, 4), dtype=np.int64)
+    raster[health, x, y] = 1
+    from_arrays = make_population((x, y, health), 5, 4)
+    from_rows = make_population(np.column_stack([x, y, health]), 5, 4)
+    from_raster = make_population(raster, 5, 4)
+    for population in (from_arrays, from_rows):
+        assert [array.tolist() for array in population] == [x.tolist(), y.tolist(), health.tolist()]
+    # The raster gives the same agents, ordered by health
+    assert sorted(zip(*(array.tolist() for array in from_raster))) == sorted(zip(x.tolist(), y.tolist(), health.tolist()))
+
+
+def test_population_from_raster_counts():
+    raster = np.zeros((4, 3, 3), dtype=np.int64)
+    raster[2, 1, 1] = 3
+    x, y, health = population_from_raster(raster)
+    assert x.tolist() == [1, 1, 1] and y.tolist() == [1, 1, 1] and health.tolist() == [2, 2, 2]
+
+
+@pytest.mark.parametrize("shape", [(5, 5), (7,), (3, 5, 5), (2, 4), (4, 5, 5, 1)])
+def test_array_of_another_shape_is_refused(shape):
+    with pytest.raises(ValueError, match="shape"):
+        make_population(np.zeros(shape, dtype=np.int64), 5, 5)
+
+
+def test_raster_of_another_board_is_refused():
+    with pytest.raises(ValueError, match="board"):
+        make_population(np.zeros((4, 6, 5), dtype=np.int64), 5, 5)
+
+
+@pytest.mark.parametrize("x, y", [(5, 0), (0, 5), (-1, 0), (0, -1)])
+def test_agents_off_the_board_are_refused(x, y):
+    with pytest.raises(ValueError, match="outside"):
+        make_population(([x], [y], [0]), 5, 5)
+
+
+def test_bad_health_codes_and_lengths_are_refused():
+    with pytest.raises(ValueError, match="Health codes"):
+        make_population(([0], [0], [4]), 5, 5)
+    with pytest.raises(ValueError, match="length"):
+        make_population(([0, 1], [0], [0]), 5, 5)
+    with pytest.raises(ValueError, match="negative"):
+        population_from_raster(-np.ones((4, 2, 2)))
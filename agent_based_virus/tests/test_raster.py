@@ -0,0 +1,69 @@
+'''
+Tests of the raster view of the board. Run from the agent_based_virus
+directory with
+
+    > python -m pytest tests
+'''
+
+import base64
+
+import numpy as np
+import pytest
+
+try:
+    import mesa.visualization.ModularVisualization
+except Exception as error: # the mesa server needs a tornado that imports on this Python
+    pytest.skip("mesa's visualization server cannot be imported: {}".format(error), allow_module_level=True)
+
+from SIR_agent_2020.engines import make_model
+from SIR_agent_2020.raster import HealthRasterModule, downsample, encode_cells
+
+
+# Sparse enough that most frames only carry the changed cells
+PARAMS = dict(initial_susceptible=40, initial_susceptible_with_mask=40, initial_infected=10,
+              initial_recovered=0, gamma=5, beta=10, epsilon=2, alpha=2, delta=1, width=60, height=60)
+
+
+def _decode(text, dtype=np.uint8):
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+
+class Canvas:
+    '''
+    What HealthRasterModule.js keeps of the frames it is sent.
+    '''
+
+    def __init__(self):
+        self.cells = None
+
+    def draw(self, frame):
+        if "cells" in frame:
+            self.cells = _decode(frame["cells"]).copy()
+        elif self.cells is not None:
+            self.cells[_decode(frame["index"], "<u4")] = _decode(frame["values"])
+
+
+def test_interleaved_clients_each_rebuild_the_raster():
+    model = make_model("vectorized", seed=3, **PARAMS)
+    element = HealthRasterModule(max_cells=200, keyframe_interval=50)
+    clients = {"first": Canvas(), "second": Canvas()}
+    deltas = 0
+    for step in range(20):
+        model.step()
+        # Each tab asks for a frame after a different number of steps
+        for name in ("first", "second") if step % 3 else ("first",):
+            frame = element.render(model, name)
+            deltas += "cells" not in frame
+            clients[name].draw(frame)
+            truth = encode_cells(downsample(model.health_raster(), element.max_cells)).ravel()
+            assert np.array_equal(clients[name].cells, truth)
+    assert deltas > 0 # the changed-cells frames were exercised
+
+
+def test_forgotten_client_gets_a_complete_frame():
+    model = make_model("vectorized", seed=3, **PARAMS)
+    element = HealthRasterModule()
+    element.render(model, "tab")
+    model.step()
+    element.forget("tab")
+    assert "cells" in element.render(model, "tab")
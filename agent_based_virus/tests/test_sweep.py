@@ -0,0 +1,48 @@
+'''
+Tests of resuming parameter sweeps.
+'''
+
+import pandas as pd
+import pytest
+
+from SIR_agent_2020.sweep import run_sweep
+
+
+GRID = {"beta": [5, 20], "width": 10, "height": 10, "initial_susceptible": 30,
+        "initial_susceptible_with_mask": 30, "initial_infected": 5}
+
+
+def _sweep(path, grid=GRID):
+    return run_sweep(grid, str(path), replicates=2, steps=5, engine="vectorized", workers=1)
+
+
+@pytest.mark.parametrize("cut", [1, 5, 20])
+def test_resume_drops_a_row_cut_short(tmp_path, cut):
+    path = tmp_path / "results.csv"
+    assert _sweep(path) == 4
+    complete = pd.read_csv(path)
+    text = path.read_bytes()
+    # Interrupted while writing the last row, possibly inside its seconds value
+    path.write_bytes(text[:text.rindex(b"\n", 0, len(text) - 1) + 1 + cut])
+    assert _sweep(path) == 1 # the cut row is removed and run again
+    resumed = pd.read_csv(path)
+    # extinction_step is empty for runs where the infection never died out
+    assert len(resumed) == 4 and not resumed.drop(columns="extinction_step").isna().any().any()
+    columns = ["scenario", "replicate", "seed", "peak_infected", "final_Infected"]
+    assert (resumed.sort_values(["scenario", "replicate"])[columns].values
+            == complete.sort_values(["scenario", "replicate"])[columns].values).all()
+
+
+def test_resume_with_another_grid_is_refused(tmp_path):
+    path = tmp_path / "results.csv"
+    _sweep(path)
+    with pytest.raises(ValueError, match="columns"):
+        _sweep(path, dict(GRID, gamma=[5, 10]))
+    assert len(pd.read_csv(path)) == 4
+
+
+def test_cut_header_is_written_again(tmp_path):
+    path = tmp_path / "results.csv"
+    path.write_text("scenario,repli")
+    assert _sweep(path) == 4
+    assert len(pd.read_csv(path)) == 4